@@ -1,31 +1,14 @@
 import falcon
 from .status_resource import StatusResource
-from .camera_process_resource import CameraProcessResource
+from .camera_process_resource import CameraProcessResource, DEFAULT_MAX_EVENT_WAITERS
 from .zwo_camera import ZwoCamera
 from .app_utils import add_log, DefaultServerTransactionIDGenerator
-from .camera_process import camera_process, CameraProcessInfo, CameraProcessHandle
+from .camera_process import create_camera_process
+from .array_trigger import ArrayTrigger
+from .array_resource import ArrayResource
+from .property_mirror import DEFAULT_MIRROR_MAX_AGE_S
 
-from multiprocessing import Event, Queue, Process, Pipe
-
-
-def create_camera_process(cid: int, cname: str):
-    kill_event = Event()
-    command_queue = Queue()
-    result_queue = Queue()
-    data_pipe_recv, data_pipe_send = Pipe()
-
-    info = CameraProcessInfo(cid=cid,
-                             command=command_queue,
-                             result=result_queue,
-                             data=data_pipe_send,
-                             ke=kill_event)
-    p = Process(target=camera_process, args=(info,))
-    p.start()
-
-    return CameraProcessHandle(info, p, cname,
-                               result_queue=result_queue,
-                               command_queue=command_queue,
-                               data_pipe=data_pipe_recv)
+import os
 
 
 log = add_log("main")
@@ -35,13 +18,21 @@ ZwoCamera.initialize_library()
 cameras = ZwoCamera.get_cameras_list()
 
 
-camera_processes = {cid: create_camera_process(cid, cname) for cid, cname in enumerate(cameras)}
+# shared by camera processes, so that array capture starts exposures of all cameras together:
+array_trigger = ArrayTrigger()
+camera_processes = {cid: create_camera_process(cid, cname, array_trigger) for cid, cname in enumerate(cameras)}
 
 app = application = falcon.App()
 
 
 server_transaction_id_generator = DefaultServerTransactionIDGenerator()
-camera_resource = CameraProcessResource(camera_processes, server_transaction_id_generator)
+mirror_max_age_s = float(os.environ.get("REMOTEARRAY_MIRROR_MAX_AGE", DEFAULT_MIRROR_MAX_AGE_S))
+# event streams and waits for image take a server thread each, the rest is left for other requests:
+max_event_waiters = int(os.environ.get("REMOTEARRAY_MAX_EVENT_WAITERS", DEFAULT_MAX_EVENT_WAITERS))
+camera_resource = CameraProcessResource(camera_processes, server_transaction_id_generator, mirror_max_age_s,
+                                        max_event_waiters)
 
 app.add_route("/api/v1/status", StatusResource())
 app.add_route("/api/v1/camera/{camera_id}/{setting_name}", camera_resource)
+app.add_route("/api/v1/array/{setting_name}",
+              ArrayResource(camera_processes, server_transaction_id_generator, array_trigger))
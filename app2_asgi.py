@@ -0,0 +1,35 @@
+import falcon.asgi
+from .status_resource import AsyncStatusResource
+from .camera_process_resource_asgi import AsyncCameraProcessResource
+from .zwo_camera import ZwoCamera
+from .app_utils import add_log, DefaultServerTransactionIDGenerator
+from .camera_process import create_camera_process
+from .array_trigger import ArrayTrigger
+from .array_resource import AsyncArrayResource
+from .property_mirror import DEFAULT_MIRROR_MAX_AGE_S
+
+import os
+
+
+log = add_log("main")
+
+
+ZwoCamera.initialize_library()
+cameras = ZwoCamera.get_cameras_list()
+
+
+# shared by camera processes, so that array capture starts exposures of all cameras together:
+array_trigger = ArrayTrigger()
+camera_processes = {cid: create_camera_process(cid, cname, array_trigger) for cid, cname in enumerate(cameras)}
+
+app = application = falcon.asgi.App()
+
+
+server_transaction_id_generator = DefaultServerTransactionIDGenerator()
+mirror_max_age_s = float(os.environ.get("REMOTEARRAY_MIRROR_MAX_AGE", DEFAULT_MIRROR_MAX_AGE_S))
+camera_resource = AsyncCameraProcessResource(camera_processes, server_transaction_id_generator, mirror_max_age_s)
+
+app.add_route("/api/v1/status", AsyncStatusResource())
+app.add_route("/api/v1/camera/{camera_id}/{setting_name}", camera_resource)
+app.add_route("/api/v1/array/{setting_name}",
+              AsyncArrayResource(camera_processes, server_transaction_id_generator, array_trigger))
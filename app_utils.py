@@ -3,6 +3,15 @@ import os
 import logging
 
 
+def parse_bool(value):
+    """
+    Boolean param as given in JSON or in form: strings "false" and "0" (any case) are False, unlike with bool().
+    """
+    if isinstance(value, str):
+        return value.strip().lower() in ("true", "1")
+    return bool(value)
+
+
 def add_log(name):
     log = logging.getLogger(name)
     log.setLevel(logging.DEBUG)
@@ -20,9 +29,14 @@ class DefaultCaptureFilenameGenerator:
         self._number = 0
         self._prefix = prefix
 
-    def generate(self):
+    def generate(self, extension="tif", subdir=None):
+        """
+        :param subdir: relative directory inside capture directory of current day
+        """
         current_day = datetime.now().strftime("%Y-%m-%d")
         new_dir = os.path.join(os.getcwd(), "capture", current_day)
+        if subdir:
+            new_dir = os.path.join(new_dir, subdir)
 
         if self._last_dir is None or (self._last_dir != new_dir):
             self._last_dir = new_dir
@@ -30,7 +44,7 @@ class DefaultCaptureFilenameGenerator:
                 os.makedirs(self._last_dir)
 
         dt_string = datetime.now().strftime("_%Y%m%d_%H%M%S")
-        fn = self._prefix + dt_string + "_Capture_{0:05d}.tif".format(self._number)
+        fn = self._prefix + dt_string + "_Capture_{0:05d}.{1}".format(self._number, extension)
         fp = os.path.join(self._last_dir, fn)
         self._number += 1
         return fp
@@ -0,0 +1,269 @@
+from .camera_process import CameraProcessHandle, BUSY_TOKEN, DONE_TOKEN
+from .camera_process_resource import CameraProcessResource
+from .camera_server_utils import CameraSimplePUTCommand, create_ascom_response_dict, split_client_and_transaction_id
+from .camera_events import EVENT_TRIGGER, EVENT_TRIGGER_END
+from .array_trigger import ArrayTrigger
+from .request_routing import DEFAULT_RESULT_TIMEOUT_S
+from .utils import add_timestamp_before, add_timestamp_after, add_timestamp_before_async, add_timestamp_after_async
+
+import falcon
+import falcon.asgi
+import asyncio
+import logging
+import json
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError, wait, FIRST_COMPLETED
+from itertools import count
+from threading import Thread, Lock, Condition
+from traceback import format_exc
+
+
+log = logging.getLogger('main')
+
+
+def parse_cameras(value):
+    """
+    :param value: list of camera numbers (JSON body) or comma separated string of them (form), None for all
+    :return: list of camera numbers, empty if none given
+    :raise ValueError: when value is neither
+    """
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = [c for c in value.split(",") if c.strip()]
+    if not isinstance(value, list):
+        raise ValueError(f"Cameras has to be a list or comma separated numbers, got {value!r}")
+    return [int(c) for c in value]
+
+
+class ArrayCaptureJob:
+    """
+    Array capture as one job: collects start times of exposures of its cameras (from their trigger events)
+    and tells skew of each camera against the first one to start, frame by frame. Events are taken on background
+    thread, which unsubscribes from a camera as soon as it reports end of its part of the job.
+    """
+    def __init__(self, job_id, handles: dict, number):
+        self.job_id = job_id
+        self._handles = handles
+        self._number = number
+        self._condition = Condition()
+        self._starts = {}
+        self._running = set(handles.keys())
+        self._errors = {}
+        self._closed = False
+        # subscribed before cameras are armed, so that no start is missed:
+        self._streams = {cid: handle.events.subscribe() for cid, handle in handles.items()}
+        self._thread = Thread(target=self._collect, daemon=True)
+        self._thread.start()
+
+    def _collect(self):
+        futures = {stream.next(): cid for cid, stream in self._streams.items()}
+        while futures:
+            done, _ = wait(futures.keys(), return_when=FIRST_COMPLETED)
+            for future in done:
+                cid = futures.pop(future)
+                event = future.result()
+                if event is None:
+                    continue  # job closed
+                if self._record(cid, event):
+                    futures[self._streams[cid].next()] = cid
+                else:
+                    self._handles[cid].events.unsubscribe(self._streams[cid])
+
+    def _record(self, cid, event):
+        """
+        :return: False when camera has finished its part of the job, so that no more events are needed from it
+        """
+        if event.get("Job") != self.job_id:
+            return True
+        with self._condition:
+            if event["Event"] == EVENT_TRIGGER:
+                self._starts.setdefault(event["Frame"], {})[cid] = event["Start"]
+            elif event["Event"] == EVENT_TRIGGER_END:
+                self._running.discard(cid)
+                if event["Error"] is not None:
+                    self._errors[cid] = event["Error"]
+            self._condition.notify_all()
+            return cid in self._running
+
+    def wait_for_frame(self, frame, timeout=DEFAULT_RESULT_TIMEOUT_S):
+        """
+        :return: True if all cameras have started exposure of the frame in time
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: len(self._starts.get(frame, {})) == len(self._handles) or
+                                     not self._running or self._closed, timeout)
+            return len(self._starts.get(frame, {})) == len(self._handles)
+
+    def get_handles(self):
+        return self._handles
+
+    def is_closed(self):
+        return self._closed
+
+    def close(self):
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify_all()
+        for cid, stream in self._streams.items():
+            self._handles[cid].events.unsubscribe(stream)
+            stream.put(None)  # ends waiting for camera which has not finished
+
+    def get_stats(self):
+        with self._condition:
+            frames = []
+            for frame in sorted(self._starts.keys()):
+                starts = self._starts[frame]
+                first = min(starts.values())
+                skews = {cid: start - first for cid, start in starts.items()}
+                frames.append({"Frame": frame, "Start": first, "Skews": skews, "MaxSkew": max(skews.values())})
+            max_skews = [frame["MaxSkew"] for frame in frames if len(frame["Skews"]) == len(self._handles)]
+            return {
+                "Job": self.job_id,
+                "Cameras": list(self._handles.keys()),
+                "Frames": self._number,
+                "Started": len(max_skews),
+                "MaxSkew": max(max_skews) if max_skews else None,
+                "MeanMaxSkew": sum(max_skews) / len(max_skews) if max_skews else None,
+                "Finished": [cid for cid in self._handles.keys() if cid not in self._running],
+                "Errors": dict(self._errors),
+                "FrameSkews": frames
+            }
+
+
+class ArrayResource(CameraProcessResource):
+    """
+    Array level requests, concerning more cameras at once: /array/capture arms chosen (default all) camera
+    processes, which then start every exposure together on shared ArrayTrigger.
+    """
+    def __init__(self, processes, id_generator, trigger: ArrayTrigger):
+        super().__init__(processes, id_generator)
+        self._trigger = trigger
+        self._job_ids = count(1)
+        self._job: ArrayCaptureJob = None
+        self._lock = Lock()
+
+    @falcon.before(add_timestamp_before)
+    @falcon.after(add_timestamp_after)
+    def on_get(self, req: falcon.Request, resp: falcon.Response, setting_name):
+        self._process_array_get(req, resp, setting_name)
+
+    @falcon.before(add_timestamp_before)
+    @falcon.after(add_timestamp_after)
+    def on_put(self, req: falcon.Request, resp: falcon.Response, setting_name):
+        self._process_array_put(resp, setting_name, req.media)
+
+    def _process_array_get(self, req, resp, setting_name):
+        if setting_name != "capture":
+            resp.text = f"There is no array resource named {setting_name}"
+            resp.status = falcon.HTTP_404
+            return
+        client_transaction_id = int(req.get_param("ClientTransactionID", default=0))
+        job = self._job
+        value = None
+        if job is not None:
+            states = {cid: self._check_state(handle)[0] for cid, handle in job.get_handles().items()}
+            value = job.get_stats()
+            value["States"] = states
+            value["Running"] = any(state not in ["IDLE", "ERROR", DONE_TOKEN] for state in states.values())
+            if not value["Running"] and not job.is_closed():
+                job.close()
+        response_dict = create_ascom_response_dict(client_transaction_id, self._id_generator.generate(),
+                                                   error_number=0, error_message="")
+        response_dict.update({"Value": value})
+        resp.text = json.dumps(response_dict)
+        resp.status = falcon.HTTP_200
+
+    def _process_array_put(self, resp, setting_name, form):
+        if setting_name != "capture":
+            resp.text = f"There is no array resource named {setting_name}"
+            resp.status = falcon.HTTP_404
+            return
+        try:
+            cid, ctid, params = split_client_and_transaction_id(form)
+            float(params["Duration"])
+            cameras = parse_cameras(params.pop("Cameras", None)) or sorted(self._processes.keys())
+        except Exception as e:
+            log.warning(f"Could not read params: {repr(e)}")
+            resp.text = json.dumps({"error": repr(e), "trace": format_exc()})
+            resp.status = falcon.HTTP_400
+            return
+        unknown = [c for c in cameras if c not in self._processes.keys()]
+        if unknown or not cameras:
+            resp.text = f"There are no cameras with numbers {unknown}"
+            resp.status = falcon.HTTP_417
+            return
+        if not self._lock.acquire(blocking=False):
+            resp.text = json.dumps({"Status": "BUSY", "ErrorMessage": "Another array capture is being started"})
+            resp.status = falcon.HTTP_409
+            return
+        try:
+            self._start_capture(resp, {c: self._processes[c] for c in cameras}, ctid, params)
+        finally:
+            self._lock.release()
+
+    def _start_capture(self, resp, handles: dict, client_transaction_id, params):
+        states = {cid: self._check_state(handle) for cid, handle in handles.items()}
+        if any(state not in ["IDLE", DONE_TOKEN] for state, _ in states.values()):
+            resp.text = json.dumps({"Status": {cid: state for cid, (state, _) in states.items()},
+                                    "ErrorMessage": "All cameras of array capture have to be idle"})
+            resp.status = falcon.HTTP_412
+            return
+
+        job = ArrayCaptureJob(next(self._job_ids), handles, int(params.get("Number", 1)))
+        self._trigger.configure(job.job_id, len(handles))
+        params["Job"] = job.job_id
+        requests = {cid: handle.demux.send(CameraSimplePUTCommand(name="triggeredcapture", params=dict(params)))
+                    for cid, handle in handles.items()}
+        errors = {}
+        for cid, request in requests.items():
+            handle: CameraProcessHandle = handles[cid]
+            try:
+                raw_result = request.next_result(DEFAULT_RESULT_TIMEOUT_S)
+            except FutureTimeoutError:
+                raw_result = None
+            if raw_result is not None and raw_result.ok() and raw_result.get() == BUSY_TOKEN:
+                # progress is read from here, as for capture of single camera:
+                with handle.state_lock:
+                    handle.busy_request = request
+                    handle.state = "BUSY"
+                handle.last_put_time = time.time()
+            else:
+                errors[cid] = raw_result.error() if raw_result is not None else "Camera process did not respond"
+                handle.demux.release(request)
+        if errors:
+            self._trigger.abort()
+            job.close()
+            resp.text = json.dumps({"Status": "ERROR", "ErrorMessage": "Could not arm cameras", "Errors": errors})
+            resp.status = falcon.HTTP_500
+            return
+
+        if self._job is not None:
+            self._job.close()
+        self._job = job
+        started = job.wait_for_frame(0)
+        stats = job.get_stats()
+        response_dict = create_ascom_response_dict(client_transaction_id, self._id_generator.generate(),
+                                                   error_number=0 if started else 500,
+                                                   error_message="" if started else "Not all cameras started")
+        response_dict.update({"Value": stats})
+        resp.text = json.dumps(response_dict)
+        resp.status = falcon.HTTP_200 if started else falcon.HTTP_500
+
+
+class AsyncArrayResource(ArrayResource):
+    """
+    ArrayResource for ASGI server. Arming cameras waits on all of them, which is done in executor.
+    """
+    @falcon.before(add_timestamp_before_async)
+    @falcon.after(add_timestamp_after_async)
+    async def on_get(self, req: falcon.asgi.Request, resp: falcon.asgi.Response, setting_name):
+        await asyncio.get_running_loop().run_in_executor(None, self._process_array_get, req, resp, setting_name)
+
+    @falcon.before(add_timestamp_before_async)
+    @falcon.after(add_timestamp_after_async)
+    async def on_put(self, req: falcon.asgi.Request, resp: falcon.asgi.Response, setting_name):
+        form = await req.get_media()
+        await asyncio.get_running_loop().run_in_executor(None, self._process_array_put, resp, setting_name, form)
@@ -0,0 +1,63 @@
+from multiprocessing import Condition, RawArray
+
+
+DEFAULT_TRIGGER_TIMEOUT_S = 30.0
+
+_JOB, _PARTIES, _ARRIVED, _GENERATION, _BROKEN = range(0, 5)
+
+
+class ArrayTrigger:
+    """
+    Barrier which camera processes of an array capture pass together right before each exposure is started.
+    Cameras taking part change from job to job, which multiprocessing.Barrier (fixed number of parties)
+    cannot do, so it is built on shared Condition. It has to be created before camera processes,
+    which inherit it.
+    """
+    def __init__(self):
+        self._condition = Condition()
+        self._state = RawArray('i', 5)
+
+    def configure(self, job, parties):
+        """
+        Server side: prepares barrier for a new job, before its cameras are armed.
+        """
+        with self._condition:
+            self._state[_JOB] = job
+            self._state[_PARTIES] = parties
+            self._state[_ARRIVED] = 0
+            self._state[_BROKEN] = 0
+
+    def abort(self):
+        """
+        Releases all cameras waiting (they fail), e.g. when one of them could not be armed.
+        """
+        with self._condition:
+            self._state[_BROKEN] = 1
+            self._condition.notify_all()
+
+    def wait(self, job, timeout=DEFAULT_TRIGGER_TIMEOUT_S):
+        """
+        Camera process side: returns when all cameras of the job have arrived.
+        :raise RuntimeError: when trigger is aborted, times out or is configured for another job
+        """
+        with self._condition:
+            if self._state[_JOB] != job:
+                raise RuntimeError(f"Trigger is configured for job {self._state[_JOB]}, not {job}")
+            if self._state[_BROKEN]:
+                raise RuntimeError("Trigger aborted")
+            generation = self._state[_GENERATION]
+            self._state[_ARRIVED] += 1
+            if self._state[_ARRIVED] >= self._state[_PARTIES]:
+                self._state[_ARRIVED] = 0
+                self._state[_GENERATION] = generation + 1
+                self._condition.notify_all()
+                return
+            released = self._condition.wait_for(
+                lambda: self._state[_GENERATION] != generation or self._state[_BROKEN], timeout)
+            if self._state[_GENERATION] != generation:
+                return
+            if not released:
+                self._state[_BROKEN] = 1
+                self._condition.notify_all()
+                raise RuntimeError(f"Not all cameras were ready in {timeout} s")
+            raise RuntimeError("Trigger aborted")
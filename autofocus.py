@@ -0,0 +1,242 @@
+import requests
+import numpy as np
+import argparse
+import logging
+import time
+import json
+
+
+log = logging.getLogger("autofocus")
+
+DEFAULT_STEP = 50
+DEFAULT_POINTS = 9
+DEFAULT_EXPOSURE_S = 1.0
+DEFAULT_ROI_SIZE = 512
+DEFAULT_SETTLE_S = 0.5
+DEFAULT_BACKLASH = 0
+IMAGEREADY_POLL_S = 0.05
+FIT_POINTS = 5
+REQUEST_TIMEOUT_S = 30
+
+# metric name: True if lower value means better focus
+lower_is_better = {
+    "hfr": True,
+    "laplacian": False
+}
+
+
+class AutoFocusError(Exception):
+    pass
+
+
+class CameraClient:
+    """
+    Camera API of app2 server, used over one keep-alive session.
+    """
+    def __init__(self, session: requests.Session, base_url, camera_id, client_id=1):
+        self._session = session
+        self._url = f"{base_url.rstrip('/')}/api/v1/camera/{camera_id}"
+        self._client_id = client_id
+        self._transaction_id = 0
+
+    def _ids(self):
+        self._transaction_id += 1
+        return {"ClientID": self._client_id, "ClientTransactionID": self._transaction_id}
+
+    def get(self, name, **params):
+        params.update(self._ids())
+        response = self._session.get(f"{self._url}/{name}", params=params, timeout=REQUEST_TIMEOUT_S)
+        result = response.json()
+        if response.status_code != 200 or result.get("ErrorNumber", 0) != 0:
+            raise AutoFocusError(f"GET {name} failed: {response.status_code} {result}")
+        return result["Value"]
+
+    def put(self, name, **params):
+        params.update(self._ids())
+        response = self._session.put(f"{self._url}/{name}", json=params, timeout=REQUEST_TIMEOUT_S)
+        if response.status_code != 200:
+            raise AutoFocusError(f"PUT {name} failed: {response.status_code} {response.text}")
+        return response.json()
+
+
+class FocuserClient:
+    """
+    Focuser API of app_mount server. Focuser moves are relative only, so position is tracked here.
+    """
+    def __init__(self, session: requests.Session, base_url, focuser_number):
+        self._session = session
+        self._url = f"{base_url.rstrip('/')}/focuser/{focuser_number}"
+        self._position = 0
+
+    def get_position(self):
+        return self._position
+
+    def move_relative(self, steps):
+        steps = int(steps)
+        if steps == 0:
+            return
+        response = self._session.put(f"{self._url}/move_relative", json={"Value": steps}, timeout=REQUEST_TIMEOUT_S)
+        if response.status_code != 200:
+            raise AutoFocusError(f"Focuser move failed: {response.status_code} {response.text}")
+        self._position += steps
+
+
+class AutoFocus:
+    """
+    Scans focuser positions around current one with short ROI exposures, scores each one with focus metric
+    computed in camera process, fits parabola to the V-curve and moves to its vertex.
+    All moves end in the positive direction, so backlash is taken up the same way every time.
+    """
+    def __init__(self, camera: CameraClient, focuser: FocuserClient, exposure_s=DEFAULT_EXPOSURE_S,
+                 step=DEFAULT_STEP, points=DEFAULT_POINTS, metric="hfr", roi_size=DEFAULT_ROI_SIZE,
+                 settle_s=DEFAULT_SETTLE_S, backlash=DEFAULT_BACKLASH):
+        if metric not in lower_is_better:
+            raise ValueError(f"Unknown metric {metric}, expected one of {list(lower_is_better.keys())}")
+        self._camera = camera
+        self._focuser = focuser
+        self._exposure_s = exposure_s
+        self._step = step
+        self._points = points
+        self._metric = metric
+        self._roi_size = roi_size
+        self._settle_s = settle_s
+        self._backlash = backlash
+        self._last_sequence = None
+
+    def _move_to(self, position):
+        delta = position - self._focuser.get_position()
+        if delta < 0 and self._backlash > 0:
+            self._focuser.move_relative(delta - self._backlash)
+            delta = self._backlash
+        self._focuser.move_relative(delta)
+
+    def _set_roi(self):
+        """
+        :return: ROI to restore afterwards
+        """
+        original = {name: self._camera.get(name) for name in ["numx", "numy", "startx", "starty"]}
+        if self._roi_size is None:
+            return original
+        width = min(self._roi_size, self._camera.get("cameraxsize"))
+        height = min(self._roi_size, self._camera.get("cameraysize"))
+        self._camera.put("numx", Value=width)
+        self._camera.put("numy", Value=height)
+        self._camera.put("startx", Value=(self._camera.get("cameraxsize") - width) // 2)
+        self._camera.put("starty", Value=(self._camera.get("cameraysize") - height) // 2)
+        return original
+
+    def _restore_roi(self, roi):
+        # start first, as restored size may not fit with start of the smaller ROI:
+        for name in ["startx", "starty", "numx", "numy"]:
+            self._camera.put(name, Value=roi[name])
+
+    def _measure(self):
+        self._camera.put("startexposure", Duration=self._exposure_s, Light=True)
+        time.sleep(self._exposure_s)
+        while not self._camera.get("imageready"):
+            time.sleep(IMAGEREADY_POLL_S)
+        result = self._camera.get("focusmetric", method=self._metric)
+        if result["Sequence"] == self._last_sequence:
+            raise AutoFocusError(f"Focus metric computed on old frame {result['Sequence']}")
+        self._last_sequence = result["Sequence"]
+        return result
+
+    def _measure_at(self, position):
+        ss = time.time()
+        self._move_to(position)
+        time.sleep(self._settle_s)
+        moved = time.time()
+        try:
+            result = self._measure()
+            value = result["Value"]
+        except AutoFocusError as e:
+            log.warning(f"No focus metric at {position}: {repr(e)}")
+            result, value = {}, None
+        se = time.time()
+        timing = {
+            "Position": position,
+            "Metric": value,
+            "StarCount": result.get("StarCount"),
+            "MoveTime": moved - ss,
+            "ExposureTime": se - moved,
+            "MetricComputeTime": result.get("ComputeTime"),
+            "StepTime": se - ss
+        }
+        log.info(f"Focus step: {timing}")
+        return timing
+
+    def fit(self, positions, values):
+        """
+        Parabola fitted to points around best measured one.
+        :return: position of vertex, or best measured position if curve does not have proper shape
+        """
+        positions = np.asarray(positions, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64)
+        best = int(np.argmin(values) if lower_is_better[self._metric] else np.argmax(values))
+        if len(values) < 3:
+            return positions[best], None
+        first = max(0, min(best - FIT_POINTS // 2, len(values) - FIT_POINTS))
+        window = slice(first, first + FIT_POINTS)
+        a, b, c = np.polyfit(positions[window], values[window], 2)
+        if (a > 0) != lower_is_better[self._metric]:
+            log.warning("V-curve does not have minimum in scanned range, using best measured position")
+            return positions[best], None
+        vertex = -b / (2 * a)
+        return float(np.clip(vertex, positions[0], positions[-1])), [a, b, c]
+
+    def run(self):
+        ss = time.time()
+        center = self._focuser.get_position()
+        roi = self._set_roi()
+        try:
+            start = center - self._step * (self._points // 2)
+            # going below start first, so that scan is done in positive direction only:
+            self._move_to(start - self._step)
+            steps = [self._measure_at(start + i * self._step) for i in range(0, self._points)]
+            measured = [s for s in steps if s["Metric"] is not None]
+            if len(measured) < 3:
+                self._move_to(center)
+                raise AutoFocusError(f"Only {len(measured)} positions could be measured")
+            best, coefficients = self.fit([s["Position"] for s in measured], [s["Metric"] for s in measured])
+            best = int(round(best))
+            final = self._measure_at(best)
+        finally:
+            self._restore_roi(roi)
+        report = {
+            "BestPosition": best,
+            "Offset": best - center,
+            "Coefficients": coefficients,
+            "FinalMetric": final["Metric"],
+            "Steps": steps,
+            "TotalTime": time.time() - ss
+        }
+        log.info(f"Autofocus done in {report['TotalTime']:.1f}s, moved by {report['Offset']} steps")
+        return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Autofocus with camera (app2) and focuser (app_mount) servers")
+    parser.add_argument("--camera-url", required=True)
+    parser.add_argument("--camera", type=int, default=0)
+    parser.add_argument("--focuser-url", required=True)
+    parser.add_argument("--focuser", type=int, default=0)
+    parser.add_argument("--exposure", type=float, default=DEFAULT_EXPOSURE_S)
+    parser.add_argument("--step", type=int, default=DEFAULT_STEP)
+    parser.add_argument("--points", type=int, default=DEFAULT_POINTS)
+    parser.add_argument("--metric", choices=list(lower_is_better.keys()), default="hfr")
+    parser.add_argument("--roi", type=int, default=DEFAULT_ROI_SIZE)
+    parser.add_argument("--settle", type=float, default=DEFAULT_SETTLE_S)
+    parser.add_argument("--backlash", type=int, default=DEFAULT_BACKLASH)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    with requests.Session() as session:
+        camera = CameraClient(session, args.camera_url, args.camera)
+        focuser = FocuserClient(session, args.focuser_url, args.focuser)
+        autofocus = AutoFocus(camera, focuser, exposure_s=args.exposure, step=args.step, points=args.points,
+                              metric=args.metric, roi_size=args.roi, settle_s=args.settle, backlash=args.backlash)
+        print(json.dumps(autofocus.run(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
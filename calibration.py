@@ -0,0 +1,208 @@
+from .app_utils import parse_bool
+from threading import Lock
+import numpy as np
+import json
+import os
+
+
+CALIBRATION_BIAS = "bias"
+CALIBRATION_DARK = "dark"
+CALIBRATION_FLAT = "flat"
+calibration_kinds = [CALIBRATION_BIAS, CALIBRATION_DARK, CALIBRATION_FLAT]
+
+COMBINE_MEAN = "mean"
+COMBINE_MEDIAN = "median"
+combine_methods = [COMBINE_MEAN, COMBINE_MEDIAN]
+
+DEFAULT_TEMPERATURE_BUCKET = 2.0
+MEDIAN_CHUNK_BYTES = 32 * 1024 * 1024
+INDEX_FILE = "index.json"
+
+# Settings master has to match to be used, per kind:
+matched_settings = {
+    CALIBRATION_BIAS: ["camera", "gain", "bin", "roi"],
+    CALIBRATION_DARK: ["camera", "gain", "exposure", "bin", "roi", "temperature"],
+    CALIBRATION_FLAT: ["camera", "bin", "roi"]
+}
+
+
+class MasterBuilder:
+    """
+    Combines frames into master frame without holding them all in memory.
+    Mean is running mean in float32. For median frames go to memory-mapped stack on disk,
+    which is then reduced in chunks of rows.
+    """
+    def __init__(self, path, number, method):
+        if method not in combine_methods:
+            raise ValueError(f"Unknown combine method {method}, expected one of {combine_methods}")
+        self._path = path
+        self._number = number
+        self._method = method
+        self._added = 0
+        self._mean = None
+        self._stack = None
+        self._stack_file = None
+
+    def add(self, img):
+        if self._added >= self._number:
+            raise ValueError(f"Master is combined from {self._number} frames only")
+        if self._method == COMBINE_MEAN:
+            if self._mean is None:
+                self._mean = np.zeros(img.shape, dtype=np.float32)
+            self._mean += (img - self._mean) / np.float32(self._added + 1)
+        else:
+            if self._stack is None:
+                self._stack_file = os.path.join(self._path, f"stack_{os.getpid()}.npy")
+                self._stack = np.lib.format.open_memmap(self._stack_file, mode="w+", dtype=img.dtype,
+                                                        shape=(self._number,) + img.shape)
+            self._stack[self._added] = img
+        self._added += 1
+
+    def finish(self):
+        """
+        :return: combined frame in float32
+        """
+        if self._added == 0:
+            raise ValueError("No frames to combine")
+        if self._method == COMBINE_MEAN:
+            return self._mean
+        try:
+            frames = self._stack[:self._added]
+            master = np.empty(frames.shape[1:], dtype=np.float32)
+            row_bytes = frames[0, 0].nbytes * self._added
+            rows = max(1, MEDIAN_CHUNK_BYTES // row_bytes)
+            for r in range(0, master.shape[0], rows):
+                np.median(frames[:, r:r + rows], axis=0, out=master[r:r + rows])
+            return master
+        finally:
+            del self._stack
+            self._stack = None
+            os.remove(self._stack_file)
+
+
+class Calibrator:
+    """
+    Master bias, dark and flat frames of one camera, stored as float32 .npy files and indexed by settings
+    they were taken with. Masters are memory-mapped and looked up once per distinct settings, after that
+    applying calibration to frame is in-memory arithmetic only: (frame - dark or bias) / flat.
+    """
+    def __init__(self, log, path):
+        self._log = log
+        self._path = path
+        self._lock = Lock()
+        self._enabled = False
+        self._temperature_bucket = DEFAULT_TEMPERATURE_BUCKET
+        self._index = []
+        self._lookup_cache = {}
+        self._scratch = None
+        self._calibrated = 0
+        self._last_masters = None
+        os.makedirs(self._path, exist_ok=True)
+        index_file = os.path.join(self._path, INDEX_FILE)
+        if os.path.isfile(index_file):
+            with open(index_file) as f:
+                self._index = json.load(f)
+
+    def configure(self, enabled, temperature_bucket):
+        temperature_bucket = float(temperature_bucket)
+        if temperature_bucket <= 0:
+            raise ValueError(f"Temperature bucket must be positive, got {temperature_bucket}")
+        with self._lock:
+            self._enabled = parse_bool(enabled)
+            self._temperature_bucket = temperature_bucket
+            self._lookup_cache = {}
+
+    def is_enabled(self):
+        return self._enabled
+
+    def _bucket(self, settings):
+        """
+        Settings as used for matching: temperature rounded to bucket, exposure to microseconds.
+        """
+        result = dict(settings)
+        result["temperature"] = round(settings["temperature"] / self._temperature_bucket) * self._temperature_bucket
+        result["exposure"] = round(settings["exposure"], 6)
+        result["roi"] = list(settings["roi"])
+        return result
+
+    def _find(self, kind, settings):
+        for entry in reversed(self._index):
+            if entry["kind"] == kind and all(entry[k] == settings[k] for k in matched_settings[kind]):
+                return entry
+        return None
+
+    def _load(self, entry):
+        return np.load(os.path.join(self._path, entry["file"]), mmap_mode="r")
+
+    def new_builder(self, number, method):
+        return MasterBuilder(self._path, number, method)
+
+    def store(self, kind, settings, master):
+        """
+        Stores combined frame as master. Flat has matching bias (or dark) subtracted and is normalized to median 1.
+        """
+        with self._lock:
+            settings = self._bucket(settings)
+            if kind == CALIBRATION_FLAT:
+                offset = self._find(CALIBRATION_DARK, settings) or self._find(CALIBRATION_BIAS, settings)
+                if offset is not None:
+                    master -= self._load(offset)
+                master /= np.median(master)
+                master[master <= 0] = 1
+            filename = f"{kind}_{len(self._index):04d}.npy"
+            np.save(os.path.join(self._path, filename), master.astype(np.float32, copy=False))
+            entry = dict(settings, kind=kind, file=filename, shape=list(master.shape))
+            self._index.append(entry)
+            with open(os.path.join(self._path, INDEX_FILE), "w") as f:
+                json.dump(self._index, f, indent=1)
+            self._lookup_cache = {}
+            self._log.info(f"Stored master {kind}: {entry}")
+            return entry
+
+    def _masters(self, settings):
+        """
+        :return: (dark or bias, flat) arrays for settings, each may be None - cached per settings
+        """
+        settings = self._bucket(settings)
+        key = tuple((k, tuple(v) if isinstance(v, list) else v) for k, v in sorted(settings.items()))
+        if key not in self._lookup_cache:
+            offset = self._find(CALIBRATION_DARK, settings) or self._find(CALIBRATION_BIAS, settings)
+            flat = self._find(CALIBRATION_FLAT, settings)
+            self._lookup_cache[key] = (self._load(offset) if offset is not None else None,
+                                       self._load(flat) if flat is not None else None,
+                                       [e["file"] for e in [offset, flat] if e is not None])
+        return self._lookup_cache[key]
+
+    def apply(self, img, settings):
+        """
+        Calibrates frame in place, if calibration is enabled and there are masters matching settings.
+        """
+        with self._lock:
+            if not self._enabled:
+                return
+            offset, flat, files = self._masters(settings)
+            if (offset is None or offset.shape != img.shape) and (flat is None or flat.shape != img.shape):
+                return
+            if self._scratch is None or self._scratch.shape != img.shape:
+                self._scratch = np.empty(img.shape, dtype=np.float32)
+            scratch = self._scratch
+            np.copyto(scratch, img, casting="unsafe")
+            if offset is not None and offset.shape == img.shape:
+                np.subtract(scratch, offset, out=scratch)
+            if flat is not None and flat.shape == img.shape:
+                np.divide(scratch, flat, out=scratch)
+            np.clip(scratch, 0, np.iinfo(img.dtype).max, out=scratch)
+            np.rint(scratch, out=scratch)
+            np.copyto(img, scratch, casting="unsafe")
+            self._calibrated += 1
+            self._last_masters = files
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "Enabled": self._enabled,
+                "TemperatureBucket": self._temperature_bucket,
+                "Calibrated": self._calibrated,
+                "LastMasters": self._last_masters,
+                "Masters": self._index
+            }
@@ -0,0 +1,137 @@
+from .request_routing import FutureStream
+from collections import deque
+from itertools import count
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from threading import Thread, Lock
+import logging
+import json
+import time
+
+
+log = logging.getLogger('main')
+
+EVENT_HISTORY = 64
+EVENT_KEEPALIVE_S = 15.0
+
+EVENT_EXPOSURE_STARTED = "exposure_started"
+EVENT_IMAGE_READY = "image_ready"
+EVENT_EXPOSURE_FAILED = "exposure_failed"
+EVENT_PROGRESS = "progress"
+EVENT_SEQUENCE = "sequence"
+EVENT_TRIGGER = "trigger"
+EVENT_TRIGGER_END = "trigger_end"  # camera has finished (or failed) its part of array capture job
+
+image_events = [EVENT_IMAGE_READY, EVENT_EXPOSURE_FAILED]
+
+
+def format_sse(event):
+    return f"id: {event['Id']}\nevent: {event['Event']}\ndata: {json.dumps(event)}\n\n".encode()
+
+
+class EventPublisher:
+    """
+    Camera process side: events go to server over their own queue, so they never mix with command results.
+    """
+    def __init__(self, event_queue, camera_id):
+        self._event_queue = event_queue
+        self._camera_id = camera_id
+
+    def publish(self, kind, data=None):
+        event = {"Event": kind, "Camera": self._camera_id, "Time": time.time()}
+        event.update(data or {})
+        self._event_queue.put(event)
+
+
+class EventBroadcaster:
+    """
+    Server side: numbers events of one camera and hands each to all subscribers. Recent events are kept,
+    so subscriber can start after event it has already seen (e.g. Last-Event-ID) without missing any.
+    """
+    def __init__(self, event_queue, history=EVENT_HISTORY):
+        self._event_queue = event_queue
+        self._lock = Lock()
+        self._history = deque(maxlen=history)
+        self._last_by_kind = {}
+        self._subscribers = set()
+        self._ids = count(1)
+        self._last_id = 0
+        self._thread = Thread(target=self._route, daemon=True)
+        self._thread.start()
+
+    def _route(self):
+        while True:
+            try:
+                event = self._event_queue.get()
+            except (EOFError, OSError):
+                return
+            with self._lock:
+                self._last_id = event["Id"] = next(self._ids)
+                self._history.append(event)
+                self._last_by_kind[event["Event"]] = event
+                for subscriber in self._subscribers:
+                    subscriber.put(event)
+
+    def subscribe(self, after=None) -> FutureStream:
+        """
+        :param after: id of last event seen, kept events newer than that are delivered first.
+        None means only events from now on.
+        """
+        stream = FutureStream()
+        with self._lock:
+            if after is not None:
+                for event in self._history:
+                    if event["Id"] > after:
+                        stream.put(event)
+            self._subscribers.add(stream)
+        return stream
+
+    def unsubscribe(self, stream: FutureStream):
+        with self._lock:
+            self._subscribers.discard(stream)
+
+    def get_last(self, kind):
+        """
+        :return: last event of given kind, None if there was none
+        """
+        with self._lock:
+            return self._last_by_kind.get(kind)
+
+    def get_last_id(self, kind=None):
+        """
+        :return: id of last event (of given kind), 0 if there was none
+        """
+        with self._lock:
+            if kind is None:
+                return self._last_id
+            event = self._last_by_kind.get(kind)
+            return event["Id"] if event is not None else 0
+
+
+class EventStream:
+    """
+    Iterable server-sent events response body. Subscription ends when WSGI server closes the iterable.
+    Comment is sent when there was no event for a while, so that disconnected client is noticed.
+    :param on_close: called once the stream is closed, e.g. to free the server thread slot it was counted in
+    """
+    def __init__(self, broadcaster: EventBroadcaster, after=None, keepalive_s=EVENT_KEEPALIVE_S, on_close=None):
+        self._broadcaster = broadcaster
+        self._stream = broadcaster.subscribe(after)
+        self._keepalive_s = keepalive_s
+        self._on_close = on_close
+
+    def __iter__(self):
+        future = self._stream.next()
+        while True:
+            try:
+                event = future.result(self._keepalive_s)
+            except FutureTimeoutError:
+                yield b": keepalive\n\n"
+                continue
+            future = self._stream.next()
+            yield format_sse(event)
+
+    def close(self):
+        self._broadcaster.unsubscribe(self._stream)
+        if self._on_close is not None:
+            self._on_close()
+            self._on_close = None
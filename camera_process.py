@@ -1,9 +1,34 @@
 import time
 
-from .zwo_camera import ZwoCamera
-from .app_utils import add_log
+from .zwo_camera import ZwoCamera, frame_as_array, bytes_per_pixel
+from .app_utils import add_log, parse_bool
 from .camera_server_utils import Error, OK, CameraCommand
+from .frame_ring import FrameRing, SlotsBusyError
+from .property_mirror import PropertyMirror
+from .request_routing import RequestTagger, ResultDemultiplexer
+from .camera_events import EventPublisher, EventBroadcaster, EVENT_PROGRESS, EVENT_SEQUENCE, EVENT_TRIGGER, \
+    EVENT_TRIGGER_END
+from .array_trigger import ArrayTrigger
+from .capture_sequence import SequenceProgress, parse_plan, settings_changes, changes_format, setting_properties
+from .continuous_acquisition import ContinuousAcquisition
+from .frame_writer import WriterPool, save_frame, DEFAULT_FILE_FORMAT
+from .raw_writers import frame_writers
+from .frame_ops import to_alpaca_layout, bin_reduce, laplacian_variance, preview_methods, stretch_methods
+from .frame_compression import compress_frame, compressors, FRAME_ENCODING_HEADER
+from .debayer import debayer, debayered_format, debayer_modes, channels
+from .frame_stats import FrameStatsCache, compute_frame_stats, rebin_histogram
+from .star_analysis import StarAnalyzer, detect_stars
+from .live_stack import LiveStack, stack_images, stack_dtypes
+from .calibration import Calibrator, calibration_kinds, combine_methods, CALIBRATION_BIAS, CALIBRATION_FLAT, \
+    COMBINE_MEDIAN, COMBINE_MEAN
+from .hot_pixels import HotPixelMap, DEFAULT_HOT_PIXEL_SIGMA
+from .thumbnail import ThumbnailCache, make_thumbnail, thumbnail_formats, DEFAULT_THUMBNAIL_SIZE, \
+    DEFAULT_THUMBNAIL_FORMAT, DEFAULT_THUMBNAIL_STRETCH
 import os
+import numpy as np
+from threading import Thread, Lock
+from traceback import format_exc
+from multiprocessing import Event, Queue, Process, Pipe
 from .app_utils import DefaultCaptureFilenameGenerator
 
 
@@ -13,25 +38,51 @@ capture_path = os.path.join(os.getcwd(), "capture")
 
 
 class CameraProcessHandle:
-    def __init__(self, info, process, name, command_queue, result_queue, data_pipe):
+    def __init__(self, info, process, name, command_queue, result_queue, data_pipe, ring, demux, mirror=None,
+                 events=None):
         self.info = info
         self.process = process
         self.name = name
         self.command_queue = command_queue
         self.result_queue = result_queue
         self.data_pipe = data_pipe
+        self.ring = ring
+        self.demux: ResultDemultiplexer = demux
+        self.busy_request = None  # request still sending progress, while state is BUSY
+        self.mirror = mirror
+        self.events: EventBroadcaster = events
+        self.last_put_time = 0.0  # mirrored values read before last PUT was done are not used
         self.state = "IDLE"  # TODO maybe enum?
+        self.state_lock = Lock()  # state and busy_request are changed together, by any server thread
 
 
 class CameraProcessInfo:
-    def __init__(self, cid, command, result, data, ke):
+    def __init__(self, cid, command, result, data, ke, ring: FrameRing, mirror: PropertyMirror = None,
+                 events=None, trigger: ArrayTrigger = None):
         self.camera_id = cid
         self.in_queue = command
         self.out_queue = result
         self.data_pipe = data
         self.kill_event = ke
+        self.ring = ring
+        self.mirror = mirror
+        self.event_queue = events
+        self.trigger = trigger
 
 
+DEFAULT_PREVIEW_FACTOR = 4
+DEFAULT_PREVIEW_METHOD = "mean"
+DEFAULT_DEBAYER_CHANNEL = "g"
+FOCUS_METRIC_HFR = "hfr"
+FOCUS_METRIC_LAPLACIAN = "laplacian"
+focus_metrics = [FOCUS_METRIC_HFR, FOCUS_METRIC_LAPLACIAN]
+
+calibration_path = os.path.join(os.getcwd(), "calibration")
+
+MIRROR_REFRESH_S = 0.5
+INSTANT_CAPTURE_TIMEOUT_S = 5
+EXPOSURE_WATCH_TIMEOUT_S = 30
+
 DONE_TOKEN = "<DONE>"
 BUSY_TOKEN = "<BUSY>"
 
@@ -75,7 +126,6 @@ regular_get_methods = [
     "cooleron",
     "bayeroffsetx",
     "bayeroffsety",
-    "imagearray",
     "imagearraybase64",
     "gain",
     "gainmin",
@@ -83,6 +133,12 @@ regular_get_methods = [
     "heatsinktemperature"
 ]
 
+# Getters reading frame out of camera - they consume pending exposure, so they are never called as side effect:
+image_getters = ["imagearraybase64"]
+
+# Served from property mirror, without going through camera process:
+mirrored_get_methods = [m for m in regular_get_methods if m not in image_getters] + ["imageready"]
+
 regular_put_methods = [
     "gain",
     "connected",
@@ -95,21 +151,57 @@ regular_put_methods = [
     "starty"
 ]
 
+# Allowed in batch - simple properties only, each of them answered with a single value:
+batch_get_methods = [m for m in regular_get_methods if m not in image_getters] + ["imageready"]
+batch_put_methods = regular_put_methods
+
+
+def parse_batch_gets(gets):
+    """
+    :param gets: list of names, or comma separated names as given in query
+    """
+    if isinstance(gets, str):
+        gets = [name.strip() for name in gets.split(",") if name.strip()]
+    return [str(name).lower() for name in gets or []]
+
+
+def batch_item(name, value=None, error=None):
+    return {"Name": name, "Value": value, "ErrorNumber": 500 if error else 0, "ErrorMessage": error or ""}
+
 
 class CameraProcessor:
     def __init__(self, info: CameraProcessInfo):
         self._filename_generator = DefaultCaptureFilenameGenerator(prefix="")
         self._capturing = False
         self._camera_id = info.camera_id
-        self._response_queue = info.out_queue
+        # results and frames are sent back tagged with id of request being handled:
+        self._tagger = RequestTagger(info.out_queue, info.data_pipe)
+        self._response_queue = self._tagger
         self._command_queue = info.in_queue
         self._kill_event = info.kill_event
-        self._data_pipe = info.data_pipe
+        self._data_pipe = self._tagger
+        self._ring = info.ring
+        self._mirror = info.mirror
+        self._events = EventPublisher(info.event_queue, info.camera_id) if info.event_queue is not None else None
+        self._trigger = info.trigger
         self._continuous = False
-        self._continuous_exp = 1
+        self._acquisition: ContinuousAcquisition = None
+        self._last_frame = None
+        self._exposure_pending = False
+        self._writer = WriterPool(log)
+        self._thumbnails = ThumbnailCache()
+        self._frame_stats = FrameStatsCache()
+        self._star_analyzer = StarAnalyzer(log)
+        self._stack = LiveStack(log)
+        self._calibrator = Calibrator(log, os.path.join(calibration_path, f"camera_{info.camera_id}"))
+        self._hot_pixels = HotPixelMap(log, os.path.join(calibration_path, f"camera_{info.camera_id}"))
+        # changed when frame processing is reconfigured, so that running acquisition takes new frame context:
+        self._context_generation = 0
         ZwoCamera.initialize_library()
         self._camera: ZwoCamera = None
         log.info(f"Starting process for camera no {info.camera_id}")
+        self._mirror_thread = Thread(target=self._refresh_mirror, daemon=True)
+        self._mirror_thread.start()
 
         self._unusual_put_method_map = {
             "init": self._handle_set_init,
@@ -117,14 +209,42 @@ class CameraProcessor:
             "capture": self._handle_set_capture,
             "instantcapture": self._handle_instant_capture,
             "startcontinuous": self._handle_start_continuous,
-            "stopcontinuous": self._handle_stop_continuous
+            "stopcontinuous": self._handle_stop_continuous,
+            "writerconfig": self._handle_set_writerconfig,
+            "staranalysis": self._handle_set_staranalysis,
+            "stack": self._handle_set_stack,
+            "stackreset": self._handle_set_stackreset,
+            "calibration": self._handle_set_calibration,
+            "calibrationcapture": self._handle_set_calibrationcapture,
+            "hotpixels": self._handle_set_hotpixels,
+            "hotpixelmap": self._handle_set_hotpixelmap,
+            "sequence": self._handle_set_sequence,
+            "triggeredcapture": self._handle_set_triggeredcapture,
+            "batch": self._handle_set_batch
         }
 
         self._unusual_get_method_map = {
             "list": self._handle_get_list,
             "imageready": self._handle_get_imageready,
             "imagebytes": self._handle_get_imagebytes,
-            "currentimage": self._get_current_image
+            "currentimage": self._get_current_image,
+            "imagearray": self._handle_get_imagearray,
+            "imagearraybytes": self._handle_get_imagearraybytes,
+            "preview": self._handle_get_preview,
+            "thumbnail": self._handle_get_thumbnail,
+            "thumbnailstats": self._handle_get_thumbnailstats,
+            "framestats": self._handle_get_framestats,
+            "starmetrics": self._handle_get_starmetrics,
+            "focusmetric": self._handle_get_focusmetric,
+            "stackimage": self._handle_get_stackimage,
+            "stack": self._handle_get_stack,
+            "calibration": self._handle_get_calibration,
+            "hotpixels": self._handle_get_hotpixels,
+            "staranalysis": self._handle_get_staranalysis,
+            "continuousstats": self._handle_get_continuousstats,
+            "writerstats": self._handle_get_writerstats,
+            "exposuretiming": self._handle_get_exposuretiming,
+            "batch": self._handle_get_batch
         }
 
     def run(self):
@@ -132,22 +252,83 @@ class CameraProcessor:
             possible_when_continuous = [
                 "init",
                 "stopcontinuous",
-                "currentimage"
+                "currentimage",
+                "continuousstats",
+                "preview",
+                "thumbnail",
+                "thumbnailstats",
+                "framestats",
+                "starmetrics",
+                "staranalysis",
+                "stackimage",
+                "stack",
+                "stackreset",
+                "calibration",
+                "hotpixels",
+                "exposuretiming"
             ]
 
             command_raw: CameraCommand = self._command_queue.get()
             if command_raw is None:
                 break  # this is ultimate stopping condition
+            self._tagger.set_request_id(command_raw.get_request_id())
 
             if self._continuous and command_raw.get_name() not in possible_when_continuous:
-                self._response_queue.put(Error(f"Not allowed when in continuous mode!"))
+                self._response_queue.put(Error("Not allowed when in continuous mode!"))
                 continue
 
-            if command_raw.is_get():
-                self._handle_get(command_raw)
+            # failure of one command must not end camera process, it would leave server without camera:
+            try:
+                if command_raw.is_get():
+                    self._handle_get(command_raw)
+
+                elif command_raw.is_put():
+                    self._handle_put(command_raw)
+                    self._publish_state()
+            except SlotsBusyError:
+                self._response_queue.put(Error("All frame slots busy"))
+            except Exception as e:
+                log.error(f"Command {command_raw.get_name()} failed: {format_exc()}")
+                self._response_queue.put(Error(f"Command {command_raw.get_name()} failed: {repr(e)}"))
+
+    def _publish_state(self):
+        """
+        Puts current values of mirrored properties into property mirror. Timestamp is taken before reading them,
+        so snapshot is never newer than it claims to be.
+        """
+        camera = self._camera
+        if self._mirror is None or camera is None:
+            return
+        timestamp = time.time()
+        values = {}
+        for name in mirrored_get_methods:
+            try:
+                if name == "imageready":
+                    values[name] = not self._capturing and camera.get_imageready()
+                else:
+                    values[name] = getattr(camera, "get_" + name)()
+            except Exception as e:
+                log.debug(f"Could not mirror {name}: {repr(e)}")
+        try:
+            self._mirror.publish(values, timestamp)
+        except (TypeError, ValueError) as e:
+            log.error(f"Could not publish property mirror: {repr(e)}")
+
+    def _publish_event(self, kind, data=None):
+        if self._events is not None:
+            self._events.publish(kind, data)
+
+    def _progress(self, message):
+        self._response_queue.put(OK(message))
+        self._publish_event(EVENT_PROGRESS, {"Message": message})
+
+    def _refresh_mirror(self):
+        while not self._kill_event.wait(MIRROR_REFRESH_S):
+            self._publish_state()
 
-            elif command_raw.is_put():
-                self._handle_put(command_raw)
+    def shutdown(self):
+        self._stop_acquisition()
+        self._writer.flush()
 
     def _handle_get(self, command_raw):
         command_name = command_raw.get_name()
@@ -158,35 +339,376 @@ class CameraProcessor:
         else:
             self._response_queue.put(Error(f"Unknown get command: {command_name}"))
 
-    def _handle_regular_get(self, command_name):
-        if self._camera is None:
-            self._response_queue.put(Error("Regular get: Camera not initialized!"))
-            return
+    def _regular_get(self, command_name):
         method_name = "get_" + command_name
         log.debug(f"Calling method: {method_name}")
         result = getattr(self._camera, method_name)()
         log.debug(f"Got result: {result}")
-        self._response_queue.put(OK(result))
+        return result
+
+    def _handle_regular_get(self, command_name):
+        if self._camera is None:
+            self._response_queue.put(Error("Regular get: Camera not initialized!"))
+            return
+        self._response_queue.put(OK(self._regular_get(command_name)))
 
     def _handle_unusual_get(self, command_raw):
         handle_for_get = self._unusual_get_method_map[command_raw.get_name()]
-        handle_for_get()
+        handle_for_get(command_raw.get_params())
 
-    def _handle_get_list(self):
+    def _handle_get_list(self, params):
         self._response_queue.put(OK(ZwoCamera.get_cameras_list()))
 
-    def _handle_get_imageready(self):
+    def _handle_get_imageready(self, params):
         if self._camera is None:
             self._response_queue.put(Error("Camera not initialized!"))
-        elif self._capturing:
-            self._response_queue.put(OK(False))
         else:
-            self._response_queue.put(OK(self._camera.get_imageready()))
+            self._response_queue.put(OK(self._imageready()))
 
-    def _handle_get_imagebytes(self):
-        imagebytes, length = self._camera.get_imagebytes()
-        self._response_queue.put(OK(DONE_TOKEN))
-        self._data_pipe.send((imagebytes, length))
+    def _imageready(self):
+        return not self._capturing and self._camera.get_imageready()
+
+    def _batch_get(self, name):
+        if name not in batch_get_methods:
+            return batch_item(name, error=f"Not allowed in batch: {name}")
+        try:
+            return batch_item(name, value=self._imageready() if name == "imageready" else self._regular_get(name))
+        except Exception as e:
+            return batch_item(name, error=repr(e))
+
+    def _batch_put(self, item):
+        name = str(item.get("Name", "")).lower()
+        params = {k: v for k, v in item.items() if k != "Name"}
+        if name not in batch_put_methods:
+            return batch_item(name, error=f"Not allowed in batch: {name}")
+        error = self._check_put_params(params)
+        if error is not None:
+            return batch_item(name, error=error)
+        try:
+            self._regular_put(name, params)
+            return batch_item(name, value="OK")
+        except Exception as e:
+            return batch_item(name, error=repr(e))
+
+    def _run_batch(self, puts, gets):
+        """
+        Puts are done in given order and stop at the first failed one, as next ones may depend on it
+        (e.g. ROI on binning). Gets are done after puts, so they return values already set.
+        """
+        put_results = []
+        for item in puts:
+            if put_results and put_results[-1]["ErrorNumber"]:
+                put_results.append(batch_item(item.get("Name"), error="Skipped after failed put"))
+            else:
+                put_results.append(self._batch_put(item))
+        return {"Puts": put_results, "Gets": [self._batch_get(name) for name in gets]}
+
+    def _handle_get_batch(self, params):
+        if self._camera is None:
+            self._response_queue.put(Error("Camera not initialized!"))
+            return
+        self._response_queue.put(OK(self._run_batch([], parse_batch_gets(params.get("gets")))))
+
+    def _handle_set_batch(self, params):
+        """
+        Many properties in one command, e.g. all of them when client connects: Puts is a list of
+        {"Name": name, <Value>: value}, Gets a list of names.
+        """
+        if self._camera is None:
+            self._response_queue.put(Error("Camera not initialized!"))
+            return
+        puts = params.get("Puts") or []
+        if not isinstance(puts, list) or not all(isinstance(item, dict) for item in puts):
+            self._response_queue.put(Error("Puts has to be a list of objects with Name"))
+            return
+        self._response_queue.put(OK(self._run_batch(puts, parse_batch_gets(params.get("Gets")))))
+
+    def _read_frame(self):
+        slot = self._ring.next_slot()
+        length = self._camera.read_into(self._ring.writable(slot, self._camera.get_frame_size()))
+        width, height, _, image_type = self._camera.get_frame_format()
+        self._exposure_pending = False
+        frame = self._ring.publish(slot, width, height, image_type, length)
+        self._on_frame(frame, self._frame_array(frame), self._frame_context())
+        # Last frame is kept pinned, so that it can be reused until next one is read:
+        self._ring.pin(frame.slot)
+        if self._last_frame is not None:
+            self._ring.unpin(self._last_frame.slot)
+        self._last_frame = frame
+        return frame
+
+    def _frame_context(self):
+        """
+        Camera settings needed to process frames at readout, taken once per frame or once per continuous run
+        (and again when generation changes).
+        """
+        needs_settings = self._calibrator.is_enabled() or self._hot_pixels.is_enabled()
+        return {
+            "max_adu": self._camera.get_maxadu(),
+            "mosaic": self._camera.get_bayer_offsets() is not None,
+            "settings": self._camera.get_calibration_settings() if needs_settings else None
+        }
+
+    def _get_context_generation(self):
+        return self._context_generation
+
+    def _on_frame(self, frame, img, context):
+        """
+        Processing of every frame at readout - also called from continuous acquisition thread.
+        """
+        self._process_raw(img, context)
+        self._frame_stats.put(frame.sequence, compute_frame_stats(img, context["max_adu"]))
+        self._star_analyzer.process(frame.sequence, img, context["mosaic"])
+
+    def _process_raw(self, img, context):
+        """
+        Processing done for every frame, including ones captured to files: calibration and hot pixel correction
+        in place, and stacking.
+        """
+        settings = context["settings"]
+        if settings is not None:
+            self._calibrator.apply(img, settings)
+            indices = self._hot_pixels.indices_for(settings["roi"], settings["bin"], img.shape)
+            self._hot_pixels.correct(img, indices, context["mosaic"])
+        self._stack.add(img)
+
+    def _send_frame(self, frame, result=DONE_TOKEN, pinned=False):
+        """
+        Frame slot stays pinned until server side is done with sending it.
+        """
+        if not pinned:
+            self._ring.pin(frame.slot)
+        self._response_queue.put(OK(result))
+        self._data_pipe.send(frame)
+
+    @staticmethod
+    def _get_encoding(params):
+        encoding = params.get("Encoding") if params is not None else None
+        return encoding if encoding in compressors else None
+
+    def _send_image(self, frame, encoding=None, pinned=False):
+        """
+        Sends frame as raw image bytes, compressed with given codec if that makes it smaller.
+        Result passed to server side contains HTTP headers describing the data.
+        """
+        img = self._frame_array(frame)
+        headers = {
+            "X-Frame-Dtype": img.dtype.name,
+            "X-Frame-Shape": ",".join(str(d) for d in img.shape)
+        }
+        if encoding is not None:
+            slot = None
+            try:
+                slot = self._ring.next_slot(pin=True)
+                compressed = compress_frame(img, encoding, self._ring.writable(slot, frame.length))
+            except RuntimeError as e:
+                log.warning(f"Frame will not be compressed: {repr(e)}")
+                compressed = None
+            if compressed is None:
+                if slot is not None:
+                    self._ring.unpin(slot)
+            else:
+                length, itemsize = compressed
+                if pinned:
+                    self._ring.unpin(frame.slot)
+                frame = self._ring.publish(slot, frame.width, frame.height, frame.image_type, length,
+                                           sequence=frame.sequence)
+                pinned = True
+                headers.update({FRAME_ENCODING_HEADER: encoding, "X-Frame-Shuffle": str(itemsize)})
+        self._send_frame(frame, result=headers, pinned=pinned)
+
+    def _frame_array(self, frame):
+        if frame.dtype is not None:
+            return np.frombuffer(self._ring.view(frame), dtype=frame.dtype).reshape(frame.shape)
+        return frame_as_array(self._ring.view(frame), frame.width, frame.height, frame.image_type)
+
+    def _acquire_latest_frame(self):
+        """
+        :return: newest frame, pinned for the caller who has to unpin it after use (or None if there is none)
+        """
+        if self._acquisition is not None:
+            return self._acquisition.take_latest()
+        frame = self._get_exposed_frame() if self._camera is not None else None
+        if frame is not None:
+            self._ring.pin(frame.slot)
+        return frame
+
+    @staticmethod
+    def _get_debayer(mode, channel):
+        """
+        :return: (mode, channel) to debayer frames with, or None if no debayering was requested
+        """
+        if mode is None:
+            return None
+        if mode not in debayer_modes:
+            raise ValueError(f"Unknown debayer mode {mode}, expected one of {debayer_modes}")
+        if channel not in channels:
+            raise ValueError(f"Unknown channel {channel}, expected one of {channels}")
+        return mode, channel
+
+    def _debayer_frame(self, frame, debayer_params):
+        """
+        Debayers frame into new slot. Returned frame is pinned, source frame is left as it was.
+        Frames which are not raw color mosaics are returned as they are (pinned once more).
+        """
+        offsets = self._camera.get_bayer_offsets() if self._camera is not None else None
+        if debayer_params is None or offsets is None or frame.dtype is not None:
+            self._ring.pin(frame.slot)
+            return frame
+        mode, channel = debayer_params
+        width, height, image_type = debayered_format(frame.width, frame.height, frame.image_type, mode)
+        length = width * height * bytes_per_pixel[image_type]
+        slot = self._ring.next_slot(pin=True)
+        try:
+            debayer(self._frame_array(frame), offsets, mode, channel, out=self._ring.writable(slot, length))
+        except Exception:
+            self._ring.unpin(slot)
+            raise
+        return self._ring.publish(slot, width, height, image_type, length, sequence=frame.sequence)
+
+    def _handle_get_preview(self, params):
+        try:
+            factor = int(params.get("factor", DEFAULT_PREVIEW_FACTOR))
+            method = params.get("method", DEFAULT_PREVIEW_METHOD)
+            debayer_params = self._get_debayer(params.get("debayer"), params.get("channel", DEFAULT_DEBAYER_CHANNEL))
+            if factor < 2:
+                raise ValueError(f"Preview factor must be at least 2, got {factor}")
+            if method not in preview_methods:
+                raise ValueError(f"Unknown method {method}, expected one of {preview_methods}")
+        except (TypeError, ValueError) as e:
+            self._response_queue.put(Error("Could not extract params: " + repr(e)))
+            return
+        frame = self._acquire_latest_frame()
+        if frame is None:
+            self._response_queue.put(Error("No image available"))
+            return
+        source = None
+        slot = None
+        try:
+            source = self._debayer_frame(frame, debayer_params)
+            slot = self._ring.next_slot(pin=True)
+            reduced = bin_reduce(self._frame_array(source), factor, method,
+                                 out=self._ring.writable(slot, source.length))
+            preview = self._ring.publish_array(slot, reduced, sequence=frame.sequence)
+        except (RuntimeError, ValueError) as e:
+            if slot is not None:
+                self._ring.unpin(slot)
+            self._response_queue.put(Error("Could not prepare preview: " + repr(e)))
+            return
+        finally:
+            self._ring.unpin(frame.slot)
+            if source is not None:
+                self._ring.unpin(source.slot)
+        self._send_image(preview, encoding=self._get_encoding(params), pinned=True)
+
+    def _handle_get_thumbnail(self, params):
+        try:
+            size = int(params.get("size", DEFAULT_THUMBNAIL_SIZE))
+            file_format = params.get("format", DEFAULT_THUMBNAIL_FORMAT)
+            stretch = params.get("stretch", DEFAULT_THUMBNAIL_STRETCH)
+            debayer_params = self._get_debayer(params.get("debayer"), params.get("channel", DEFAULT_DEBAYER_CHANNEL))
+            if size < 1:
+                raise ValueError(f"Thumbnail size must be positive, got {size}")
+            if file_format not in thumbnail_formats:
+                raise ValueError(f"Unknown format {file_format}, expected one of {list(thumbnail_formats.keys())}")
+            if stretch not in stretch_methods:
+                raise ValueError(f"Unknown stretch {stretch}, expected one of {stretch_methods}")
+        except (TypeError, ValueError) as e:
+            self._response_queue.put(Error("Could not extract params: " + repr(e)))
+            return
+        frame = self._acquire_latest_frame()
+        if frame is None:
+            self._response_queue.put(Error("No image available"))
+            return
+        key = (frame.sequence, size, file_format, stretch, debayer_params)
+        source = None
+        slot = None
+        try:
+            data = self._thumbnails.get(key)
+            if data is None:
+                source = self._debayer_frame(frame, debayer_params)
+                data = make_thumbnail(self._frame_array(source), size, file_format, stretch)
+                self._thumbnails.put(key, data)
+            if len(data) > self._ring.get_slot_size():
+                raise ValueError(f"Thumbnail of {len(data)} bytes does not fit in frame slot")
+            slot = self._ring.next_slot(pin=True)
+            self._ring.writable(slot, len(data))[:] = data
+        except (RuntimeError, ValueError) as e:
+            if slot is not None:
+                self._ring.unpin(slot)
+            self._response_queue.put(Error("Could not prepare thumbnail: " + repr(e)))
+            return
+        finally:
+            self._ring.unpin(frame.slot)
+            if source is not None:
+                self._ring.unpin(source.slot)
+        thumbnail = self._ring.publish(slot, frame.width, frame.height, None, len(data), sequence=frame.sequence)
+        self._send_frame(thumbnail, result={"Content-Type": thumbnail_formats[file_format][1]}, pinned=True)
+
+    def _handle_get_thumbnailstats(self, params):
+        self._response_queue.put(OK(self._thumbnails.get_stats()))
+
+    def _handle_get_framestats(self, params):
+        try:
+            sequence = int(params["sequence"]) if params.get("sequence") is not None else None
+            bins = int(params["bins"]) if params.get("bins") is not None else None
+        except (TypeError, ValueError) as e:
+            self._response_queue.put(Error("Could not extract params: " + repr(e)))
+            return
+        record = self._frame_stats.get(sequence)
+        if record is None:
+            self._response_queue.put(Error(f"No statistics available for frame {sequence}"))
+            return
+        if bins is not None:
+            try:
+                record = dict(record, Histogram=rebin_histogram(record["Histogram"], bins))
+            except ValueError as e:
+                self._response_queue.put(Error(repr(e)))
+                return
+        self._response_queue.put(OK(record))
+
+    def _get_exposed_frame(self):
+        """
+        Frame of last exposure started with startexposure: downloaded from camera if it was not done yet.
+        None while that exposure is not ready - previous frame must not be served as if it was the new one.
+        """
+        if self._exposure_pending:
+            return self._read_frame() if self._camera.get_imageready() else None
+        return self._last_frame
+
+    def _no_exposed_frame_error(self):
+        return Error("Image not ready" if self._exposure_pending else "No image available")
+
+    def _handle_get_imagearray(self, params):
+        frame = self._get_exposed_frame() if self._camera is not None else None
+        if frame is None:
+            self._response_queue.put(self._no_exposed_frame_error())
+            return
+        img = frame_as_array(self._ring.view(frame), frame.width, frame.height, frame.image_type)
+        transposed, metadata = to_alpaca_layout(img)
+        self._response_queue.put(OK({"Type": metadata["ImageElementType"],
+                                     "Rank": metadata["Rank"],
+                                     "Value": transposed.tolist()}))
+
+    def _handle_get_imagearraybytes(self, params):
+        frame = self._get_exposed_frame() if self._camera is not None else None
+        if frame is None:
+            self._response_queue.put(self._no_exposed_frame_error())
+            return
+        img = frame_as_array(self._ring.view(frame), frame.width, frame.height, frame.image_type)
+        slot = self._ring.next_slot()
+        _, metadata = to_alpaca_layout(img, out=self._ring.writable(slot, frame.length))
+        alpaca_frame = self._ring.publish(slot, frame.width, frame.height, frame.image_type, frame.length,
+                                          sequence=frame.sequence)
+        self._send_frame(alpaca_frame, result=metadata)
+
+    def _handle_get_imagebytes(self, params):
+        try:
+            frame = self._read_frame()
+        except SlotsBusyError:
+            self._response_queue.put(Error("All frame slots busy"))
+            return
+        self._send_image(frame, encoding=self._get_encoding(params))
 
     def _handle_put(self, command_raw):
         command_name = command_raw.get_name()
@@ -202,19 +724,12 @@ class CameraProcessor:
         if self._camera is None:
             self._response_queue.put(Error("Regular put: Camera not initialized!"))
             return
-        if params is None:
-            self._response_queue.put(Error("No params passed for put method"))
-            return
-
-        params_no = len(params)
-        if params_no > 1:
-            self._response_queue.put(Error(f"Expecting only one argument, got {params_no}"))
+        error = self._check_put_params(params)
+        if error is not None:
+            self._response_queue.put(Error(error))
             return
         try:
-            value = list(params.values())[0]
-            method_name = "set_"+command_name
-            log.debug(f"Calling method {method_name}")
-            getattr(self._camera, method_name)(value)
+            self._regular_put(command_name, params)
             self._response_queue.put(OK("OK"))
         except KeyError as ke:
             self._response_queue.put(Error("Missing params: " + repr(ke)))
@@ -223,38 +738,317 @@ class CameraProcessor:
         except Exception as e:
             self._response_queue.put(Error("Unknown exception: " + repr(e)))
 
+    @staticmethod
+    def _check_put_params(params):
+        """
+        :return: error message if params do not hold exactly one value, None otherwise
+        """
+        if params is None:
+            return "No params passed for put method"
+        params_no = len(params)
+        if params_no > 1:
+            return f"Expecting only one argument, got {params_no}"
+        return None
+
+    def _regular_put(self, command_name, params):
+        value = list(params.values())[0]
+        method_name = "set_"+command_name
+        log.debug(f"Calling method {method_name}")
+        getattr(self._camera, method_name)(value)
+
     def _handle_unusual_put(self, command_name, params):
         mapped_handle = self._unusual_put_method_map[command_name]
         mapped_handle(params)
 
     def _handle_start_continuous(self, params):
         log.debug("Starting continuous imaging!")
+        if self._camera is None:
+            self._response_queue.put(Error("Camera not initialized!"))
+            return
+        try:
+            duration = float(params["Exposure"])
+        except (KeyError, TypeError, ValueError) as e:
+            self._response_queue.put(Error("Could not extract params: " + repr(e)))
+            return
+        self._acquisition = ContinuousAcquisition(self._camera, self._ring, duration, log, self._on_frame,
+                                                  self._frame_context, self._get_context_generation)
+        self._acquisition.start()
         self._continuous = True
         self._response_queue.put(OK(DONE_TOKEN))
-        duration = float(params["Exposure"])
-        self._continuous_exp = duration
-        self._camera.startexposure(duration=duration, light=True)
 
-    def _handle_stop_continuous(self, params):
-        log.debug("Starting continuous imaging!")
+    def _stop_acquisition(self):
+        if self._acquisition is not None:
+            self._acquisition.stop()
+            log.info(f"Continuous imaging stopped: {self._acquisition.get_stats()}")
+            self._acquisition = None
         self._continuous = False
+
+    def _handle_stop_continuous(self, params):
+        log.debug("Stopping continuous imaging!")
+        self._stop_acquisition()
         self._response_queue.put(OK(DONE_TOKEN))
 
-    def _get_current_image(self):
-        if not self._camera.get_imageready():
+    def _get_current_image(self, params):
+        frame = self._acquisition.take_latest() if self._acquisition is not None else None
+        if frame is None:
             self._response_queue.put(OK(BUSY_TOKEN))
             return
+        self._send_image(frame, encoding=self._get_encoding(params), pinned=True)
 
-        imagebytes, length = self._camera.get_imagebytes()
+    def _handle_get_continuousstats(self, params):
+        if self._acquisition is None:
+            self._response_queue.put(Error("Continuous imaging not running!"))
+            return
+        self._response_queue.put(OK(self._acquisition.get_stats()))
+
+    def _handle_get_writerstats(self, params):
+        self._response_queue.put(OK(self._writer.get_stats()))
+
+    def _handle_get_starmetrics(self, params):
+        try:
+            sequence = int(params["sequence"]) if params.get("sequence") is not None else None
+        except (TypeError, ValueError) as e:
+            self._response_queue.put(Error("Could not extract params: " + repr(e)))
+            return
+        metrics = self._star_analyzer.get_metrics(sequence)
+        if metrics is None:
+            self._response_queue.put(Error(f"No star metrics available for frame {sequence}"))
+            return
+        self._response_queue.put(OK(metrics))
+
+    def _handle_get_stackimage(self, params):
+        kind = params.get("kind", "mean")
+        dtype = params.get("dtype", "uint16")
+        if kind not in stack_images or dtype not in stack_dtypes:
+            self._response_queue.put(Error(f"Unknown stack image {kind} of {dtype}, expected one of {stack_images} "
+                                           f"of {list(stack_dtypes.keys())}"))
+            return
+        shape = self._stack.get_stats()["Shape"]
+        if shape is None:
+            self._response_queue.put(Error("Live stack is empty"))
+            return
+        length = int(np.prod(shape)) * np.dtype(stack_dtypes[dtype]).itemsize
+        if length > self._ring.get_slot_size():
+            self._response_queue.put(Error(f"Stack image of {length} bytes does not fit in frame slot"))
+            return
+        try:
+            slot = self._ring.next_slot(pin=True)
+        except RuntimeError as e:
+            self._response_queue.put(Error("Could not prepare stack image: " + repr(e)))
+            return
+        image = self._stack.render(kind, stack_dtypes[dtype], self._ring.writable(slot, length))
+        if image is None:
+            self._ring.unpin(slot)
+            self._response_queue.put(Error("Live stack is empty"))
+            return
+        self._send_image(self._ring.publish_array(slot, image), encoding=self._get_encoding(params),
+                         pinned=True)
+
+    def _handle_get_stack(self, params):
+        self._response_queue.put(OK(self._stack.get_stats()))
+
+    def _handle_set_stack(self, params):
+        try:
+            current = self._stack.get_stats()
+            self._stack.configure(enabled=params.get("Enabled", current["Enabled"]),
+                                  kappa=params.get("Kappa", current["Kappa"]),
+                                  min_frames=params.get("MinFrames", current["MinFrames"]))
+        except (TypeError, ValueError) as e:
+            self._response_queue.put(Error("Could not configure live stack: " + repr(e)))
+            return
+        self._response_queue.put(OK(DONE_TOKEN))
+
+    def _handle_set_stackreset(self, params):
+        self._stack.reset()
+        self._response_queue.put(OK(DONE_TOKEN))
+
+    def _handle_get_calibration(self, params):
+        self._response_queue.put(OK(self._calibrator.get_stats()))
+
+    def _handle_set_calibration(self, params):
+        try:
+            current = self._calibrator.get_stats()
+            self._calibrator.configure(enabled=params.get("Enabled", current["Enabled"]),
+                                       temperature_bucket=params.get("TemperatureBucket",
+                                                                     current["TemperatureBucket"]))
+        except (TypeError, ValueError) as e:
+            self._response_queue.put(Error("Could not configure calibration: " + repr(e)))
+            return
+        self._context_generation += 1
+        self._response_queue.put(OK(DONE_TOKEN))
+
+    def _handle_set_calibrationcapture(self, params):
+        """
+        Takes frames for master bias, dark or flat and stores combined master. Runs like capture.
+        """
+        try:
+            kind = params["Kind"]
+            number = int(params["Number"])
+            method = params.get("Method", COMBINE_MEDIAN)
+            if kind not in calibration_kinds:
+                raise ValueError(f"Unknown kind {kind}, expected one of {calibration_kinds}")
+            if method not in combine_methods:
+                raise ValueError(f"Unknown method {method}, expected one of {combine_methods}")
+            if kind == CALIBRATION_BIAS:
+                duration_s = self._camera.get_exposuremin() if self._camera is not None else 0
+            else:
+                duration_s = float(params["Duration"])
+        except KeyError as ke:
+            self._response_queue.put(Error("Missing params: " + repr(ke)))
+            return
+        except (TypeError, ValueError) as e:
+            self._response_queue.put(Error("Could not extract params: " + repr(e)))
+            return
+
+        if self._camera is None:
+            self._response_queue.put(Error("Camera not initialized!"))
+            return
+        self._capturing = True
+        self._response_queue.put(OK(BUSY_TOKEN))
+        try:
+            self._camera.set_exposure(duration_s)
+            width, height, _, image_type = self._camera.get_frame_format()
+            settings = self._camera.get_calibration_settings()
+            builder = self._calibrator.new_builder(number, method)
+            buffer = bytearray(self._camera.get_frame_size())
+            self._camera.startexposure(duration=duration_s, light=kind == CALIBRATION_FLAT)
+            for i in range(0, number):
+                self._camera.wait_for_exposure()
+                self._camera.read_into(buffer)
+                if i + 1 < number:
+                    self._camera.startexposure(duration=duration_s, light=kind == CALIBRATION_FLAT)
+                builder.add(frame_as_array(buffer, width, height, image_type))
+                self._progress(f"{i+1}/{number}")
+            entry = self._calibrator.store(kind, settings, builder.finish())
+        except Exception as e:
+            self._response_queue.put(Error("Calibration capture failed: " + repr(e)))
+            self._capturing = False
+            return
+        log.info(f"Master {kind} done: {entry['file']}")
+        self._response_queue.put(OK(DONE_TOKEN))
+        self._capturing = False
+
+    def _handle_get_hotpixels(self, params):
+        self._response_queue.put(OK(self._hot_pixels.get_stats()))
+
+    def _handle_set_hotpixels(self, params):
+        if "Enabled" not in params:
+            self._response_queue.put(Error("Missing params: 'Enabled'"))
+            return
+        self._hot_pixels.set_enabled(params["Enabled"])
+        self._context_generation += 1
+        self._response_queue.put(OK(DONE_TOKEN))
+
+    def _handle_set_hotpixelmap(self, params):
+        """
+        Takes dark frames and builds hot pixel map from their mean. Has to be done without binning.
+        """
+        try:
+            number = int(params["Number"])
+            duration_s = float(params["Duration"])
+            sigma = float(params.get("Threshold", DEFAULT_HOT_PIXEL_SIGMA))
+            if number < 1 or sigma <= 0:
+                raise ValueError(f"Number and threshold must be positive, got {number} and {sigma}")
+        except KeyError as ke:
+            self._response_queue.put(Error("Missing params: " + repr(ke)))
+            return
+        except (TypeError, ValueError) as e:
+            self._response_queue.put(Error("Could not extract params: " + repr(e)))
+            return
+
+        if self._camera is None:
+            self._response_queue.put(Error("Camera not initialized!"))
+            return
+        settings = self._camera.get_calibration_settings()
+        if settings["bin"] != 1:
+            self._response_queue.put(Error("Hot pixel map has to be built without binning"))
+            return
+        self._capturing = True
+        self._response_queue.put(OK(BUSY_TOKEN))
+        try:
+            self._camera.set_exposure(duration_s)
+            width, height, _, image_type = self._camera.get_frame_format()
+            builder = self._calibrator.new_builder(number, COMBINE_MEAN)
+            buffer = bytearray(self._camera.get_frame_size())
+            self._camera.startexposure(duration=duration_s, light=False)
+            for i in range(0, number):
+                self._camera.wait_for_exposure()
+                self._camera.read_into(buffer)
+                if i + 1 < number:
+                    self._camera.startexposure(duration=duration_s, light=False)
+                img = frame_as_array(buffer, width, height, image_type)
+                if img.ndim != 2:
+                    raise ValueError("Hot pixel map needs mono or raw frames")
+                builder.add(img)
+                self._progress(f"{i+1}/{number}")
+            self._hot_pixels.build(builder.finish(), settings["roi"], self._camera.get_cameraxsize(), sigma)
+        except Exception as e:
+            self._response_queue.put(Error("Hot pixel map capture failed: " + repr(e)))
+            self._capturing = False
+            return
+        self._response_queue.put(OK(DONE_TOKEN))
+        self._capturing = False
+
+    def _handle_get_focusmetric(self, params):
+        """
+        Focus metric of newest frame: median HFR of stars (lower is better) or Laplacian variance (higher is better).
+        """
+        method = params.get("method", FOCUS_METRIC_HFR)
+        if method not in focus_metrics:
+            self._response_queue.put(Error(f"Unknown method {method}, expected one of {focus_metrics}"))
+            return
+        frame = self._acquire_latest_frame()
+        if frame is None:
+            self._response_queue.put(Error("No image available"))
+            return
+        ss = time.time()
+        try:
+            img = self._frame_array(frame)
+            mosaic = frame.dtype is None and self._camera.get_bayer_offsets() is not None
+            if method == FOCUS_METRIC_HFR:
+                stars = detect_stars(img, mosaic=mosaic)
+                value, star_count = stars["HFR"], stars["StarCount"]
+            else:
+                value, star_count = laplacian_variance(img, mosaic=mosaic), None
+        finally:
+            self._ring.unpin(frame.slot)
+        if value is None:
+            self._response_queue.put(Error(f"No stars found in frame {frame.sequence}"))
+            return
+        self._response_queue.put(OK({"Sequence": frame.sequence,
+                                     "Method": method,
+                                     "Value": value,
+                                     "StarCount": star_count,
+                                     "ComputeTime": time.time() - ss}))
+
+    def _handle_get_staranalysis(self, params):
+        self._response_queue.put(OK(self._star_analyzer.get_stats()))
+
+    def _handle_set_staranalysis(self, params):
+        try:
+            current = self._star_analyzer.get_stats()
+            self._star_analyzer.configure(enabled=params.get("Enabled", current["Enabled"]),
+                                          budget=params.get("Budget", current["Budget"]),
+                                          threshold_sigma=params.get("Threshold", current["Threshold"]))
+        except (TypeError, ValueError) as e:
+            self._response_queue.put(Error("Could not configure star analysis: " + repr(e)))
+            return
+        self._response_queue.put(OK(DONE_TOKEN))
+
+    def _handle_set_writerconfig(self, params):
+        try:
+            current = self._writer.get_stats()
+            self._writer.configure(threads=params.get("Threads", current["Threads"]),
+                                   depth=params.get("Depth", current["Depth"]),
+                                   policy=params.get("Policy", current["Policy"]))
+        except (TypeError, ValueError) as e:
+            self._response_queue.put(Error("Could not configure writer: " + repr(e)))
+            return
         self._response_queue.put(OK(DONE_TOKEN))
-        self._camera.startexposure(duration=self._continuous_exp, light=True)
-        self._data_pipe.send((imagebytes, length))
 
     def _handle_instant_capture(self, params):
         log.debug("Starting instant capture!")
         max_instant_capture_duration_s = 5
-        instant_capture_wait_increment_s = 0.1
-        instant_capture_max_counter = 10 + int(max_instant_capture_duration_s/instant_capture_wait_increment_s)
         duration = float(params["Duration"])
         light = bool(params["Light"])
         if duration > max_instant_capture_duration_s:
@@ -263,36 +1057,61 @@ class CameraProcessor:
                       f"while requested {duration}"))
             return
         self._camera.startexposure(duration=duration, light=light)
-        for i in range(0, instant_capture_max_counter):
-            if self._camera.get_imageready():
-                imagebytes, length = self._camera.get_imagebytes()
-                self._response_queue.put(OK(DONE_TOKEN))
-                self._data_pipe.send((imagebytes, length))
-                return
-            time.sleep(instant_capture_wait_increment_s)
-        self._response_queue.put(
-            Error(f"Timeout: Could not get instant image on time!"))
-        return
+        try:
+            self._camera.wait_for_exposure(timeout_s=duration + INSTANT_CAPTURE_TIMEOUT_S)
+        except Exception as e:
+            self._response_queue.put(Error(f"Could not get instant image on time: {repr(e)}"))
+            return
+        try:
+            frame = self._read_frame()
+        except SlotsBusyError:
+            self._response_queue.put(Error("All frame slots busy"))
+            return
+        self._send_image(frame, encoding=self._get_encoding(params))
 
     def _handle_set_init(self, params):
         if self._camera is not None:
+            self._stop_acquisition()
             self._response_queue.put(OK("Done init"))
-            self._continuous = False
         else:
             self._camera = ZwoCamera(camera_index=self._camera_id)
+            self._camera.set_event_listener(self._publish_event)
+            # live stack images are served from frame slots too, float32 ones are larger than raw frames:
+            self._ring.create(max([self._camera.get_max_frame_size()] +
+                                  [self._camera.get_max_converted_size(dtype) for dtype in stack_dtypes.values()]))
             self._response_queue.put(Error("Failed to initialize"))
 
     def _handle_set_startexposure(self, params):
         duration = float(params["Duration"])
         light = bool(params["Light"])
         self._camera.startexposure(duration=duration, light=light)
+        self._exposure_pending = True
+        # waits for end of exposure in background, so that image_ready event is published right when it is done:
+        Thread(target=self._watch_exposure, args=(duration,), daemon=True).start()
         self._response_queue.put(OK(DONE_TOKEN))
 
+    def _watch_exposure(self, duration):
+        try:
+            self._camera.wait_for_exposure(timeout_s=duration + EXPOSURE_WATCH_TIMEOUT_S)
+        except Exception as e:
+            log.warning(f"Waiting for exposure failed: {repr(e)}")
+
+    def _handle_get_exposuretiming(self, params):
+        if self._camera is None:
+            self._response_queue.put(Error("Camera not initialized!"))
+            return
+        self._response_queue.put(OK(self._camera.get_exposure_timing()))
+
     def _handle_set_capture(self, params):
         print(f"Handling capture with params: {params}!")
         try:
             duration_s = float(params["Duration"])
             number = int(params["Number"])
+            pipelined = parse_bool(params.get("Pipelined", True))
+            file_format = params.get("Format", DEFAULT_FILE_FORMAT)
+            if file_format not in frame_writers:
+                raise ValueError(f"Unknown format {file_format}, expected one of {list(frame_writers.keys())}")
+            debayer_params = self._get_debayer(params.get("Debayer"), params.get("Channel", DEFAULT_DEBAYER_CHANNEL))
         except KeyError as ke:
             self._response_queue.put(Error("Missing params: " + repr(ke)))
             return
@@ -309,27 +1128,336 @@ class CameraProcessor:
         self._capturing = True
         self._response_queue.put(OK(BUSY_TOKEN))
 
+        self._camera.set_debayer_mode(debayer_params[0] if debayer_params is not None else None)
         self._camera.set_exposure(duration_s)
         ss = time.time()
         try:
-            for i in range(0, number):
-                print(f"Capturing file {i}")
-                fn = self._filename_generator.generate()
-                self._camera.capture(fn)
-                self._response_queue.put(OK(f"{i+1}/{number}"))
-        except PermissionError as pe:
+            if pipelined:
+                self._capture_pipelined(duration_s, number, file_format, debayer_params)
+            else:
+                self._capture_serial(duration_s, number, file_format, debayer_params)
+        except PermissionError:
             self._response_queue.put(Error("Permissions problems! Try running with sudo"))
             self._capturing = False
             return
+        except Exception as e:
+            self._response_queue.put(Error("Capture failed: " + repr(e)))
+            self._capturing = False
+            return
 
         print(f"Capturing done! It took {time.time() - ss} s")
         self._response_queue.put(OK(DONE_TOKEN))
         self._capturing = False
 
+    def _handle_set_sequence(self, params):
+        """
+        Captures a plan of steps, each with its own exposure, settings, count and output. Progress is published
+        as sequence events, so it can be read while camera process is busy.
+        """
+        try:
+            plan = parse_plan(params)
+            debayer_params = self._get_debayer(params.get("Debayer"), params.get("Channel", DEFAULT_DEBAYER_CHANNEL))
+        except (ValueError, TypeError) as e:
+            self._response_queue.put(Error("Invalid plan: " + repr(e)))
+            return
+        if self._camera is None:
+            self._response_queue.put(Error("Camera not initialized!"))
+            return
+        self._capturing = True
+        self._response_queue.put(OK(BUSY_TOKEN))
+
+        progress = SequenceProgress(plan)
+        self._camera.set_debayer_mode(debayer_params[0] if debayer_params is not None else None)
+        try:
+            self._capture_sequence(plan, progress, debayer_params)
+        except PermissionError as pe:
+            progress.finish(repr(pe))
+            self._publish_event(EVENT_SEQUENCE, progress.get())
+            self._response_queue.put(Error("Permissions problems! Try running with sudo"))
+            self._capturing = False
+            return
+        except Exception as e:
+            progress.finish(repr(e))
+            self._publish_event(EVENT_SEQUENCE, progress.get())
+            self._response_queue.put(Error("Sequence failed: " + repr(e)))
+            self._capturing = False
+            return
+
+        progress.finish()
+        self._publish_event(EVENT_SEQUENCE, progress.get())
+        log.info(f"Sequence done: {progress.get()['StepStats']}")
+        self._response_queue.put(OK(DONE_TOKEN))
+        self._capturing = False
+
+    def _sequence_settings(self):
+        return {name: self._regular_get(prop) for name, prop in setting_properties.items()}
+
+    def _start_sequence_step(self, plan, position, current, progress):
+        """
+        Applies only settings which differ from current ones, in the order they depend on each other,
+        and starts first exposure of the step.
+        :return: settings camera has now
+        """
+        ss = time.time()
+        step = plan[position]
+        changes = settings_changes(current, step)
+        for name, value in changes:
+            self._regular_put(setting_properties[name], {name: value})
+        # binning or ROI change may adjust other format settings, so they are read back:
+        current = self._sequence_settings() if changes_format(changes) else dict(current, **dict(changes))
+        self._camera.startexposure(duration=step.duration, light=step.light)
+        progress.step_started(position, time.time() - ss)
+        return current
+
+    def _sequence_segment(self, debayer_params):
+        """
+        :return: (Bayer offsets or None, width, height, image_type, raw buffer or None) for current frame format
+        """
+        offsets, width, height, image_type = self._capture_format(debayer_params)
+        # frames of previous segment are written before buffers are reallocated, their failure ends sequence:
+        error = self._writer.reserve(width * height * bytes_per_pixel[image_type])
+        if error is not None:
+            raise error
+        raw = bytearray(self._camera.get_frame_size()) if offsets is not None else None
+        return offsets, width, height, image_type, raw
+
+    def _capture_sequence(self, plan, progress, debayer_params=None):
+        """
+        Pipelined like capture: next exposure is started right after readout, before frame is processed - also
+        across steps, unless next step changes frame format. Then camera is reconfigured after processing.
+        """
+        frames = [(position, i) for position, step in enumerate(plan) for i in range(0, step.number)]
+        current = self._start_sequence_step(plan, 0, self._sequence_settings(), progress)
+        segment = self._sequence_segment(debayer_params)
+        context = self._frame_context()
+        fields = self._camera.get_header_fields()
+        try:
+            for j, (position, i) in enumerate(frames):
+                step = plan[position]
+                offsets, width, height, image_type, raw = segment
+                self._camera.wait_for_exposure()
+                buffer = self._writer.acquire_buffer()
+                self._camera.read_into(buffer if offsets is None else raw)
+                header = self._camera.get_frame_header(fields)
+                frame_context = context
+                next_position = frames[j + 1][0] if j + 1 < len(frames) else None
+                reconfigure = False
+                if next_position == position:
+                    self._camera.startexposure(duration=step.duration, light=step.light)
+                    fields["temperature"] = self._camera.get_ccdtemperature()
+                elif next_position is not None:
+                    reconfigure = changes_format(settings_changes(current, plan[next_position]))
+                    if not reconfigure:
+                        current = self._start_sequence_step(plan, next_position, current, progress)
+                        context = self._frame_context()
+                        fields = self._camera.get_header_fields()
+                self._process_raw_buffer(buffer if offsets is None else raw, frame_context)
+                if offsets is not None:
+                    self._debayer_buffer(raw, buffer, offsets, debayer_params)
+                self._writer.submit(self._filename_generator.generate(step.file_format, step.path), buffer,
+                                    width, height, image_type, step.file_format, header)
+                progress.frame_done(position)
+                state = progress.get()
+                self._progress(f"{state['Frame']}/{state['Frames']}, step {position + 1}/{state['Steps']}, "
+                               f"ETA {state['ETA']:.1f} s")
+                self._publish_event(EVENT_SEQUENCE, state)
+                if reconfigure:
+                    current = self._start_sequence_step(plan, next_position, current, progress)
+                    segment = self._sequence_segment(debayer_params)
+                    context = self._frame_context()
+                    fields = self._camera.get_header_fields()
+        finally:
+            error = self._writer.flush()
+        if error is not None:
+            raise error
+
+    def _handle_set_triggeredcapture(self, params):
+        """
+        Part of array capture: each exposure is started when all cameras of the job have passed array trigger.
+        Start times are published as trigger events, so that server can tell skew between cameras.
+        """
+        try:
+            job = int(params["Job"])
+            duration_s = float(params["Duration"])
+            number = int(params.get("Number", 1))
+            light = parse_bool(params.get("Light", True))
+            file_format = params.get("Format", DEFAULT_FILE_FORMAT)
+            if file_format not in frame_writers:
+                raise ValueError(f"Unknown format {file_format}, expected one of {list(frame_writers.keys())}")
+        except KeyError as ke:
+            self._response_queue.put(Error("Missing params: " + repr(ke)))
+            return
+        except (TypeError, ValueError) as e:
+            self._response_queue.put(Error("Could not extract params: " + repr(e)))
+            return
+        if self._camera is None or self._trigger is None:
+            self._response_queue.put(Error("Camera not initialized or not part of array!"))
+            return
+        self._capturing = True
+        self._response_queue.put(OK(BUSY_TOKEN))
+
+        try:
+            self._capture_triggered(job, duration_s, number, light, file_format)
+        except Exception as e:
+            self._trigger.abort()  # other cameras would wait for this one otherwise
+            self._publish_event(EVENT_TRIGGER_END, {"Job": job, "Error": repr(e)})
+            self._response_queue.put(Error("Array capture failed: " + repr(e)))
+            self._capturing = False
+            return
+        self._publish_event(EVENT_TRIGGER_END, {"Job": job, "Error": None})
+        self._response_queue.put(OK(DONE_TOKEN))
+        self._capturing = False
+
+    def _start_triggered(self, job, frame, duration_s, light):
+        self._trigger.wait(job)
+        start = time.time()
+        self._camera.startexposure(duration=duration_s, light=light)
+        self._publish_event(EVENT_TRIGGER, {"Job": job, "Frame": frame, "Start": start,
+                                            "StartLatency": time.time() - start})
+
+    def _capture_triggered(self, job, duration_s, number, light, file_format):
+        """
+        Pipelined like capture, but next exposure is started only when all cameras have read out their frame.
+        """
+        # exposure is set in advance, so that starting it right after trigger is one call only:
+        self._camera.set_exposure(duration_s)
+        offsets, width, height, image_type, _ = self._sequence_segment(None)
+        context = self._frame_context()
+        fields = self._camera.get_header_fields()
+        self._start_triggered(job, 0, duration_s, light)
+        try:
+            for i in range(0, number):
+                self._camera.wait_for_exposure()
+                buffer = self._writer.acquire_buffer()
+                self._camera.read_into(buffer)
+                header = self._camera.get_frame_header(fields)
+                if i + 1 < number:
+                    self._start_triggered(job, i + 1, duration_s, light)
+                    fields["temperature"] = self._camera.get_ccdtemperature()
+                self._process_raw_buffer(buffer, context)
+                self._writer.submit(self._filename_generator.generate(file_format, os.path.join(f"array_{job:05d}",
+                                                                                 f"camera_{self._camera_id}")),
+                                    buffer, width, height, image_type, file_format, header)
+                self._progress(f"{i+1}/{number}")
+        finally:
+            error = self._writer.flush()
+        if error is not None:
+            raise error
+
+    def _capture_format(self, debayer_params):
+        """
+        :return: (Bayer offsets or None, width, height, image_type) of frames that will be written to files
+        """
+        width, height, _, image_type = self._camera.get_frame_format()
+        offsets = self._camera.get_bayer_offsets() if debayer_params is not None else None
+        if offsets is None:
+            return None, width, height, image_type
+        return (offsets,) + debayered_format(width, height, image_type, debayer_params[0])
+
+    def _debayer_buffer(self, raw, buffer, offsets, debayer_params):
+        width, height, _, image_type = self._camera.get_frame_format()
+        mode, channel = debayer_params
+        debayer(frame_as_array(raw, width, height, image_type), offsets, mode, channel, out=buffer)
+
+    def _process_raw_buffer(self, buffer, context):
+        width, height, _, image_type = self._camera.get_frame_format()
+        self._process_raw(frame_as_array(buffer, width, height, image_type), context)
+
+    def _capture_serial(self, duration_s, number, file_format, debayer_params=None):
+        offsets, width, height, image_type = self._capture_format(debayer_params)
+        output = bytearray(width * height * bytes_per_pixel[image_type]) if offsets is not None else None
+        fields = self._camera.get_header_fields()
+        for i in range(0, number):
+            print(f"Capturing file {i}")
+            self._camera.startexposure(duration=duration_s, light=True)
+            if i > 0:
+                fields["temperature"] = self._camera.get_ccdtemperature()
+            self._camera.wait_for_exposure()
+            buffer, _ = self._camera.get_imagebytes()
+            self._process_raw_buffer(buffer, self._frame_context())
+            if offsets is not None:
+                self._debayer_buffer(buffer, output, offsets, debayer_params)
+                buffer = output
+            save_frame(self._filename_generator.generate(file_format), buffer, width, height, image_type,
+                       file_format, self._camera.get_frame_header(fields))
+            self._progress(f"{i+1}/{number}")
+
+    def _capture_pipelined(self, duration_s, number, file_format, debayer_params=None):
+        offsets, width, height, image_type = self._capture_format(debayer_params)
+        error = self._writer.reserve(width * height * bytes_per_pixel[image_type])
+        if error is not None:
+            raise error
+        raw = bytearray(self._camera.get_frame_size()) if offsets is not None else None
+        context = self._frame_context()
+        fields = self._camera.get_header_fields()
+        ss = time.time()
+        self._camera.startexposure(duration=duration_s, light=True)
+        try:
+            for i in range(0, number):
+                self._camera.wait_for_exposure()
+                buffer = self._writer.acquire_buffer()
+                self._camera.read_into(buffer if offsets is None else raw)
+                header = self._camera.get_frame_header(fields)
+                if i + 1 < number:
+                    self._camera.startexposure(duration=duration_s, light=True)
+                    # read while next frame is being exposed:
+                    fields["temperature"] = self._camera.get_ccdtemperature()
+                self._process_raw_buffer(buffer if offsets is None else raw, context)
+                if offsets is not None:
+                    # done while the next frame is being exposed:
+                    self._debayer_buffer(raw, buffer, offsets, debayer_params)
+                self._writer.submit(self._filename_generator.generate(file_format), buffer, width, height, image_type,
+                                    file_format, header)
+                duty_cycle = (i + 1) * duration_s / (time.time() - ss)
+                self._progress(f"{i+1}/{number}, duty cycle {duty_cycle:.2f}, "
+                               f"writer queue {self._writer.get_queue_depth()}")
+        finally:
+            error = self._writer.flush()
+        if error is not None:
+            raise error
+        log.info(f"Pipelined capture of {number} frames, duty cycle {number * duration_s / (time.time() - ss):.2f}")
+
+
+def create_camera_process(cid: int, cname: str, trigger: ArrayTrigger = None):
+    """
+    :param trigger: shared by camera processes of the array, so that they can start exposures together
+    """
+    kill_event = Event()
+    command_queue = Queue()
+    result_queue = Queue()
+    data_pipe_recv, data_pipe_send = Pipe()
+    ring = FrameRing(cid)
+    mirror = PropertyMirror()
+    event_queue = Queue()
+
+    info = CameraProcessInfo(cid=cid,
+                             command=command_queue,
+                             result=result_queue,
+                             data=data_pipe_send,
+                             ke=kill_event,
+                             ring=ring,
+                             mirror=mirror,
+                             events=event_queue,
+                             trigger=trigger)
+    p = Process(target=camera_process, args=(info,))
+    p.start()
+    demux = ResultDemultiplexer(command_queue, result_queue, data_pipe_recv, ring)
+
+    return CameraProcessHandle(info, p, cname,
+                               result_queue=result_queue,
+                               command_queue=command_queue,
+                               data_pipe=data_pipe_recv,
+                               ring=ring,
+                               demux=demux,
+                               mirror=mirror,
+                               events=EventBroadcaster(event_queue))
+
 
 def camera_process(info: CameraProcessInfo):
     global log
     log = add_log(f"camera_{info.camera_id}")
     cp = CameraProcessor(info)
     cp.run()
+    cp.shutdown()
+    info.ring.close()
     log.info("Camera process ended!")
@@ -1,32 +1,67 @@
-from .camera_process import CameraProcessHandle, DONE_TOKEN, BUSY_TOKEN
+from .camera_process import CameraProcessHandle, DONE_TOKEN, BUSY_TOKEN, mirrored_get_methods, parse_batch_gets, \
+    batch_item
 from .camera_server_utils import CameraSimpleGETCommand, CameraSimplePUTCommand, \
-    extract_client_and_transaction_id_for_put, create_ascom_response_dict
+    split_client_and_transaction_id, extract_command_params_for_get, create_ascom_response_dict, \
+    create_imagebytes_metadata
 from .utils import add_timestamp_before, add_timestamp_after
+from .frame_ring import FrameStream
+from .frame_compression import negotiate_encoding, FRAME_ENCODING_HEADER
+from .property_mirror import DEFAULT_MIRROR_MAX_AGE_S
+from .request_routing import PendingRequest, DEFAULT_RESULT_TIMEOUT_S
+from .camera_events import EventStream, image_events, EVENT_EXPOSURE_STARTED, EVENT_EXPOSURE_FAILED, EVENT_SEQUENCE, \
+    EVENT_KEEPALIVE_S
 
 import falcon
 import logging
 import json
-from multiprocessing import Queue
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from threading import BoundedSemaphore
 from traceback import format_exc
 import os
 import glob
+import time
 
 
 log = logging.getLogger('main')
 capture_path = os.path.join(os.getcwd(), "capture")
 
+image_get_methods = [
+    "imagebytes",
+    "currentimage",
+    "preview",
+    "thumbnail",
+    "stackimage"
+]
+
+event_get_methods = [
+    "waitforimage",
+    "events",
+    "sequence"
+]
+
+MAX_WAIT_FOR_IMAGE_S = 300
+# Event streams and waits for image hold WSGI server thread all the time (waitress has 4 by default),
+# beyond this number they are refused, so that threads are left for other requests. ASGI is not limited.
+DEFAULT_MAX_EVENT_WAITERS = 2
+
+content_types_by_extension = {
+    ".tif": "image/tif",
+    ".fits": "image/fits",
+    ".npy": "application/octet-stream"
+}
+
 
 def get_latest_file_name():
     cwd_contents = [os.path.join(capture_path, d) for d in os.listdir(capture_path)]
     all_subdirs = [d for d in cwd_contents if os.path.isdir(d)]
     latest_subdir = max(all_subdirs, key=os.path.getmtime)
-    list_of_files = glob.glob(latest_subdir+"/*.tif")
+    list_of_files = [f for f in glob.glob(latest_subdir+"/*") if os.path.splitext(f)[1] in content_types_by_extension]
     latest_file = max(list_of_files, key=os.path.getctime)
     return latest_file
 
 
 def retrieve_file_image(resp, filename):
-    resp.content_type = "image/tif"
+    resp.content_type = content_types_by_extension.get(os.path.splitext(filename)[1], "application/octet-stream")
     stream = open(filename, 'rb')
     content_length = os.path.getsize(filename)
     resp.stream, resp.content_length = stream, content_length
@@ -51,9 +86,14 @@ def save_image_and_send_bytes(camera, resp, filename):
 
 
 class CameraProcessResource:
-    def __init__(self, processes, id_generator):
+    _frame_stream_class = FrameStream
+
+    def __init__(self, processes, id_generator, mirror_max_age_s=DEFAULT_MIRROR_MAX_AGE_S,
+                 max_event_waiters=DEFAULT_MAX_EVENT_WAITERS):
         self._processes = processes
         self._id_generator = id_generator
+        self._mirror_max_age_s = mirror_max_age_s
+        self._event_waiters = BoundedSemaphore(max_event_waiters)
 
         print(f"Camera processes include: {self._processes}")
         self._capturing = False
@@ -90,10 +130,12 @@ class CameraProcessResource:
         if cam_handle is None:
             return
 
-        if setting_name == "imagebytes":
-            self._handle_imagebytes(resp, cam_handle)
-        elif setting_name == "currentimage":
-            self._handle_currentimage(resp, cam_handle)
+        if setting_name in event_get_methods:
+            self._handle_event_get(req, resp, cam_handle, setting_name)
+        elif setting_name in image_get_methods:
+            self._handle_image_get(req, resp, cam_handle, setting_name)
+        elif setting_name == "imagearray" and req.client_accepts("application/imagebytes"):
+            self._handle_imagearray_bytes(req, resp, cam_handle)
         else:
             self._process_get(req, resp, cam_handle, setting_name)
 
@@ -105,47 +147,225 @@ class CameraProcessResource:
             resp.status = falcon.HTTP_412
         return
 
-    def _return_image_common(self, resp: falcon.Response, cam_handle: CameraProcessHandle):
-        raw_result = cam_handle.result_queue.get()
+    @staticmethod
+    def _next_result(resp: falcon.Response, cam_handle: CameraProcessHandle, request: PendingRequest,
+                     timeout=DEFAULT_RESULT_TIMEOUT_S, frame=False):
+        """
+        Waits for next result (or frame) of request. On timeout request is released and response is set.
+        :return: result, or None on timeout
+        """
+        future = request.frame_future() if frame else request.result_future()
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            CameraProcessResource._timed_out(resp, cam_handle, request, timeout, future if frame else None)
+            return None
+
+    @staticmethod
+    def _timed_out(resp: falcon.Response, cam_handle: CameraProcessHandle, request: PendingRequest, timeout,
+                   frame_future=None):
+        cam_handle.demux.release(request)
+        if frame_future is not None:
+            # frame may still come in before request is released, its slot has to be unpinned then:
+            frame_future.add_done_callback(lambda f: cam_handle.ring.unpin(f.result().slot))
+        log.error(f"No response to request {request.request_id} in {timeout}s")
+        resp.status = falcon.HTTP_504
+        resp.text = json.dumps({"error": f"Camera process did not respond in {timeout}s"})
+
+    @staticmethod
+    def _image_result_failed(resp: falcon.Response, cam_handle: CameraProcessHandle, request: PendingRequest,
+                             raw_result):
+        """
+        :return: True if there will be no frame for the result - then response is set and request released
+        """
         if not raw_result.ok():
+            cam_handle.demux.release(request)
             log.error(f"Error in result from process: {raw_result.error()}")
             resp.status = falcon.HTTP_500
             resp.text = raw_result.error()
-            return
+            return True
 
         if raw_result.get() == BUSY_TOKEN:
+            cam_handle.demux.release(request)
             resp.status = falcon.HTTP_418
             resp.text = "Busy..."
+            return True
+        return False
+
+    def _serve_frame(self, resp: falcon.Response, cam_handle: CameraProcessHandle, raw_result, frame):
+        log.debug(f"Serving {frame}")
+        resp.content_type = "application/octet-stream"
+        if isinstance(raw_result.get(), dict):
+            for header, value in raw_result.get().items():
+                resp.set_header(header, value)
+        resp.stream = self._frame_stream_class(cam_handle.ring, frame)
+        resp.content_length = frame.length
+        resp.set_header("X-Frame-Sequence", str(frame.sequence))
+        resp.status = falcon.HTTP_200
+
+    def _return_image_common(self, resp: falcon.Response, cam_handle: CameraProcessHandle, request: PendingRequest,
+                             timeout=DEFAULT_RESULT_TIMEOUT_S):
+        raw_result = self._next_result(resp, cam_handle, request, timeout)
+        if raw_result is None or self._image_result_failed(resp, cam_handle, request, raw_result):
             return
 
         log.info("Successful processing of imaging request!")
-        data = cam_handle.data_pipe.recv()
-        imagebytes, length = data
-        resp.content_type = "application/octet-stream"
-        resp.data = imagebytes
-        resp.content_length = length
+        frame = self._next_result(resp, cam_handle, request, frame=True)
+        if frame is None:
+            return
+        cam_handle.demux.release(request)
+        self._serve_frame(resp, cam_handle, raw_result, frame)
+
+    @staticmethod
+    def _image_params(req: falcon.Request):
+        return {"Encoding": negotiate_encoding(req.get_header(FRAME_ENCODING_HEADER))}
+
+    @staticmethod
+    def _image_command(req: falcon.Request, setting_name: str):
+        params = extract_command_params_for_get(req)
+        params.update(CameraProcessResource._image_params(req))
+        return CameraSimpleGETCommand(setting_name, params=params)
+
+    def _handle_image_get(self, req: falcon.Request, resp: falcon.Response, cam_handle: CameraProcessHandle,
+                          setting_name: str):
+        request = cam_handle.demux.send(self._image_command(req, setting_name))
+        self._return_image_common(resp, cam_handle, request)
+
+    def _imagearray_bytes_failed(self, resp: falcon.Response, cam_handle: CameraProcessHandle,
+                                 request: PendingRequest, raw_result, transaction_ids):
+        resp.content_type = "application/imagebytes"
         resp.status = falcon.HTTP_200
+        if raw_result.ok():
+            return False
+        cam_handle.demux.release(request)
+        log.error(f"Error in result from process: {raw_result.error()}")
+        resp.data = create_imagebytes_metadata(*transaction_ids, error_number=0x500) + raw_result.error().encode("utf-8")
+        return True
+
+    def _serve_imagearray_bytes(self, resp: falcon.Response, cam_handle: CameraProcessHandle, raw_result, frame,
+                                transaction_ids):
+        metadata = create_imagebytes_metadata(*transaction_ids, error_number=0, image_metadata=raw_result.get())
+        resp.stream = self._frame_stream_class(cam_handle.ring, frame, prefix=metadata)
+        resp.content_length = len(resp.stream)
+        resp.set_header("X-Frame-Sequence", str(frame.sequence))
+
+    def _handle_imagearray_bytes(self, req: falcon.Request, resp: falcon.Response, cam_handle: CameraProcessHandle):
+        client_transaction_id = int(req.get_param("ClientTransactionID", default=0))
+        request = cam_handle.demux.send(CameraSimpleGETCommand("imagearraybytes"))
+        transaction_ids = (client_transaction_id, self._id_generator.generate())
+        raw_result = self._next_result(resp, cam_handle, request)
+        if raw_result is None or self._imagearray_bytes_failed(resp, cam_handle, request, raw_result,
+                                                               transaction_ids):
+            return
 
-    def _handle_imagebytes(self, resp: falcon.Response, cam_handle: CameraProcessHandle):
-        cam_handle.command_queue.put(CameraSimpleGETCommand("imagebytes"))
-        self._return_image_common(resp, cam_handle)
+        frame = self._next_result(resp, cam_handle, request, frame=True)
+        if frame is None:
+            return
+        cam_handle.demux.release(request)
+        self._serve_imagearray_bytes(resp, cam_handle, raw_result, frame, transaction_ids)
+
+    def _event_params(self, req: falcon.Request, resp: falcon.Response, handle: CameraProcessHandle,
+                      setting_name: str):
+        """
+        Events are answered by server from camera events, camera process is not asked (and may be busy).
+        :return: transaction ids, id of last event client has seen and wait timeout, None if response is set already
+        """
+        try:
+            client_transaction_id = int(req.get_param("ClientTransactionID", default=0))
+            after = req.get_header("Last-Event-ID") or req.get_param("after")
+            after = int(after) if after is not None else None
+            timeout = min(float(req.get_param("timeout", default=DEFAULT_RESULT_TIMEOUT_S)), MAX_WAIT_FOR_IMAGE_S)
+        except ValueError as e:
+            resp.text = json.dumps({"error": repr(e), "trace": format_exc()})
+            resp.status = falcon.HTTP_400
+            return None
+        if after is None and setting_name == "waitforimage":
+            # by default waits for image of the last started exposure, even if it is ready already
+            after = handle.events.get_last_id(EVENT_EXPOSURE_STARTED)
+        return (client_transaction_id, self._id_generator.generate()), after, timeout
+
+    @staticmethod
+    def _respond_image_event(resp: falcon.Response, event, transaction_ids):
+        """
+        Value is image_ready event, or None when there was none in time. Failed exposure is an error.
+        """
+        failed = event is not None and event["Event"] == EVENT_EXPOSURE_FAILED
+        response_dict = create_ascom_response_dict(*transaction_ids,
+                                                   error_number=500 if failed else 0,
+                                                   error_message=f"Exposure failed: {event['Status']}" if failed else "")
+        response_dict.update({"Value": event})
+        resp.text = json.dumps(response_dict)
+        resp.status = falcon.HTTP_500 if failed else falcon.HTTP_200
+
+    @staticmethod
+    def _respond_sequence(resp: falcon.Response, handle: CameraProcessHandle, transaction_ids):
+        """
+        Value is progress of running (or last) capture sequence, with ETA and timing of its steps.
+        """
+        event = handle.events.get_last(EVENT_SEQUENCE)
+        response_dict = create_ascom_response_dict(*transaction_ids, error_number=0, error_message="")
+        response_dict.update({"Value": event})
+        resp.text = json.dumps(response_dict)
+        resp.status = falcon.HTTP_200
 
-    def _handle_currentimage(self, resp: falcon.Response, cam_handle: CameraProcessHandle):
-        cam_handle.command_queue.put(CameraSimpleGETCommand("currentimage"))
-        self._return_image_common(resp, cam_handle)
+    def _handle_event_get(self, req: falcon.Request, resp: falcon.Response, handle: CameraProcessHandle,
+                          setting_name: str):
+        params = self._event_params(req, resp, handle, setting_name)
+        if params is None:
+            return
+        transaction_ids, after, timeout = params
+        if setting_name == "sequence":
+            self._respond_sequence(resp, handle, transaction_ids)
+            return
+        if not self._event_waiters.acquire(blocking=False):
+            resp.text = json.dumps({"Status": "BUSY",
+                                    "ErrorMessage": "Too many clients waiting for events, use ASGI server for more"})
+            resp.append_header("Retry-After", str(int(EVENT_KEEPALIVE_S)))
+            resp.status = falcon.HTTP_503
+            return
+        if setting_name == "events":
+            resp.content_type = "text/event-stream"
+            resp.stream = EventStream(handle.events, after, on_close=self._event_waiters.release)
+            resp.status = falcon.HTTP_200
+            return
 
-    def _check_state(self, handle: CameraProcessHandle, result_queue: Queue):
+        stream = handle.events.subscribe(after)
+        deadline = time.time() + timeout
+        event = None
+        try:
+            while event is None or event["Event"] not in image_events:
+                event = stream.next().result(max(0.0, deadline - time.time()))
+        except FutureTimeoutError:
+            event = None
+        finally:
+            handle.events.unsubscribe(stream)
+            self._event_waiters.release()
+        self._respond_image_event(resp, event, transaction_ids)
+
+    def _check_state(self, handle: CameraProcessHandle):
+        with handle.state_lock:
+            return self._poll_state(handle)
+
+    @staticmethod
+    def _poll_state(handle: CameraProcessHandle):
         print(f"Current state = {handle.state}")
         if handle.state == "IDLE":
             print("Camera process idle")
             return handle.state, ""
         if handle.state == "BUSY":
             print("Camera process WAS busy, polling...")
+            request = handle.busy_request
+            if request is None:
+                return handle.state, "Quite unexpected"
 
             at_least_one = False
-            while not result_queue.empty():
+            raw = request.poll_result()
+            while raw is not None:
                 at_least_one = True
-                status_raw = result_queue.get(block=False)
+                status_raw = raw
+                if not status_raw.ok() or status_raw.get() == DONE_TOKEN:
+                    break
+                raw = request.poll_result()
             if at_least_one:
                 print("Polling succeeded, getting status...")
                 if status_raw.ok():
@@ -153,10 +373,14 @@ class CameraProcessResource:
                 else:
                     err_msg = status_raw.error()
                     print(f"Error encountered: {err_msg}")
+                    handle.demux.release(request)
+                    handle.busy_request = None
                     handle.state = "ERROR"
                     return handle.state, err_msg
                 print(f"Received status: {status}")
                 if status == DONE_TOKEN:
+                    handle.demux.release(request)
+                    handle.busy_request = None
                     handle.state = "IDLE"
                     return status, ""
                 else:
@@ -165,31 +389,80 @@ class CameraProcessResource:
                 print("Polling failed, we are still busy...")
         return handle.state, "Quite unexpected"
 
-    def _process_get(self, req: falcon.Request, resp: falcon.Response, handle: CameraProcessHandle, setting_name: str):
-        result_queue = handle.result_queue
-        current_state, err_msg = self._check_state(handle, result_queue)
+    def _mirrored_get(self, req: falcon.Request, resp: falcon.Response, handle: CameraProcessHandle,
+                      setting_name: str):
+        """
+        Answers read-only property from property mirror, if it is fresh enough.
+        :return: True if request was answered
+        """
+        if handle.mirror is None:
+            return False
+        if setting_name == "batch":
+            found, value = self._mirrored_batch(req, handle)
+        elif setting_name in mirrored_get_methods:
+            found, value = handle.mirror.get(setting_name, self._mirror_max_age_s, handle.last_put_time)
+        else:
+            return False
+        if not found:
+            return False
+        try:
+            client_transaction_id = int(req.params["ClientTransactionID"])
+        except Exception:
+            return False
+        response_dict = create_ascom_response_dict(client_transaction_id, self._id_generator.generate(),
+                                                   error_number=0, error_message="")
+        response_dict.update({"Value": value})
+        resp.text = json.dumps(response_dict)
+        resp.status = falcon.HTTP_200
+        return True
+
+    def _mirrored_batch(self, req: falcon.Request, handle: CameraProcessHandle):
+        """
+        Batch of gets is answered from mirror only when all of its values are there and fresh.
+        """
+        items = []
+        for name in parse_batch_gets(req.get_param("gets", default="")):
+            if name not in mirrored_get_methods:
+                return False, None
+            found, value = handle.mirror.get(name, self._mirror_max_age_s, handle.last_put_time)
+            if not found:
+                return False, None
+            items.append(batch_item(name, value=value))
+        return True, {"Puts": [], "Gets": items}
+
+    def _prepare_get(self, req: falcon.Request, resp: falcon.Response, handle: CameraProcessHandle,
+                     setting_name: str):
+        """
+        :return: client transaction id if command has to be sent to camera process, None if response is set already
+        """
+        if self._mirrored_get(req, resp, handle, setting_name):
+            return None
+        current_state, err_msg = self._check_state(handle)
         if "IDLE" != current_state:
             resp.text = json.dumps({"Status": current_state, "ErrorMessage": err_msg})
             resp.status = falcon.HTTP_412
-            return
-        command_queue = handle.command_queue
+            return None
 
         try:
-            client_id = int(req.params["ClientID"])
+            int(req.params["ClientID"])  # validated only, transaction id is what response carries
             client_transaction_id = int(req.params["ClientTransactionID"])
         except Exception as e:
             log.warning(f"Could not read params: {repr(e)}")
             resp.text = json.dumps({"error": repr(e), "trace": format_exc()})
             resp.status = falcon.HTTP_400
-            return
-
-        command_queue.put(CameraSimpleGETCommand(setting_name))
-        resp.status = falcon.HTTP_200
-        server_transaction_id = self._id_generator.generate()
-        raw_result = result_queue.get()
-
+            return None
+        return client_transaction_id
+
+    @staticmethod
+    def _respond(resp: falcon.Response, handle: CameraProcessHandle, request: PendingRequest, raw_result,
+                 transaction_ids, merge=False):
+        """
+        Sets ASCOM response with result. Request which turned camera process busy is kept to read progress from.
+        :param merge: result is a dict merged into response, instead of being its Value
+        """
         error_msg = ""
         error_no = 0
+        resp.status = falcon.HTTP_200
         if not raw_result.ok():
             error_msg = raw_result.error()
             error_no = 500
@@ -198,16 +471,33 @@ class CameraProcessResource:
         result = raw_result.get()
         print(f"Acquired result: {result}")
         if result == BUSY_TOKEN:
-            handle.state = "BUSY"
+            with handle.state_lock:
+                handle.busy_request = request
+                handle.state = "BUSY"
+        else:
+            handle.demux.release(request)
 
-        response_dict = create_ascom_response_dict(client_transaction_id,
-                                                   server_transaction_id,
+        response_dict = create_ascom_response_dict(*transaction_ids,
                                                    error_number=error_no,
                                                    error_message=error_msg)
-        response_dict.update({"Value": result})
+        if merge and raw_result.ok():
+            response_dict.update(result)
+        else:
+            response_dict.update({"Value": result})
 
         resp.text = json.dumps(response_dict)
 
+    def _process_get(self, req: falcon.Request, resp: falcon.Response, handle: CameraProcessHandle, setting_name: str):
+        client_transaction_id = self._prepare_get(req, resp, handle, setting_name)
+        if client_transaction_id is None:
+            return
+        request = handle.demux.send(CameraSimpleGETCommand(setting_name, params=extract_command_params_for_get(req)))
+        transaction_ids = (client_transaction_id, self._id_generator.generate())
+        raw_result = self._next_result(resp, handle, request)
+        if raw_result is None:
+            return
+        self._respond(resp, handle, request, raw_result, transaction_ids, merge=setting_name == "imagearray")
+
     @falcon.before(add_timestamp_before)
     @falcon.after(add_timestamp_after)
     def on_put(self, req: falcon.Request, resp: falcon.Response, camera_id, setting_name):
@@ -215,51 +505,54 @@ class CameraProcessResource:
         if cam_handle is None:
             return
         print(f"PUT {setting_name}")
-        self._process_put(req, resp, cam_handle, setting_name)
+        self._process_put(req, resp, cam_handle, setting_name, req.media)
 
-    def _process_put(self, req, resp, cam_handle: CameraProcessHandle, setting_name):
-        state, err_msg = self._check_state(cam_handle, cam_handle.result_queue)
+    def _prepare_put(self, req, resp, cam_handle: CameraProcessHandle, setting_name, form):
+        """
+        :return: (client transaction id, command) if command has to be sent, None if response is set already
+        """
+        state, err_msg = self._check_state(cam_handle)
         if "IDLE" != state:
             resp.text = json.dumps({"Status": cam_handle.state, "ErrorMessage": err_msg})
             resp.status = falcon.HTTP_412
-            return
+            return None
 
         try:
-            form = req.media
-            cid, ctid, params = extract_client_and_transaction_id_for_put(req)
+            cid, ctid, params = split_client_and_transaction_id(form)
             log.info(f"Send form = {form}")
+            if setting_name == "instantcapture":
+                float(params.get("Duration", 0))  # response timeout is derived from it
         except Exception as e:
             log.warning(f"Could not read params: {repr(e)}")
             resp.text = json.dumps({"error": repr(e), "trace": format_exc()})
             resp.status = falcon.HTTP_400
-            return
-
-        cam_handle.command_queue.put(CameraSimplePUTCommand(name=setting_name, params=params))
-        log.info("Waiting for response")
-        server_transaction_id = self._id_generator.generate()
+            return None
 
         if setting_name == "instantcapture":
-            self._return_image_common(resp, cam_handle)
-            return
+            params.update(self._image_params(req))
+        return ctid, CameraSimplePUTCommand(name=setting_name, params=params)
 
-        raw_result = cam_handle.result_queue.get()
-        error_msg = ""
-        error_no = 0
-        resp.status = falcon.HTTP_200
-        if not raw_result.ok():
-            error_msg = raw_result.error()
-            error_no = 500
-            resp.status = falcon.HTTP_500
+    @staticmethod
+    def _instantcapture_timeout(command):
+        return DEFAULT_RESULT_TIMEOUT_S + float(command.get_params().get("Duration", 0))
 
-        result = raw_result.get()
+    def _process_put(self, req, resp, cam_handle: CameraProcessHandle, setting_name, form):
+        prepared = self._prepare_put(req, resp, cam_handle, setting_name, form)
+        if prepared is None:
+            return
+        ctid, command = prepared
+        request = cam_handle.demux.send(command)
+        log.info("Waiting for response")
+        transaction_ids = (ctid, self._id_generator.generate())
 
-        if result == BUSY_TOKEN:
-            cam_handle.state = "BUSY"
+        if setting_name == "instantcapture":
+            self._return_image_common(resp, cam_handle, request, self._instantcapture_timeout(command))
+            cam_handle.last_put_time = time.time()
+            return
 
-        log.info(f"Response = {result}")
-        response_dict = create_ascom_response_dict(ctid,
-                                                   server_transaction_id,
-                                                   error_number=error_no,
-                                                   error_message=error_msg)
-        response_dict.update({"Value": result})
-        resp.text = json.dumps(response_dict)
+        raw_result = self._next_result(resp, cam_handle, request)
+        if raw_result is None:
+            return
+        cam_handle.last_put_time = time.time()
+        log.info(f"Response = {raw_result.get()}")
+        self._respond(resp, cam_handle, request, raw_result, transaction_ids)
@@ -0,0 +1,197 @@
+from .camera_process import CameraProcessHandle
+from .camera_process_resource import CameraProcessResource, image_get_methods, event_get_methods, \
+    get_latest_file_name, content_types_by_extension
+from .camera_events import EventBroadcaster, image_events, EVENT_KEEPALIVE_S
+from .camera_server_utils import CameraSimpleGETCommand, extract_command_params_for_get
+from .request_routing import PendingRequest, DEFAULT_RESULT_TIMEOUT_S
+from .utils import add_timestamp_before_async, add_timestamp_after_async
+from .frame_ring import AsyncFrameStream
+
+import falcon
+import falcon.asgi
+import asyncio
+import logging
+import json
+import time
+import os
+from traceback import format_exc
+
+
+log = logging.getLogger('main')
+
+FILE_READ_CHUNK_SIZE = 256 * 1024
+
+
+class AsyncFileStream:
+    """
+    File as ASGI response body, read in executor so that event loop is not blocked by disk.
+    """
+    def __init__(self, filename):
+        self._file = open(filename, 'rb')
+
+    async def read(self, size=FILE_READ_CHUNK_SIZE):
+        return await asyncio.get_running_loop().run_in_executor(None, self._file.read, size)
+
+    async def close(self):
+        self._file.close()
+
+
+class AsyncCameraProcessResource(CameraProcessResource):
+    """
+    CameraProcessResource for ASGI server. Waiting for results of camera process is awaited on futures
+    of pending requests, so requests waiting for camera cost coroutines, not threads.
+    """
+    _frame_stream_class = AsyncFrameStream
+
+    async def _await_result(self, resp: falcon.asgi.Response, cam_handle: CameraProcessHandle,
+                            request: PendingRequest, timeout=DEFAULT_RESULT_TIMEOUT_S, frame=False):
+        """
+        :return: next result (or frame) of request, or None on timeout - then response is set
+        """
+        future = request.frame_future() if frame else request.result_future()
+        try:
+            # shielded, so that timeout does not cancel future which demultiplexer may be resolving:
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+        except asyncio.TimeoutError:
+            self._timed_out(resp, cam_handle, request, timeout, future if frame else None)
+            return None
+
+    @falcon.before(add_timestamp_before_async)
+    @falcon.after(add_timestamp_after_async)
+    async def on_get(self, req: falcon.asgi.Request, resp: falcon.asgi.Response, camera_id, setting_name):
+        if setting_name == "lastimage":
+            self._handle_lastimage_async(resp)
+            return
+        cam_handle = self._get_camera_handler(camera_id, setting_name, resp)
+        if cam_handle is None:
+            return
+
+        if setting_name in event_get_methods:
+            await self._handle_event_get_async(req, resp, cam_handle, setting_name)
+        elif setting_name in image_get_methods:
+            request = cam_handle.demux.send(self._image_command(req, setting_name))
+            await self._return_image_async(resp, cam_handle, request)
+        elif setting_name == "imagearray" and req.client_accepts("application/imagebytes"):
+            await self._handle_imagearray_bytes_async(req, resp, cam_handle)
+        else:
+            await self._process_get_async(req, resp, cam_handle, setting_name)
+
+    @staticmethod
+    def _handle_lastimage_async(resp: falcon.asgi.Response):
+        try:
+            filename = get_latest_file_name()
+        except ValueError as e:
+            resp.text = json.dumps({"error": repr(e), "trace": format_exc()})
+            resp.status = falcon.HTTP_412
+            return
+        resp.content_type = content_types_by_extension.get(os.path.splitext(filename)[1], "application/octet-stream")
+        resp.stream = AsyncFileStream(filename)
+        resp.content_length = os.path.getsize(filename)
+        resp.status = falcon.HTTP_200
+
+    @staticmethod
+    async def _sse_events(broadcaster: EventBroadcaster, after):
+        """
+        Server-sent events of camera. None is yielded when there was no event for a while, falcon sends ping then.
+        """
+        stream = broadcaster.subscribe(after)
+        try:
+            future = asyncio.wrap_future(stream.next())
+            while True:
+                try:
+                    event = await asyncio.wait_for(asyncio.shield(future), EVENT_KEEPALIVE_S)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                future = asyncio.wrap_future(stream.next())
+                yield falcon.asgi.SSEvent(event=event["Event"], event_id=str(event["Id"]), json=event)
+        finally:
+            broadcaster.unsubscribe(stream)
+
+    async def _handle_event_get_async(self, req: falcon.asgi.Request, resp: falcon.asgi.Response,
+                                      handle: CameraProcessHandle, setting_name: str):
+        params = self._event_params(req, resp, handle, setting_name)
+        if params is None:
+            return
+        transaction_ids, after, timeout = params
+        if setting_name == "events":
+            resp.sse = self._sse_events(handle.events, after)
+            return
+        if setting_name == "sequence":
+            self._respond_sequence(resp, handle, transaction_ids)
+            return
+
+        stream = handle.events.subscribe(after)
+        deadline = time.time() + timeout
+        event = None
+        try:
+            while event is None or event["Event"] not in image_events:
+                event = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(stream.next())),
+                                               max(0.0, deadline - time.time()))
+        except asyncio.TimeoutError:
+            event = None
+        finally:
+            handle.events.unsubscribe(stream)
+        self._respond_image_event(resp, event, transaction_ids)
+
+    async def _return_image_async(self, resp: falcon.asgi.Response, cam_handle: CameraProcessHandle,
+                                  request: PendingRequest, timeout=DEFAULT_RESULT_TIMEOUT_S):
+        raw_result = await self._await_result(resp, cam_handle, request, timeout)
+        if raw_result is None or self._image_result_failed(resp, cam_handle, request, raw_result):
+            return
+        frame = await self._await_result(resp, cam_handle, request, frame=True)
+        if frame is None:
+            return
+        cam_handle.demux.release(request)
+        self._serve_frame(resp, cam_handle, raw_result, frame)
+
+    async def _handle_imagearray_bytes_async(self, req: falcon.asgi.Request, resp: falcon.asgi.Response,
+                                             cam_handle: CameraProcessHandle):
+        client_transaction_id = int(req.get_param("ClientTransactionID", default=0))
+        request = cam_handle.demux.send(CameraSimpleGETCommand("imagearraybytes"))
+        transaction_ids = (client_transaction_id, self._id_generator.generate())
+        raw_result = await self._await_result(resp, cam_handle, request)
+        if raw_result is None or self._imagearray_bytes_failed(resp, cam_handle, request, raw_result,
+                                                               transaction_ids):
+            return
+        frame = await self._await_result(resp, cam_handle, request, frame=True)
+        if frame is None:
+            return
+        cam_handle.demux.release(request)
+        self._serve_imagearray_bytes(resp, cam_handle, raw_result, frame, transaction_ids)
+
+    async def _process_get_async(self, req: falcon.asgi.Request, resp: falcon.asgi.Response,
+                                 handle: CameraProcessHandle, setting_name: str):
+        client_transaction_id = self._prepare_get(req, resp, handle, setting_name)
+        if client_transaction_id is None:
+            return
+        request = handle.demux.send(CameraSimpleGETCommand(setting_name, params=extract_command_params_for_get(req)))
+        transaction_ids = (client_transaction_id, self._id_generator.generate())
+        raw_result = await self._await_result(resp, handle, request)
+        if raw_result is None:
+            return
+        self._respond(resp, handle, request, raw_result, transaction_ids, merge=setting_name == "imagearray")
+
+    @falcon.before(add_timestamp_before_async)
+    @falcon.after(add_timestamp_after_async)
+    async def on_put(self, req: falcon.asgi.Request, resp: falcon.asgi.Response, camera_id, setting_name):
+        cam_handle = self._get_camera_handler(camera_id, setting_name, resp)
+        if cam_handle is None:
+            return
+        prepared = self._prepare_put(req, resp, cam_handle, setting_name, await req.get_media())
+        if prepared is None:
+            return
+        ctid, command = prepared
+        request = cam_handle.demux.send(command)
+        transaction_ids = (ctid, self._id_generator.generate())
+
+        if setting_name == "instantcapture":
+            await self._return_image_async(resp, cam_handle, request, self._instantcapture_timeout(command))
+            cam_handle.last_put_time = time.time()
+            return
+
+        raw_result = await self._await_result(resp, cam_handle, request)
+        if raw_result is None:
+            return
+        cam_handle.last_put_time = time.time()
+        self._respond(resp, cam_handle, request, raw_result, transaction_ids)
@@ -1,6 +1,7 @@
 import falcon
 import json
 import logging
+import struct
 
 
 log = logging.getLogger('main')
@@ -11,6 +12,7 @@ class CameraCommand:
         self._name = name
         self._params = params
         self._type = ctype
+        self._request_id = None
 
     def is_get(self):
         return self._type == "GET"
@@ -27,10 +29,16 @@ class CameraCommand:
     def get_params(self):
         return self._params
 
+    def get_request_id(self):
+        return self._request_id
+
+    def set_request_id(self, request_id):
+        self._request_id = request_id
+
 
 class CameraSimpleGETCommand(CameraCommand):
-    def __init__(self, name):
-        super(CameraSimpleGETCommand, self).__init__(name, params=None, ctype="GET")
+    def __init__(self, name, params=None):
+        super(CameraSimpleGETCommand, self).__init__(name, params=params, ctype="GET")
 
 
 class CameraSimplePUTCommand(CameraCommand):
@@ -61,15 +69,45 @@ def create_ascom_response_dict(client_transaction_id, server_transaction_id, err
     return response_json
 
 
+IMAGEBYTES_METADATA_VERSION = 1
+IMAGEBYTES_DATA_START = 44
+
+
+def create_imagebytes_metadata(client_transaction_id, server_transaction_id, error_number, image_metadata=None):
+    image_metadata = image_metadata if image_metadata is not None else {}
+    return struct.pack("<iiIIiiiiiii",
+                       IMAGEBYTES_METADATA_VERSION,
+                       error_number,
+                       client_transaction_id,
+                       server_transaction_id,
+                       IMAGEBYTES_DATA_START,
+                       image_metadata.get("ImageElementType", 0),
+                       image_metadata.get("TransmissionElementType", 0),
+                       image_metadata.get("Rank", 0),
+                       image_metadata.get("Dimension1", 0),
+                       image_metadata.get("Dimension2", 0),
+                       image_metadata.get("Dimension3", 0))
+
+
 def extract_client_and_transaction_id_for_put(req: falcon.Request):
-    params = req.media
-    client_id = req.media["ClientID"]
-    client_transaction_id = req.media["ClientTransactionID"]
+    return split_client_and_transaction_id(req.media)
+
+
+def split_client_and_transaction_id(params: dict):
+    """
+    Removes ClientID and ClientTransactionID from PUT form (as ASGI request gives media only when awaited).
+    """
+    client_id = params["ClientID"]
+    client_transaction_id = params["ClientTransactionID"]
     del params["ClientID"]
     del params["ClientTransactionID"]
     return int(client_id), int(client_transaction_id), params
 
 
+def extract_command_params_for_get(req: falcon.Request):
+    return {k: v for k, v in req.params.items() if k not in ["ClientID", "ClientTransactionID"]}
+
+
 def check_camera_id(camera_id, cameras, resp):
     try:
         if int(camera_id) not in cameras.keys():
@@ -91,6 +129,7 @@ class Result:
     def __init__(self, result, error):
         self._result = result
         self._error = error
+        self._request_id = None
 
     def ok(self):
         return len(self._error) == 0
@@ -101,6 +140,12 @@ class Result:
     def error(self):
         return self._error
 
+    def get_request_id(self):
+        return self._request_id
+
+    def set_request_id(self, request_id):
+        self._request_id = request_id
+
 
 class Error(Result):
     def __init__(self, error):
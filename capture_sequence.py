@@ -0,0 +1,167 @@
+from .app_utils import parse_bool
+from .frame_writer import DEFAULT_FILE_FORMAT
+from .raw_writers import frame_writers
+import os
+import time
+
+
+# Settings changing frame format, in the order they have to be applied: binning rescales ROI,
+# so it goes before it, and size goes before start, which is checked against it.
+format_settings = ["ReadoutMode", "Bin", "NumX", "NumY", "StartX", "StartY"]
+sequence_settings = format_settings + ["Gain"]
+
+# camera property set by each setting:
+setting_properties = {
+    "ReadoutMode": "readoutmode",
+    "Bin": "binx",
+    "NumX": "numx",
+    "NumY": "numy",
+    "StartX": "startx",
+    "StartY": "starty",
+    "Gain": "gain"
+}
+
+MAX_SEQUENCE_FRAMES = 100000
+
+SEQUENCE_RUNNING = "RUNNING"
+SEQUENCE_DONE = "DONE"
+SEQUENCE_FAILED = "FAILED"
+
+
+class SequenceStep:
+    """
+    One block of a capture plan: Number frames of Duration, with given settings. Settings which are not given
+    are left as they are.
+    """
+    def __init__(self, index, params: dict):
+        self.index = index
+        self.duration = float(params["Duration"])
+        self.number = int(params.get("Number", 1))
+        self.light = parse_bool(params.get("Light", True))
+        self.file_format = params.get("Format", DEFAULT_FILE_FORMAT)
+        self.path = params.get("Path")
+        self.settings = {name: int(params[name]) for name in sequence_settings if params.get(name) is not None}
+        if self.duration < 0 or self.number < 1:
+            raise ValueError(f"Step {index}: Duration has to be >= 0 and Number >= 1")
+        if self.file_format not in frame_writers:
+            raise ValueError(f"Step {index}: unknown format {self.file_format}, "
+                             f"expected one of {list(frame_writers.keys())}")
+        if self.path is not None:
+            self.path = os.path.normpath(str(self.path))
+            if os.path.isabs(self.path) or self.path.startswith(".."):
+                raise ValueError(f"Step {index}: Path has to be relative to capture directory")
+
+    def format_key(self):
+        return tuple(self.settings.get(name) for name in format_settings)
+
+    def to_dict(self):
+        step = {"Duration": self.duration, "Number": self.number, "Light": self.light, "Format": self.file_format,
+                "Path": self.path}
+        step.update(self.settings)
+        return step
+
+
+def parse_plan(params):
+    """
+    :param params: {"Steps": [step, ...], "Optimize": bool} - optimized plan is reordered (stably) so that
+    steps of the same frame format follow each other, then format changes as few times as possible
+    :return: list of SequenceStep
+    :raise ValueError: when plan is not valid
+    """
+    steps = params.get("Steps")
+    if not isinstance(steps, list) or not steps or not all(isinstance(step, dict) for step in steps):
+        raise ValueError("Steps has to be a non-empty list of steps")
+    try:
+        plan = [SequenceStep(i, step) for i, step in enumerate(steps)]
+    except KeyError as ke:
+        raise ValueError(f"Missing step param: {repr(ke)}")
+    if sum(step.number for step in plan) > MAX_SEQUENCE_FRAMES:
+        raise ValueError(f"Too many frames in plan, allowed {MAX_SEQUENCE_FRAMES}")
+    if params.get("Optimize", False):
+        first_seen = {}
+        for step in plan:
+            first_seen.setdefault(step.format_key(), len(first_seen))
+        plan.sort(key=lambda step: first_seen[step.format_key()])
+    return plan
+
+
+def settings_changes(current: dict, step: SequenceStep):
+    """
+    :param current: settings camera has now, as far as known
+    :return: [(setting, value)] which differ from current, in order they have to be applied in
+    """
+    return [(name, step.settings[name]) for name in sequence_settings
+            if name in step.settings and current.get(name) != step.settings[name]]
+
+
+def changes_format(changes):
+    return any(name in format_settings for name, _ in changes)
+
+
+class SequenceProgress:
+    """
+    Progress and timing of a running plan. ETA counts remaining exposures plus overheads observed so far:
+    per frame (readout, processing) and per step (settings changes).
+    """
+    def __init__(self, plan):
+        self._plan = plan
+        self._total = sum(step.number for step in plan)
+        self._start = time.time()
+        self._end = None
+        self._state = SEQUENCE_RUNNING
+        self._error = None
+        self._step = 0
+        self._done = 0
+        self._steps = [{"Step": step.index, "Frames": step.number, "Done": 0, "Duration": step.duration,
+                        "Start": None, "SettingsTime": 0.0, "Elapsed": 0.0, "MeanFrameInterval": None,
+                        "DutyCycle": None}
+                       for step in plan]
+
+    def step_started(self, position, settings_time):
+        self._step = position
+        stats = self._steps[position]
+        stats["Start"] = time.time()
+        stats["SettingsTime"] = settings_time
+
+    def frame_done(self, position):
+        self._done += 1
+        stats = self._steps[position]
+        stats["Done"] += 1
+        stats["Elapsed"] = time.time() - stats["Start"]
+        stats["MeanFrameInterval"] = stats["Elapsed"] / stats["Done"]
+        stats["DutyCycle"] = stats["Done"] * stats["Duration"] / stats["Elapsed"] if stats["Elapsed"] > 0 else None
+
+    def finish(self, error=None):
+        self._end = time.time()
+        self._state = SEQUENCE_FAILED if error is not None else SEQUENCE_DONE
+        self._error = error
+
+    def get_eta(self):
+        if self._state != SEQUENCE_RUNNING:
+            return 0.0
+        started = [stats for stats in self._steps if stats["Done"] > 0]
+        frame_overhead = sum(stats["Elapsed"] - stats["Done"] * stats["Duration"] for stats in started) / \
+            max(1, sum(stats["Done"] for stats in started))
+        settings_time = sum(stats["SettingsTime"] for stats in started) / max(1, len(started))
+        eta = 0.0
+        for position, stats in enumerate(self._steps):
+            remaining = stats["Frames"] - stats["Done"]
+            eta += remaining * (stats["Duration"] + max(0.0, frame_overhead))
+            if position > self._step:
+                eta += settings_time
+        return eta
+
+    def get(self):
+        end = self._end if self._end is not None else time.time()
+        return {
+            "State": self._state,
+            "Error": self._error,
+            "Step": self._step,
+            "Steps": len(self._plan),
+            "Frame": self._done,
+            "Frames": self._total,
+            "Elapsed": end - self._start,
+            "ETA": self.get_eta(),
+            "Plan": [step.to_dict() for step in self._plan],
+            "StepStats": [{k: v for k, v in stats.items() if k != "Start"} for stats in self._steps]
+        }
@@ -0,0 +1,2 @@
+# test_mp.py is a manual script for a camera attached to the machine, not a test:
+collect_ignore = ["test_mp.py"]
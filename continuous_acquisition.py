@@ -0,0 +1,122 @@
+from .zwo_camera import ZwoCamera, ONE_SECOND_IN_MILLISECONDS, frame_as_array
+from .frame_ring import FrameRing
+from threading import Thread, Event, Lock
+import zwoasi as asi
+import time
+
+
+# As suggested by ASI SDK: twice the exposure plus 500ms
+VIDEO_TIMEOUT_BASE_MS = 500
+SLOT_WAIT_S = 0.005
+VIDEO_TIMEOUT_ERROR_CODE = asi.zwo_errors[11].error_code
+
+
+class ContinuousAcquisition(Thread):
+    """
+    Free running acquisition in SDK video mode. Frames are read into ring slots one after another
+    and the newest completed one is always available via take_latest().
+    on_frame(frame, img, context) is called from acquisition thread for every frame read, with context
+    returned by frame_context() once video capture has started and again whenever context_generation()
+    changes (frame processing has been reconfigured).
+    """
+    def __init__(self, camera: ZwoCamera, ring: FrameRing, duration_s, log, on_frame, frame_context,
+                 context_generation):
+        super(ContinuousAcquisition, self).__init__(daemon=True)
+        self._camera = camera
+        self._ring = ring
+        self._duration_s = float(duration_s)
+        self._log = log
+        self._on_frame = on_frame
+        self._frame_context = frame_context
+        self._context_generation = context_generation
+        self._stop_event = Event()
+        self._lock = Lock()
+        self._latest = None
+        self._served_sequence = 0
+        self._frames = 0
+        self._unserved = 0
+        self._timeouts = 0
+        self._start_time = None
+        self._error = ""
+
+    def run(self):
+        timeout_ms = 2 * self._duration_s * ONE_SECOND_IN_MILLISECONDS + VIDEO_TIMEOUT_BASE_MS
+        try:
+            width, height, _, image_type = self._camera.get_frame_format()
+            size = self._camera.get_frame_size()
+            self._start_time = time.time()
+            self._camera.start_video(self._duration_s)
+            generation = self._context_generation()
+            context = self._frame_context()
+            self._log.info(f"Video capture started with exposure {self._duration_s}s")
+            while not self._stop_event.is_set():
+                try:
+                    slot = self._ring.next_slot(pin=True)
+                except RuntimeError:
+                    self._stop_event.wait(SLOT_WAIT_S)  # all slots are being sent to clients
+                    continue
+                try:
+                    length = self._camera.read_video_frame_into(self._ring.writable(slot, size), timeout_ms)
+                except asi.ZWO_IOError as e:
+                    self._ring.unpin(slot)
+                    if e.error_code != VIDEO_TIMEOUT_ERROR_CODE:
+                        raise  # camera closed, removed etc. - there is no point in trying again
+                    self._timeouts += 1
+                    self._log.warning(f"Video frame not received: {repr(e)}")
+                    continue
+                except Exception:
+                    self._ring.unpin(slot)
+                    raise
+                frame = self._ring.publish(slot, width, height, image_type, length)
+                img = frame_as_array(self._ring.view(frame), width, height, image_type)
+                if self._context_generation() != generation:
+                    generation = self._context_generation()
+                    context = self._frame_context()
+                self._on_frame(frame, img, context)
+                with self._lock:
+                    # newest frame stays pinned, so that it is never overwritten before next one is complete:
+                    if self._latest is not None:
+                        if self._latest.sequence > self._served_sequence:
+                            self._unserved += 1
+                        self._ring.unpin(self._latest.slot)
+                    self._latest = frame
+                    self._frames += 1
+        except Exception as e:
+            self._error = repr(e)
+            self._log.error(f"Video capture failed: {self._error}")
+        finally:
+            try:
+                self._camera.stop_video()
+            except Exception as e:
+                self._log.warning(f"Could not stop video capture: {repr(e)}")
+            with self._lock:
+                if self._latest is not None:
+                    self._ring.unpin(self._latest.slot)
+                self._latest = None
+            self._log.info(f"Video capture stopped after {self._frames} frames")
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def take_latest(self):
+        """
+        :return: newest frame, with its slot already pinned (or None if nothing was acquired yet)
+        """
+        with self._lock:
+            if self._latest is not None:
+                self._served_sequence = self._latest.sequence
+                self._ring.pin(self._latest.slot)
+            return self._latest
+
+    def get_stats(self):
+        elapsed = time.time() - self._start_time if self._start_time is not None else 0
+        with self._lock:
+            return {
+                "Frames": self._frames,
+                "DroppedFrames": self._camera.get_dropped_frames(),
+                "UnservedFrames": self._unserved,
+                "Timeouts": self._timeouts,
+                "FPS": self._frames / elapsed if elapsed > 0 else 0,
+                "Error": self._error
+            }
@@ -0,0 +1,157 @@
+import zwoasi as asi
+import numpy as np
+
+
+# Not an SDK type - 16 bit BGR frame, which is what debayering RAW16 gives:
+IMG_RGB48 = 4
+
+MODE_SUPERPIXEL = "superpixel"
+MODE_BILINEAR = "bilinear"
+MODE_CHANNEL = "channel"
+debayer_modes = [MODE_SUPERPIXEL, MODE_BILINEAR, MODE_CHANNEL]
+
+channels = ["r", "g", "b"]
+
+# Bayer pattern as given by SDK: ASCOM offsets of red pixel within 2x2 cell (RGGB matrix)
+bayer_offsets = {
+    asi.ASI_BAYER_RG: (0, 0),
+    asi.ASI_BAYER_BG: (1, 1),
+    asi.ASI_BAYER_GR: (1, 0),
+    asi.ASI_BAYER_RB: (0, 1)  # GB pattern, named RB in zwoasi
+}
+
+color_types = {
+    asi.ASI_IMG_RAW8: asi.ASI_IMG_RGB24,
+    asi.ASI_IMG_RAW16: IMG_RGB48
+}
+
+mono_types = {
+    asi.ASI_IMG_RAW8: asi.ASI_IMG_Y8,
+    asi.ASI_IMG_RAW16: asi.ASI_IMG_RAW16
+}
+
+# For bilinear interpolation, weights of 3x3 neighbourhood, each sum over existing samples is 4:
+_red_blue_kernel = [(-1, -1, 1), (-1, 0, 2), (-1, 1, 1),
+                    (0, -1, 2), (0, 0, 4), (0, 1, 2),
+                    (1, -1, 1), (1, 0, 2), (1, 1, 1)]
+_green_kernel = [(-1, 0, 1), (0, -1, 1), (0, 0, 4), (0, 1, 1), (1, 0, 1)]
+
+
+def debayered_format(width, height, image_type, mode):
+    """
+    :return: (width, height, image_type) of frame produced from mosaic of given format
+    """
+    if mode == MODE_BILINEAR:
+        return width - width % 2, height - height % 2, color_types[image_type]
+    if mode == MODE_SUPERPIXEL:
+        return width // 2, height // 2, color_types[image_type]
+    if mode == MODE_CHANNEL:
+        return width // 2, height // 2, mono_types[image_type]
+    raise ValueError(f"Unknown debayer mode {mode}, expected one of {debayer_modes}")
+
+
+def _result(out, shape, dtype):
+    if out is None:
+        return np.empty(shape, dtype=dtype)
+    return np.frombuffer(out, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+
+
+def _planes(mosaic, offsets):
+    """
+    Views of red, both green and blue samples, each of half resolution.
+    """
+    x, y = offsets
+    return {
+        "r": mosaic[y::2, x::2],
+        "g1": mosaic[y::2, 1 - x::2],
+        "g2": mosaic[1 - y::2, x::2],
+        "b": mosaic[1 - y::2, 1 - x::2]
+    }
+
+
+def _average_green(planes, out):
+    total = planes["g1"].astype(np.uint32)
+    total += planes["g2"]
+    total >>= 1
+    np.copyto(out, total, casting="unsafe")
+
+
+def superpixel(mosaic, offsets, out=None):
+    """
+    Every 2x2 cell becomes one BGR pixel, greens are averaged. Half resolution, but cheapest.
+    """
+    mosaic = mosaic[:mosaic.shape[0] - mosaic.shape[0] % 2, :mosaic.shape[1] - mosaic.shape[1] % 2]
+    planes = _planes(mosaic, offsets)
+    result = _result(out, planes["r"].shape + (3,), mosaic.dtype)
+    np.copyto(result[:, :, 0], planes["b"])
+    _average_green(planes, result[:, :, 1])
+    np.copyto(result[:, :, 2], planes["r"])
+    return result
+
+
+def extract_channel(mosaic, offsets, channel, out=None):
+    """
+    Single color plane of half resolution, greens are averaged.
+    """
+    mosaic = mosaic[:mosaic.shape[0] - mosaic.shape[0] % 2, :mosaic.shape[1] - mosaic.shape[1] % 2]
+    planes = _planes(mosaic, offsets)
+    result = _result(out, planes["r"].shape, mosaic.dtype)
+    if channel == "g":
+        _average_green(planes, result)
+    elif channel in planes:
+        np.copyto(result, planes[channel])
+    else:
+        raise ValueError(f"Unknown channel {channel}, expected one of {channels}")
+    return result
+
+
+def _interpolate(sparse, kernel, out):
+    """
+    Weighted sum of shifted views of reflect-padded sparse plane (reflection keeps Bayer parity), divided by 4.
+    """
+    height, width = out.shape
+    padded = np.pad(sparse, 1, mode="reflect")
+    total = np.zeros((height, width), dtype=np.uint32)
+    for dy, dx, weight in kernel:
+        shifted = padded[1 + dy:1 + dy + height, 1 + dx:1 + dx + width]
+        if weight == 1:
+            total += shifted
+        else:
+            total += shifted * np.uint32(weight)
+    total += 2
+    total >>= 2
+    np.copyto(out, total, casting="unsafe")
+
+
+def bilinear(mosaic, offsets, out=None):
+    """
+    Full resolution BGR frame, missing samples interpolated from nearest neighbours of the same color.
+    """
+    mosaic = mosaic[:mosaic.shape[0] - mosaic.shape[0] % 2, :mosaic.shape[1] - mosaic.shape[1] % 2]
+    result = _result(out, mosaic.shape + (3,), mosaic.dtype)
+    x, y = offsets
+    sparse = np.zeros(mosaic.shape, dtype=np.uint32)
+    for plane, (px, py), kernel in [(2, (x, y), _red_blue_kernel), (0, (1 - x, 1 - y), _red_blue_kernel)]:
+        sparse[py::2, px::2] = mosaic[py::2, px::2]
+        _interpolate(sparse, kernel, result[:, :, plane])
+        sparse[py::2, px::2] = 0
+    sparse[y::2, 1 - x::2] = mosaic[y::2, 1 - x::2]
+    sparse[1 - y::2, x::2] = mosaic[1 - y::2, x::2]
+    _interpolate(sparse, _green_kernel, result[:, :, 1])
+    return result
+
+
+def debayer(mosaic, offsets, mode, channel="g", out=None):
+    """
+    :param mosaic: raw frame as returned by frame_as_array
+    :param offsets: (x, y) ASCOM Bayer offsets of the frame
+    :param out: optional writable buffer for result, e.g. frame ring slot or writer buffer
+    :return: BGR frame (superpixel, bilinear) or single plane (channel)
+    """
+    if mode == MODE_SUPERPIXEL:
+        return superpixel(mosaic, offsets, out)
+    if mode == MODE_BILINEAR:
+        return bilinear(mosaic, offsets, out)
+    if mode == MODE_CHANNEL:
+        return extract_channel(mosaic, offsets, channel, out)
+    raise ValueError(f"Unknown debayer mode {mode}, expected one of {debayer_modes}")
@@ -0,0 +1,44 @@
+from threading import Lock
+
+
+DEFAULT_OVERHEAD_S = 0.05
+OVERHEAD_SMOOTHING = 0.3
+OVERHEAD_GUARD_FRACTION = 0.2
+MIN_GUARD_S = 0.005
+FINAL_POLL_S = 0.002
+
+
+class ExposureTimingModel:
+    """
+    Learns, per frame format, how long after the nominal end of exposure camera reports it as done
+    (readout and USB overhead), as exponential moving average. Waiting for exposure then sleeps until
+    just before expected completion and polls status only shortly, at fine interval.
+    """
+    def __init__(self, default_overhead_s=DEFAULT_OVERHEAD_S):
+        self._lock = Lock()
+        self._default_overhead_s = default_overhead_s
+        self._overheads = {}
+        self._polls = {}
+
+    def sleep_until(self, key, start, duration_s):
+        """
+        :return: time until which it is certainly not worth to poll camera
+        """
+        with self._lock:
+            overhead = self._overheads.get(key, self._default_overhead_s)
+        guard = max(MIN_GUARD_S, overhead * OVERHEAD_GUARD_FRACTION)
+        return start + duration_s + max(0.0, overhead - guard)
+
+    def record(self, key, start, duration_s, end, polls):
+        overhead = max(0.0, end - start - duration_s)
+        with self._lock:
+            previous = self._overheads.get(key)
+            self._overheads[key] = overhead if previous is None else \
+                previous + OVERHEAD_SMOOTHING * (overhead - previous)
+            self._polls[key] = polls
+        return overhead
+
+    def get_stats(self):
+        with self._lock:
+            return [{"Format": list(key), "Overhead": overhead, "LastPolls": self._polls[key]}
+                    for key, overhead in self._overheads.items()]
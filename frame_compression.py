@@ -0,0 +1,93 @@
+import numpy as np
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+
+ZSTD_LEVEL = 1
+DEFLATE_LEVEL = 1
+
+
+def _compress_zstd(data):
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+
+
+def _compress_lz4(data):
+    return lz4_frame.compress(data)
+
+
+def _compress_deflate(data):
+    return zlib.compress(data, DEFLATE_LEVEL)
+
+
+# In order of preference, when client accepts all of them equally. Frames are byte-shuffled before compression,
+# so these are not HTTP content codings: client asks for them in X-Frame-Encoding request header (with the same
+# syntax as Accept-Encoding) and has to unshuffle decompressed data, see X-Frame-Shuffle response header.
+FRAME_ENCODING_HEADER = "X-Frame-Encoding"
+compressors = {}
+if zstandard is not None:
+    compressors["zstd"] = _compress_zstd
+if lz4_frame is not None:
+    compressors["lz4"] = _compress_lz4
+compressors["deflate"] = _compress_deflate
+
+
+def negotiate_encoding(accept_encoding):
+    """
+    Picks best available codec from X-Frame-Encoding header value.
+    :return: codec name or None if frame should be sent as it is
+    """
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for item in accept_encoding.split(","):
+        token, _, q = item.strip().partition(";")
+        try:
+            quality = float(q.strip()[2:]) if q.strip().startswith("q=") else 1.0
+        except ValueError:
+            quality = 0.0
+        accepted[token.strip().lower()] = quality
+    best, best_quality = None, 0.0
+    for codec in compressors.keys():
+        quality = accepted.get(codec, accepted.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = codec, quality
+    return best
+
+
+def shuffle_bytes(img, out):
+    """
+    Byte shuffle: all lowest bytes of elements first, then all next ones and so on.
+    High bytes of sky frames are very similar, so shuffled data compresses much better.
+    :param out: writable buffer of img.nbytes size
+    """
+    itemsize = img.dtype.itemsize
+    target = np.frombuffer(out, dtype=np.uint8, count=img.nbytes).reshape((itemsize, -1))
+    np.copyto(target, np.ascontiguousarray(img).view(np.uint8).reshape((-1, itemsize)).T)
+    return itemsize
+
+
+def compress_frame(img, codec, out):
+    """
+    Shuffles and compresses frame into out buffer (which is also used as scratch for shuffled data).
+    :return: (compressed length, shuffle element size) or None if compression does not make frame smaller
+    """
+    itemsize = 1
+    if img.dtype.itemsize > 1:
+        itemsize = shuffle_bytes(img, out)
+        source = memoryview(out)[:img.nbytes]
+    else:
+        source = memoryview(np.ascontiguousarray(img)).cast("B")
+    compressed = compressors[codec](source)
+    if len(compressed) >= img.nbytes:
+        return None
+    out[:len(compressed)] = compressed
+    return len(compressed), itemsize
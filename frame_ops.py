@@ -0,0 +1,154 @@
+import numpy as np
+
+
+# Alpaca ImageBytes element types:
+ELEMENT_UNKNOWN = 0
+ELEMENT_INT16 = 1
+ELEMENT_INT32 = 2
+ELEMENT_DOUBLE = 3
+ELEMENT_SINGLE = 4
+ELEMENT_UINT64 = 5
+ELEMENT_BYTE = 6
+ELEMENT_INT64 = 7
+ELEMENT_UINT16 = 8
+
+preview_methods = ["mean", "sum", "max", "stride"]
+stretch_methods = ["percentile", "mtf"]
+
+DEFAULT_LOW_PERCENTILE = 0.5
+DEFAULT_HIGH_PERCENTILE = 99.8
+# Automatic screen transfer function parameters, as used by PixInsight:
+MTF_SHADOWS_CLIP = -2.8
+MTF_TARGET_BACKGROUND = 0.25
+MAD_TO_SIGMA = 1.4826
+
+transmission_element_types = {
+    np.dtype(np.uint8): ELEMENT_BYTE,
+    np.dtype(np.int16): ELEMENT_INT16,
+    np.dtype(np.uint16): ELEMENT_UINT16,
+    np.dtype(np.int32): ELEMENT_INT32
+}
+
+
+def to_alpaca_layout(img, out=None):
+    """
+    Transposes camera frame (row-major, BGR for color) into Alpaca layout, which is indexed [x][y][plane].
+    :param img: frame as returned by frame_as_array
+    :param out: optional writable buffer to put result into, e.g. frame ring slot
+    :return: transposed array and ImageBytes metadata dict
+    """
+    if img.ndim == 3:
+        transposed = img[:, :, ::-1].transpose(1, 0, 2)
+    else:
+        transposed = img.transpose(1, 0)
+    if out is None:
+        result = np.ascontiguousarray(transposed)
+    else:
+        result = np.frombuffer(out, dtype=img.dtype, count=img.size).reshape(transposed.shape)
+        np.copyto(result, transposed)
+    dimensions = list(result.shape) + [0] * (3 - result.ndim)
+    metadata = {
+        "ImageElementType": ELEMENT_INT32,
+        "TransmissionElementType": transmission_element_types[img.dtype],
+        "Rank": img.ndim,
+        "Dimension1": dimensions[0],
+        "Dimension2": dimensions[1],
+        "Dimension3": dimensions[2]
+    }
+    return result, metadata
+
+
+def bin_reduce(img, factor, method, out=None):
+    """
+    Reduces frame resolution by factor in both axes, with reshape-reduce over factor x factor blocks.
+    Trailing rows and columns not filling whole block are skipped.
+    :param out: optional writable buffer for result, e.g. frame ring slot
+    :return: reduced array (placed in out if given)
+    """
+    rows, columns = img.shape[0] // factor, img.shape[1] // factor
+    shape = (rows, columns) + img.shape[2:]
+    dtype = np.uint32 if method == "sum" else img.dtype
+    if out is None:
+        result = np.empty(shape, dtype=dtype)
+    else:
+        result = np.frombuffer(out, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+    cropped = img[:rows * factor, :columns * factor]
+    if method == "stride":
+        np.copyto(result, cropped[::factor, ::factor])
+        return result
+    blocks = cropped.reshape((rows, factor, columns, factor) + img.shape[2:])
+    if method == "sum":
+        blocks.sum(axis=(1, 3), dtype=np.uint32, out=result)
+    elif method == "max":
+        blocks.max(axis=(1, 3), out=result)
+    elif method == "mean":
+        np.copyto(result, np.rint(blocks.mean(axis=(1, 3), dtype=np.float32)), casting="unsafe")
+    else:
+        raise ValueError(f"Unknown method {method}, expected one of {preview_methods}")
+    return result
+
+
+def frame_histogram(img):
+    """
+    Histogram with one bin per possible value of 8 or 16 bit data, all color channels together.
+    """
+    levels = 256 if img.dtype.itemsize == 1 else 65536
+    return np.bincount(img.ravel(), minlength=levels)
+
+
+def histogram_percentiles(histogram, percentiles):
+    """
+    Percentiles read from cumulative histogram - no sorting of pixel data needed.
+    """
+    cumulative = np.cumsum(histogram)
+    ranks = np.asarray(percentiles, dtype=np.float64) / 100 * (cumulative[-1] - 1)
+    return np.searchsorted(cumulative, ranks, side="right")
+
+
+def histogram_median_mad(histogram):
+    """
+    :return: median and median absolute deviation of data described by histogram
+    """
+    median = histogram_percentiles(histogram, [50])[0]
+    deviations = np.bincount(np.abs(np.arange(len(histogram)) - median), weights=histogram)
+    return median, histogram_percentiles(deviations, [50])[0]
+
+
+def _mtf(midtones, x):
+    return (midtones - 1) * x / ((2 * midtones - 1) * x - midtones)
+
+
+def stretch_lut(histogram, method="percentile", low=DEFAULT_LOW_PERCENTILE, high=DEFAULT_HIGH_PERCENTILE):
+    """
+    Lookup table mapping every possible pixel value to 8 bit display value.
+    :param method: "percentile" for linear stretch between low and high percentiles,
+                   "mtf" for automatic midtones transfer function stretch based on median and MAD
+    """
+    levels = len(histogram)
+    x = np.arange(levels, dtype=np.float64)
+    if method == "percentile":
+        black, white = histogram_percentiles(histogram, [low, high])
+        y = (x - black) / max(white - black, 1)
+    elif method == "mtf":
+        median, mad = histogram_median_mad(histogram)
+        shadows = min(max(0.0, median + MTF_SHADOWS_CLIP * MAD_TO_SIGMA * mad), levels - 2)
+        y = np.clip((x - shadows) / (levels - 1 - shadows), 0, 1)
+        midtones = _mtf(MTF_TARGET_BACKGROUND, (median - shadows) / (levels - 1 - shadows))
+        y = _mtf(min(max(midtones, 1e-4), 1 - 1e-4), y)
+    else:
+        raise ValueError(f"Unknown stretch {method}, expected one of {stretch_methods}")
+    return (np.clip(y, 0, 1) * 255 + 0.5).astype(np.uint8)
+
+
+def laplacian_variance(img, mosaic=False):
+    """
+    Focus metric: variance of discrete Laplacian, higher is sharper.
+    :param mosaic: frame is raw Bayer mosaic, 2x2 cells are averaged first
+    """
+    if mosaic:
+        img = bin_reduce(img, 2, "mean")
+    data = img.astype(np.float32)
+    if data.ndim == 3:
+        data = data.mean(axis=2)
+    laplacian = 4 * data[1:-1, 1:-1] - data[:-2, 1:-1] - data[2:, 1:-1] - data[1:-1, :-2] - data[1:-1, 2:]
+    return float(laplacian.var())
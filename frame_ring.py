@@ -0,0 +1,192 @@
+from multiprocessing import resource_tracker, Lock, RawArray
+from multiprocessing.shared_memory import SharedMemory
+import os
+
+
+DEFAULT_RING_SLOTS = 4
+DEFAULT_STREAM_CHUNK_SIZE = 256 * 1024
+
+
+class SlotsBusyError(RuntimeError):
+    """
+    All slots of the ring are pinned - frames in them are still being sent or used.
+    """
+
+
+class FrameInfo:
+    """
+    Small descriptor of a frame stored in FrameRing - this is what crosses process boundary instead of pixels.
+    """
+    def __init__(self, slot, sequence, width, height, image_type, length, dtype=None, shape=None):
+        self.slot = slot
+        self.sequence = sequence
+        self.width = width
+        self.height = height
+        self.image_type = image_type
+        self.length = length
+        # for processed data which is not camera frame anymore (e.g. preview) array description is given directly:
+        self.dtype = dtype
+        self.shape = shape
+
+    def __repr__(self):
+        return f"FrameInfo(slot={self.slot}, sequence={self.sequence}, " \
+               f"{self.width}x{self.height}, type={self.image_type}, length={self.length})"
+
+
+class FrameRing:
+    """
+    Ring of shared memory slots for one camera. Camera process creates slots and reads frames directly into them,
+    server side attaches to the same slots by name and serves data from there.
+    Slot is pinned while its data is in use (e.g. being sent to client) and will not be overwritten until unpinned.
+    """
+    def __init__(self, camera_id, slots=DEFAULT_RING_SLOTS):
+        self._prefix = f"remotearray_{os.getpid()}_cam{camera_id}"
+        self._slots_number = slots
+        self._pins = RawArray('i', slots)
+        self._pins_lock = Lock()
+        self._segments = {}
+        self._slot_size = 0
+        self._owner = False
+        self._next_slot = -1
+        self._sequence = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_segments"] = {}
+        return state
+
+    def _slot_name(self, slot):
+        return f"{self._prefix}_{slot}"
+
+    def get_slots_number(self):
+        return self._slots_number
+
+    def get_slot_size(self):
+        return self._slot_size
+
+    def pin(self, slot):
+        with self._pins_lock:
+            self._pins[slot] += 1
+
+    def unpin(self, slot):
+        with self._pins_lock:
+            self._pins[slot] = max(0, self._pins[slot] - 1)
+
+    # Camera process side:
+    def create(self, slot_size):
+        self.close()
+        self._owner = True
+        self._slot_size = slot_size
+        for slot in range(0, self._slots_number):
+            name = self._slot_name(slot)
+            try:
+                stale = SharedMemory(name=name)
+                stale.close()
+                stale.unlink()
+            except FileNotFoundError:
+                pass
+            self._segments[slot] = SharedMemory(name=name, create=True, size=slot_size)
+            self._pins[slot] = 0
+
+    def next_slot(self, pin=False):
+        """
+        Next slot to write to - never pinned one and never the one returned last time, as it holds newest frame.
+        :param pin: pin the slot right away, needed when another thread may be looking for a slot at the same time
+        """
+        with self._pins_lock:
+            for i in range(1, self._slots_number):
+                slot = (self._next_slot + i) % self._slots_number
+                if self._pins[slot] == 0:
+                    self._next_slot = slot
+                    if pin:
+                        self._pins[slot] = 1
+                    return slot
+        raise SlotsBusyError(f"All {self._slots_number} frame slots are in use")
+
+    def writable(self, slot, length):
+        return self._segments[slot].buf[:length]
+
+    def _new_sequence(self):
+        with self._pins_lock:
+            self._sequence += 1
+            return self._sequence
+
+    def publish(self, slot, width, height, image_type, length, sequence=None):
+        """
+        :param sequence: passed for data derived from already published frame, new number is assigned otherwise
+        """
+        if sequence is None:
+            sequence = self._new_sequence()
+        return FrameInfo(slot, sequence, width, height, image_type, length)
+
+    def publish_array(self, slot, array, sequence=None):
+        """
+        Publishes processed data which has been put into slot as given numpy array.
+        """
+        if sequence is None:
+            sequence = self._new_sequence()
+        return FrameInfo(slot, sequence, array.shape[1], array.shape[0], None, array.nbytes,
+                         dtype=array.dtype.str, shape=array.shape)
+
+    # Server side (works in camera process too):
+    def _attach(self, slot):
+        if slot not in self._segments:
+            segment = SharedMemory(name=self._slot_name(slot))
+            # Segment belongs to camera process, it must not be unlinked when this process exits:
+            resource_tracker.unregister(segment._name, "shared_memory")
+            self._segments[slot] = segment
+        return self._segments[slot]
+
+    def view(self, frame: FrameInfo):
+        return self._attach(frame.slot).buf[:frame.length]
+
+    def close(self):
+        for segment in self._segments.values():
+            try:
+                segment.close()
+            except BufferError:
+                pass  # some view is still exported, memory will be released with process
+            if self._owner:
+                segment.unlink()
+        self._segments = {}
+
+
+class FrameStream:
+    """
+    Iterable response body sending frame slot in chunks. Slot has to be pinned before, it is unpinned
+    when WSGI server closes the iterable - after sending is finished or client disconnected.
+    """
+    def __init__(self, ring: FrameRing, frame: FrameInfo, prefix=b"", chunk_size=DEFAULT_STREAM_CHUNK_SIZE):
+        self._ring = ring
+        self._frame = frame
+        self._prefix = prefix
+        self._chunk_size = chunk_size
+        self._closed = False
+
+    def __len__(self):
+        return len(self._prefix) + self._frame.length
+
+    def __iter__(self):
+        if self._prefix:
+            yield self._prefix
+        view = self._ring.view(self._frame)
+        for offset in range(0, self._frame.length, self._chunk_size):
+            # WSGI requires bytes, so each chunk (but never the whole frame) is copied on its way out
+            yield bytes(view[offset:offset + self._chunk_size])
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._ring.unpin(self._frame.slot)
+
+
+class AsyncFrameStream(FrameStream):
+    """
+    FrameStream for ASGI server: async iterable, closed with await.
+    """
+    async def __aiter__(self):
+        for chunk in self.__iter__():
+            yield chunk
+
+    async def close(self):
+        super().close()
@@ -0,0 +1,79 @@
+from .frame_ops import frame_histogram, histogram_median_mad, MAD_TO_SIGMA
+from collections import OrderedDict
+from threading import Lock
+import numpy as np
+import time
+
+
+DEFAULT_STATS_ENTRIES = 64
+histogram_bins = [256, 4096]
+
+
+def saturation_level(max_adu, dtype):
+    """
+    Value at which pixel is saturated - 16 bit data from sensors with fewer bits is scaled up by SDK.
+    """
+    levels = 2 ** (8 * np.dtype(dtype).itemsize)
+    if max_adu >= levels:
+        return levels - 1
+    return (max_adu - 1) * (levels // max_adu)
+
+
+def compute_frame_stats(img, max_adu):
+    """
+    All statistics are derived from single full-resolution histogram, which is the only pass over pixel data.
+    Histogram stored in record has 256 bins for 8 bit data and 4096 bins for 16 bit data.
+    """
+    ss = time.time()
+    histogram = frame_histogram(img)
+    levels = np.flatnonzero(histogram)
+    pixels = int(histogram.sum())
+    median, mad = histogram_median_mad(histogram)
+    saturated = int(histogram[saturation_level(max_adu, img.dtype):].sum())
+    bins = min(len(histogram), histogram_bins[-1])
+    return {
+        "Min": int(levels[0]),
+        "Max": int(levels[-1]),
+        "Mean": float(np.dot(histogram, np.arange(len(histogram), dtype=np.float64)) / pixels),
+        "Median": int(median),
+        "MAD": int(mad),
+        "Noise": float(mad * MAD_TO_SIGMA),
+        "SaturatedFraction": saturated / pixels,
+        "Pixels": pixels,
+        "Histogram": histogram.reshape((bins, -1)).sum(axis=1).tolist(),
+        "ComputeTime": time.time() - ss
+    }
+
+
+def rebin_histogram(histogram, bins):
+    if bins not in histogram_bins or bins > len(histogram):
+        raise ValueError(f"Histogram can have {[b for b in histogram_bins if b <= len(histogram)]} bins, got {bins}")
+    return np.asarray(histogram).reshape((bins, -1)).sum(axis=1).tolist()
+
+
+class FrameStatsCache:
+    """
+    Statistics records of recent frames, keyed by frame sequence number.
+    Filled at readout (possibly from acquisition thread), read when clients ask for them.
+    """
+    def __init__(self, entries=DEFAULT_STATS_ENTRIES):
+        self._entries = entries
+        self._records = OrderedDict()
+        self._lock = Lock()
+
+    def put(self, sequence, record):
+        record["Sequence"] = sequence
+        with self._lock:
+            self._records[sequence] = record
+            while len(self._records) > self._entries:
+                self._records.popitem(last=False)
+
+    def get(self, sequence=None):
+        """
+        :param sequence: frame sequence number, newest record is returned if not given
+        :return: statistics record or None if there is no such
+        """
+        with self._lock:
+            if sequence is None:
+                return next(reversed(self._records.values()), None)
+            return self._records.get(sequence)
@@ -0,0 +1,223 @@
+from threading import Thread, Condition, current_thread
+from collections import deque
+from .raw_writers import frame_writers
+import time
+import os
+
+
+DEFAULT_WRITER_THREADS = 2
+DEFAULT_WRITER_QUEUE_DEPTH = 4
+DEFAULT_SPILL_PATH = "/dev/shm/remotearray_spill"
+
+POLICY_BLOCK = "block"
+POLICY_DROP_OLDEST = "drop_oldest"
+POLICY_SPILL = "spill"
+overflow_policies = [POLICY_BLOCK, POLICY_DROP_OLDEST, POLICY_SPILL]
+
+DEFAULT_FILE_FORMAT = "tif"
+
+
+def save_frame(filename, buffer, width, height, image_type, file_format=DEFAULT_FILE_FORMAT, header=None):
+    frame_writers[file_format](filename, buffer, width, height, image_type, header)
+
+
+class WriteJob:
+    def __init__(self, filename, buffer, width, height, image_type, file_format, header):
+        self.filename = filename
+        self.buffer = buffer
+        self.width = width
+        self.height = height
+        self.image_type = image_type
+        self.file_format = file_format
+        self.header = header
+        self.spill_file = None
+        self.submitted = time.time()
+
+
+class WriterPool:
+    """
+    Pool of threads writing frames to disk. Frames are read by camera into buffers owned by the pool,
+    so no allocation happens per frame. Number of buffers bounds the queue; what happens when all of them
+    are taken is decided by overflow policy:
+    block - wait for the oldest frame to be written,
+    drop_oldest - oldest frame waiting in queue is discarded,
+    spill - oldest frame waiting in queue is dumped as raw data to tmpfs and written later.
+    """
+    def __init__(self, log, threads=DEFAULT_WRITER_THREADS, depth=DEFAULT_WRITER_QUEUE_DEPTH,
+                 policy=POLICY_BLOCK, spill_path=DEFAULT_SPILL_PATH):
+        self._log = log
+        self._condition = Condition()
+        self._jobs = deque()
+        self._free = []
+        self._buffer_size = 0
+        self._in_progress = 0
+        self._workers = []
+        self._threads = 0
+        self._depth = 0
+        self._policy = POLICY_BLOCK
+        self._spill_path = spill_path
+        self._spill_counter = 0
+        self._error = None
+        self._stats = {}
+        self.reset_stats()
+        self.configure(threads, depth, policy)
+
+    def configure(self, threads, depth, policy):
+        threads = int(threads)
+        depth = int(depth)
+        if threads < 1 or depth < 1:
+            raise ValueError(f"Threads and depth must be positive, got {threads} and {depth}")
+        if policy not in overflow_policies:
+            raise ValueError(f"Unknown overflow policy {policy}, expected one of {overflow_policies}")
+        self.flush()
+        with self._condition:
+            self._depth = depth
+            self._policy = policy
+            self._buffer_size = 0
+            self._free = []
+            while len(self._workers) < threads:
+                worker = Thread(target=self._work, daemon=True)
+                self._workers.append(worker)
+                worker.start()
+            self._threads = threads
+            self._condition.notify_all()
+        self._log.info(f"Writer pool: {threads} threads, queue depth {depth}, policy {policy}")
+
+    def reset_stats(self):
+        self._stats = {
+            "Written": 0,
+            "Dropped": 0,
+            "Spilled": 0,
+            "Errors": 0,
+            "LastLatency": 0,
+            "MaxLatency": 0,
+            "TotalLatency": 0,
+            "LastWriteTime": 0
+        }
+
+    def reserve(self, buffer_size):
+        """
+        Prepares pool buffers for frames of given size - this is the only place they are allocated.
+        Frames submitted before are written first.
+        :return: first exception encountered while writing them, as from flush()
+        """
+        error = self.flush()
+        with self._condition:
+            if buffer_size != self._buffer_size:
+                self._buffer_size = buffer_size
+                self._free = [bytearray(buffer_size) for _ in range(self._depth + self._threads)]
+        return error
+
+    def acquire_buffer(self):
+        with self._condition:
+            while not self._free:
+                victim = self._oldest_buffered_job()
+                if self._policy == POLICY_BLOCK or victim is None:
+                    self._condition.wait()
+                elif self._policy == POLICY_DROP_OLDEST:
+                    self._jobs.remove(victim)
+                    self._stats["Dropped"] += 1
+                    self._log.warning(f"Writer queue full, dropping {victim.filename}")
+                    self._free.append(victim.buffer)
+                else:
+                    self._spill(victim)
+            return self._free.pop()
+
+    def submit(self, filename, buffer, width, height, image_type, file_format=DEFAULT_FILE_FORMAT, header=None):
+        with self._condition:
+            self._jobs.append(WriteJob(filename, buffer, width, height, image_type, file_format, header))
+            self._condition.notify()
+
+    def flush(self):
+        """
+        Waits for all submitted frames to be written.
+        :return: first exception encountered while writing since last flush or None
+        """
+        with self._condition:
+            while self._jobs or self._in_progress > 0:
+                self._condition.wait()
+            error, self._error = self._error, None
+            return error
+
+    def get_queue_depth(self):
+        return len(self._jobs)
+
+    def get_stats(self):
+        with self._condition:
+            stats = dict(self._stats)
+            total_latency = stats.pop("TotalLatency")
+            stats["MeanLatency"] = total_latency / stats["Written"] if stats["Written"] > 0 else 0
+            stats.update({
+                "QueueDepth": len(self._jobs),
+                "InProgress": self._in_progress,
+                "FreeBuffers": len(self._free),
+                "Threads": self._threads,
+                "Depth": self._depth,
+                "Policy": self._policy
+            })
+            return stats
+
+    def _oldest_buffered_job(self):
+        for job in self._jobs:
+            if job.buffer is not None:
+                return job
+        return None
+
+    def _spill(self, job):
+        os.makedirs(self._spill_path, exist_ok=True)
+        self._spill_counter += 1
+        spill_file = os.path.join(self._spill_path, f"{os.getpid()}_{self._spill_counter}.raw")
+        with open(spill_file, "wb") as f:
+            f.write(job.buffer)
+        self._free.append(job.buffer)
+        job.buffer = None
+        job.spill_file = spill_file
+        self._stats["Spilled"] += 1
+        self._log.warning(f"Writer queue full, {job.filename} spilled to {spill_file}")
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while True:
+                    if len(self._workers) > self._threads:
+                        self._workers.remove(current_thread())
+                        return
+                    if self._jobs:
+                        break
+                    self._condition.wait()
+                job = self._jobs.popleft()
+                self._in_progress += 1
+
+            ws = time.time()
+            error = None
+            try:
+                buffer = job.buffer
+                if job.spill_file is not None:
+                    buffer = bytearray(os.path.getsize(job.spill_file))
+                    with open(job.spill_file, "rb") as f:
+                        f.readinto(buffer)
+                save_frame(job.filename, buffer, job.width, job.height, job.image_type, job.file_format, job.header)
+                if job.spill_file is not None:
+                    os.remove(job.spill_file)
+                self._log.debug(f"Wrote {job.filename}")
+            except Exception as e:
+                self._log.error(f"Could not write {job.filename}: {repr(e)}")
+                error = e
+
+            we = time.time()
+            with self._condition:
+                self._in_progress -= 1
+                if job.buffer is not None and len(job.buffer) == self._buffer_size:
+                    self._free.append(job.buffer)
+                if error is not None:
+                    self._stats["Errors"] += 1
+                    if self._error is None:
+                        self._error = error
+                else:
+                    latency = we - job.submitted
+                    self._stats["Written"] += 1
+                    self._stats["LastLatency"] = latency
+                    self._stats["MaxLatency"] = max(latency, self._stats["MaxLatency"])
+                    self._stats["TotalLatency"] += latency
+                    self._stats["LastWriteTime"] = we - ws
+                self._condition.notify_all()
@@ -0,0 +1,116 @@
+from .frame_ops import frame_histogram, histogram_median_mad, MAD_TO_SIGMA
+from .app_utils import parse_bool
+from threading import Lock
+import numpy as np
+import json
+import os
+
+
+DEFAULT_HOT_PIXEL_SIGMA = 6.0
+MAP_FILE = "hotpixels.npy"
+MAP_INFO_FILE = "hotpixels.json"
+
+# 8 neighbours, for mosaic at distance 2 so that they are of the same color:
+_neighbour_offsets = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+
+
+class HotPixelMap:
+    """
+    Hot and cold pixels found in mean of dark frames, kept as flat index array in full sensor coordinates.
+    For given frame format (ROI, binning) it is converted to flat indices into frame once and cached,
+    correction then replaces these pixels with median of their neighbours.
+    """
+    def __init__(self, log, path):
+        self._log = log
+        self._path = path
+        self._lock = Lock()
+        self._enabled = False
+        self._indices = None
+        self._info = {}
+        self._format_cache = {}
+        self._corrected = 0
+        map_file = os.path.join(self._path, MAP_FILE)
+        if os.path.isfile(map_file):
+            self._indices = np.load(map_file)
+            with open(os.path.join(self._path, MAP_INFO_FILE)) as f:
+                self._info = json.load(f)
+
+    def set_enabled(self, enabled):
+        self._enabled = parse_bool(enabled)
+
+    def is_enabled(self):
+        return self._enabled
+
+    def build(self, dark, roi, sensor_width, sigma=DEFAULT_HOT_PIXEL_SIGMA):
+        """
+        :param dark: mean of dark frames taken without binning, as 2D array
+        :param roi: [startx, starty, width, height] the frames were taken with
+        """
+        histogram = frame_histogram(np.rint(dark).astype(np.uint16))
+        median, mad = histogram_median_mad(histogram)
+        noise = max(mad * MAD_TO_SIGMA, 1.0)
+        hot = dark > median + sigma * noise
+        cold = dark < median - sigma * noise
+        ys, xs = np.nonzero(hot | cold)
+        indices = (ys + roi[1]) * sensor_width + xs + roi[0]
+        info = {
+            "Hot": int(np.count_nonzero(hot)),
+            "Cold": int(np.count_nonzero(cold)),
+            "Median": float(median),
+            "Noise": float(noise),
+            "Sigma": sigma,
+            "SensorWidth": sensor_width,
+            "Roi": list(roi)
+        }
+        os.makedirs(self._path, exist_ok=True)
+        np.save(os.path.join(self._path, MAP_FILE), indices.astype(np.int64))
+        with open(os.path.join(self._path, MAP_INFO_FILE), "w") as f:
+            json.dump(info, f, indent=1)
+        with self._lock:
+            self._indices = indices.astype(np.int64)
+            self._info = info
+            self._format_cache = {}
+        self._log.info(f"Hot pixel map built: {info}")
+        return info
+
+    def indices_for(self, roi, binning, shape):
+        """
+        :return: flat indices of pixels to correct in frames of given format, or None
+        """
+        with self._lock:
+            if not self._enabled or self._indices is None or len(shape) != 2:
+                return None
+            key = (tuple(roi), binning, tuple(shape))
+            if key not in self._format_cache:
+                width = self._info["SensorWidth"]
+                xs = self._indices % width // binning - roi[0]
+                ys = self._indices // width // binning - roi[1]
+                inside = (xs >= 0) & (xs < shape[1]) & (ys >= 0) & (ys < shape[0])
+                self._format_cache[key] = np.unique(ys[inside] * shape[1] + xs[inside])
+            return self._format_cache[key]
+
+    def correct(self, img, indices, mosaic=False):
+        """
+        Replaces given pixels with median of their 8 neighbours, all of them at once.
+        """
+        if indices is None or len(indices) == 0:
+            return
+        height, width = img.shape
+        distance = 2 if mosaic else 1
+        ys, xs = np.divmod(indices, width)
+        neighbours = np.empty((len(_neighbour_offsets), len(indices)), dtype=img.dtype)
+        for i, (dy, dx) in enumerate(_neighbour_offsets):
+            ny = ys + dy * distance
+            nx = xs + dx * distance
+            # reflect at frame border:
+            ny = np.where(ny < 0, ys - dy * distance, np.where(ny >= height, ys - dy * distance, ny))
+            nx = np.where(nx < 0, xs - dx * distance, np.where(nx >= width, xs - dx * distance, nx))
+            neighbours[i] = img[ny, nx]
+        img[ys, xs] = np.median(neighbours, axis=0)
+        self._corrected += 1
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self._info, Enabled=self._enabled,
+                        Pixels=len(self._indices) if self._indices is not None else 0,
+                        CorrectedFrames=self._corrected)
@@ -0,0 +1,145 @@
+from .app_utils import parse_bool
+from threading import Lock
+import numpy as np
+import time
+
+
+DEFAULT_KAPPA = 3.0
+DEFAULT_MIN_FRAMES = 10  # variance of fewer frames is too noisy to reject against
+
+stack_images = ["mean", "sum", "sigma"]
+stack_dtypes = {
+    "uint16": np.uint16,
+    "float32": np.float32
+}
+
+
+class LiveStack:
+    """
+    Running per-pixel mean and variance (Welford) of frames, kept in float32, so memory does not grow with
+    number of frames. With kappa > 0, pixels further than kappa sigma from running mean are rejected
+    (once there are at least min_frames frames), so each pixel has its own count. Sum is mean * count.
+    """
+    def __init__(self, log, kappa=DEFAULT_KAPPA, min_frames=DEFAULT_MIN_FRAMES):
+        self._log = log
+        self._lock = Lock()
+        self._enabled = False
+        self._kappa = kappa
+        self._min_frames = min_frames
+        self._mean = None
+        self._m2 = None
+        self._count = None
+        self._scratch = None
+        self._delta = None
+        self._accept = None
+        self._source_dtype = None
+        self._frames = 0
+        self._rejected = 0
+        self._last_add_time = 0
+
+    def configure(self, enabled, kappa, min_frames):
+        kappa = float(kappa)
+        min_frames = int(min_frames)
+        if kappa < 0 or min_frames < 2:
+            raise ValueError(f"Kappa must not be negative and min frames must be at least 2, "
+                             f"got {kappa} and {min_frames}")
+        with self._lock:
+            self._enabled = parse_bool(enabled)
+            self._kappa = kappa
+            self._min_frames = min_frames
+
+    def is_enabled(self):
+        return self._enabled
+
+    def reset(self):
+        with self._lock:
+            self._reset()
+
+    def _reset(self):
+        self._mean = self._m2 = self._count = self._scratch = self._delta = self._accept = None
+        self._source_dtype = None
+        self._frames = 0
+        self._rejected = 0
+
+    def _allocate(self, img):
+        self._mean = np.zeros(img.shape, dtype=np.float32)
+        self._m2 = np.zeros(img.shape, dtype=np.float32)
+        self._count = np.zeros(img.shape, dtype=np.float32)
+        self._scratch = np.empty(img.shape, dtype=np.float32)
+        self._delta = np.empty(img.shape, dtype=np.float32)
+        self._accept = np.empty(img.shape, dtype=bool)
+        self._source_dtype = img.dtype
+
+    def add(self, img):
+        """
+        Adds frame to stack, if stacking is enabled. Stack starts again when frame format changes.
+        """
+        with self._lock:
+            if not self._enabled:
+                return
+            ss = time.time()
+            if self._mean is None or self._mean.shape != img.shape or self._source_dtype != img.dtype:
+                if self._mean is not None:
+                    self._log.info(f"Frame format changed to {img.shape} {img.dtype}, live stack restarted")
+                self._reset()
+                self._allocate(img)
+            x, delta, accept = self._scratch, self._delta, self._accept
+            np.copyto(x, img, casting="unsafe")
+            np.subtract(x, self._mean, out=delta)
+            if self._kappa > 0 and self._frames >= self._min_frames:
+                # accept |x - mean| <= kappa * sigma, compared squared: delta^2 * (n - 1) <= kappa^2 * M2
+                np.maximum(self._count - 1, 1, out=x)
+                np.multiply(x, np.square(delta), out=x)
+                np.less_equal(x, self._kappa ** 2 * self._m2, out=accept)
+                self._rejected += int(accept.size - np.count_nonzero(accept))
+                np.copyto(x, img, casting="unsafe")
+            else:
+                accept.fill(True)
+            np.add(self._count, accept, out=self._count)
+            # Welford: mean += delta / n; M2 += delta * (x - new mean), for accepted pixels only
+            np.divide(delta, self._count, out=x, where=accept)
+            np.add(self._mean, x, out=self._mean, where=accept)
+            np.copyto(x, img, casting="unsafe")
+            np.subtract(x, self._mean, out=x)
+            np.multiply(x, delta, out=x)
+            np.add(self._m2, x, out=self._m2, where=accept)
+            self._frames += 1
+            self._last_add_time = time.time() - ss
+
+    def render(self, kind, out_dtype, out):
+        """
+        Writes current stack into out buffer.
+        :param kind: "mean", "sum" or "sigma"
+        :param out_dtype: float32, or uint16 - then 8 bit data is scaled to 16 bits
+        :return: array placed in out or None if stack is empty
+        """
+        with self._lock:
+            if self._mean is None:
+                return None
+            result = np.frombuffer(out, dtype=out_dtype, count=self._mean.size).reshape(self._mean.shape)
+            if kind == "mean":
+                source = self._mean
+            elif kind == "sum":
+                source = self._mean * self._count
+            elif kind == "sigma":
+                source = np.sqrt(self._m2 / np.maximum(self._count - 1, 1))
+            else:
+                raise ValueError(f"Unknown stack image {kind}, expected one of {stack_images}")
+            if result.dtype == np.float32:
+                np.copyto(result, source)
+            else:
+                scale = 257 if self._source_dtype.itemsize == 1 else 1
+                np.copyto(result, np.clip(np.rint(source * scale), 0, 65535), casting="unsafe")
+            return result
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "Enabled": self._enabled,
+                "Kappa": self._kappa,
+                "MinFrames": self._min_frames,
+                "Frames": self._frames,
+                "RejectedFraction": self._rejected / self._mean.size / self._frames if self._frames > 0 else 0,
+                "Shape": list(self._mean.shape) if self._mean is not None else None,
+                "LastAddTime": self._last_add_time
+            }
@@ -0,0 +1,72 @@
+from multiprocessing import Lock, RawArray, RawValue
+import ctypes
+import json
+import time
+
+
+DEFAULT_MIRROR_SIZE = 16 * 1024
+DEFAULT_MIRROR_MAX_AGE_S = 1.0
+MIRROR_READ_RETRIES = 100
+
+
+class PropertyMirror:
+    """
+    Snapshot of camera properties in shared memory, written by camera process and read by server side without
+    going through command queue. Snapshot is JSON of {name: {"Value": value, "Time": timestamp}}, guarded by
+    sequence lock: writer makes sequence odd while writing, reader retries when sequence was odd or has changed.
+    """
+    def __init__(self, size=DEFAULT_MIRROR_SIZE):
+        self._buffer = RawArray(ctypes.c_char, size)
+        self._length = RawValue(ctypes.c_uint32, 0)
+        self._sequence = RawValue(ctypes.c_uint64, 0)
+        self._write_lock = Lock()
+        self._entries = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_entries"] = {}
+        return state
+
+    # Camera process side:
+    def publish(self, values, timestamp=None):
+        """
+        Updates given properties. Value taken earlier than the one already published does not replace it.
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._write_lock:
+            for name, value in values.items():
+                if name not in self._entries or self._entries[name]["Time"] <= timestamp:
+                    self._entries[name] = {"Value": value, "Time": timestamp}
+            data = json.dumps(self._entries).encode("utf-8")
+            if len(data) > len(self._buffer):
+                raise ValueError(f"Snapshot of {len(data)} bytes does not fit in mirror of {len(self._buffer)}")
+            self._sequence.value += 1
+            ctypes.memmove(self._buffer, data, len(data))
+            self._length.value = len(data)
+            self._sequence.value += 1
+
+    # Server side:
+    def read(self):
+        """
+        :return: consistent snapshot, or None if it could not be read
+        """
+        for _ in range(0, MIRROR_READ_RETRIES):
+            before = self._sequence.value
+            if before % 2 == 1:
+                continue
+            data = self._buffer.raw[:self._length.value]
+            if self._sequence.value != before:
+                continue
+            return json.loads(data) if len(data) > 0 else {}
+        return None
+
+    def get(self, name, max_age_s=DEFAULT_MIRROR_MAX_AGE_S, not_before=0.0):
+        """
+        :return: (True, value) if property was published not earlier than not_before and is at most max_age_s old,
+        (False, None) otherwise
+        """
+        snapshot = self.read()
+        entry = snapshot.get(name) if snapshot is not None else None
+        if entry is None or entry["Time"] < not_before or time.time() - entry["Time"] > max_age_s:
+            return False, None
+        return True, entry["Value"]
@@ -0,0 +1,204 @@
+from .debayer import IMG_RGB48
+import zwoasi as asi
+import numpy as np
+import struct
+import os
+
+
+FITS_BLOCK = 2880
+FITS_CARD = 80
+NPY_ALIGNMENT = 64
+
+TIFF_SHORT = 3
+TIFF_LONG = 4
+
+bytes_per_sample = {
+    asi.ASI_IMG_RAW8: 1,
+    asi.ASI_IMG_Y8: 1,
+    asi.ASI_IMG_RAW16: 2,
+    asi.ASI_IMG_RGB24: 1,
+    IMG_RGB48: 2
+}
+
+samples_per_pixel = {
+    asi.ASI_IMG_RAW8: 1,
+    asi.ASI_IMG_Y8: 1,
+    asi.ASI_IMG_RAW16: 1,
+    asi.ASI_IMG_RGB24: 3,
+    IMG_RGB48: 3
+}
+
+
+# All writers below may modify given buffer in place (byte order, channel order), so it has to be
+# owned by the writer - e.g. buffer taken from WriterPool.
+
+
+def _write_all(filename, parts):
+    """
+    Writes all parts to file with single writev call (unless it was interrupted in the middle).
+    """
+    parts = [memoryview(p).cast("B") for p in parts]
+    fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o644)
+    try:
+        if not hasattr(os, "writev"):
+            for p in parts:
+                os.write(fd, p)
+            return
+        while parts:
+            written = os.writev(fd, parts)
+            while parts and written >= len(parts[0]):
+                written -= len(parts[0])
+                parts.pop(0)
+            if parts and written > 0:
+                parts[0] = parts[0][written:]
+    finally:
+        os.close(fd)
+
+
+def _sample_dtype(image_type):
+    return np.uint16 if bytes_per_sample[image_type] == 2 else np.uint8
+
+
+def _swap_bgr_to_rgb(buffer, width, height, image_type):
+    img = np.frombuffer(buffer, dtype=_sample_dtype(image_type), count=width*height*3).reshape((height, width, 3))
+    b = img[:, :, 0]
+    r = img[:, :, 2]
+    # xor swap works in place, without temporary channel copy:
+    np.bitwise_xor(b, r, out=b)
+    np.bitwise_xor(r, b, out=r)
+    np.bitwise_xor(b, r, out=b)
+
+
+def _data_view(buffer, width, height, image_type):
+    return memoryview(buffer)[:width * height * bytes_per_sample[image_type] * samples_per_pixel[image_type]]
+
+
+def write_tiff(filename, buffer, width, height, image_type, header=None):
+    """
+    Minimal baseline TIFF: little endian, uncompressed, single strip.
+    """
+    spp = samples_per_pixel[image_type]
+    bits = 8 * bytes_per_sample[image_type]
+    if spp == 3:
+        _swap_bgr_to_rgb(buffer, width, height, image_type)
+    data = _data_view(buffer, width, height, image_type)
+
+    entries_number = 10
+    ifd_offset = 8
+    extra_offset = ifd_offset + 2 + entries_number * 12 + 4
+    extra = b""
+    if spp == 1:
+        bits_entry = (258, TIFF_SHORT, 1, bits)
+    else:
+        extra = struct.pack("<3H", bits, bits, bits)
+        bits_entry = (258, TIFF_SHORT, 3, extra_offset)
+    data_offset = extra_offset + len(extra)
+    data_offset += data_offset % 2
+    entries = [
+        (256, TIFF_LONG, 1, width),
+        (257, TIFF_LONG, 1, height),
+        bits_entry,
+        (259, TIFF_SHORT, 1, 1),  # no compression
+        (262, TIFF_SHORT, 1, 2 if spp == 3 else 1),  # RGB or BlackIsZero
+        (273, TIFF_LONG, 1, data_offset),
+        (277, TIFF_SHORT, 1, spp),
+        (278, TIFF_LONG, 1, height),
+        (279, TIFF_LONG, 1, len(data)),
+        (284, TIFF_SHORT, 1, 1)  # chunky planar configuration
+    ]
+    ifd = struct.pack("<2sHI", b"II", 42, ifd_offset) + struct.pack("<H", entries_number)
+    for tag, field_type, count, value in entries:
+        if field_type == TIFF_SHORT and count == 1:
+            ifd += struct.pack("<HHIHH", tag, field_type, count, value, 0)
+        else:
+            ifd += struct.pack("<HHII", tag, field_type, count, value)
+    ifd += struct.pack("<I", 0) + extra
+    ifd += b"\0" * (data_offset - len(ifd))
+    _write_all(filename, [ifd, data])
+
+
+def _fits_card(key, value, comment=""):
+    if isinstance(value, str):
+        card = f"{key:<8}= " + ("'" + value.replace("'", "''").ljust(8) + "'").ljust(20)
+    else:
+        if isinstance(value, bool):
+            value = "T" if value else "F"
+        card = f"{key:<8}= {value:>20}"
+    if comment:
+        card += f" / {comment}"
+    return card[:FITS_CARD].ljust(FITS_CARD)
+
+
+def write_fits(filename, buffer, width, height, image_type, header=None):
+    """
+    Primary HDU only. 16 bit data is stored as signed big endian with BZERO=32768, as FITS requires.
+    """
+    header = header if header is not None else {}
+    spp = samples_per_pixel[image_type]
+    bits = 8 * bytes_per_sample[image_type]
+    img = np.frombuffer(buffer, dtype=_sample_dtype(image_type), count=width*height*spp)
+    if bits == 16:
+        img ^= 0x8000  # same as subtracting BZERO
+        img.byteswap(inplace=True)
+    if spp == 3:
+        # FITS color data is planar, this one needs real copy:
+        planes = img.reshape((height, width, 3)).transpose(2, 0, 1)[::-1]
+        data = memoryview(np.ascontiguousarray(planes)).cast("B")
+    else:
+        data = _data_view(buffer, width, height, image_type)
+
+    cards = [
+        _fits_card("SIMPLE", True, "conforms to FITS standard"),
+        _fits_card("BITPIX", bits, "array data type"),
+        _fits_card("NAXIS", 3 if spp == 3 else 2, "number of array dimensions"),
+        _fits_card("NAXIS1", width),
+        _fits_card("NAXIS2", height)
+    ]
+    if spp == 3:
+        cards.append(_fits_card("NAXIS3", 3))
+    if bits == 16:
+        cards.append(_fits_card("BZERO", 32768))
+        cards.append(_fits_card("BSCALE", 1))
+    keys = [
+        ("EXPTIME", "exposure", "exposure time [s]"),
+        ("GAIN", "gain", "sensor gain"),
+        ("CCD-TEMP", "temperature", "sensor temperature [C]"),
+        ("DATE-OBS", "timestamp", "UTC start of exposure"),
+        ("XBINNING", "bin", "binning factor"),
+        ("YBINNING", "bin", "binning factor"),
+        ("INSTRUME", "camera", "camera name")
+    ]
+    for fits_key, header_key, comment in keys:
+        if header.get(header_key) is not None:
+            cards.append(_fits_card(fits_key, header[header_key], comment))
+    cards.append(_fits_card("ROWORDER", "TOP-DOWN", "order of rows"))
+    cards.append("END".ljust(FITS_CARD))
+    header_bytes = "".join(cards).encode("ascii")
+    header_bytes += b" " * (-len(header_bytes) % FITS_BLOCK)
+    padding = b"\0" * (-data.nbytes % FITS_BLOCK)
+    _write_all(filename, [header_bytes, data, padding])
+
+
+def write_npy(filename, buffer, width, height, image_type, header=None):
+    """
+    NPY format version 1.0 - can be read with numpy.load.
+    """
+    spp = samples_per_pixel[image_type]
+    if spp == 3:
+        _swap_bgr_to_rgb(buffer, width, height, image_type)
+        shape = (height, width, 3)
+    else:
+        shape = (height, width)
+    descr = "<u2" if bytes_per_sample[image_type] == 2 else "|u1"
+    npy_header = f"{{'descr': '{descr}', 'fortran_order': False, 'shape': {shape}, }}"
+    preamble_length = 10
+    npy_header += " " * (-(preamble_length + len(npy_header) + 1) % NPY_ALIGNMENT) + "\n"
+    preamble = b"\x93NUMPY\x01\x00" + struct.pack("<H", len(npy_header))
+    _write_all(filename, [preamble + npy_header.encode("latin1"), _data_view(buffer, width, height, image_type)])
+
+
+frame_writers = {
+    "tif": write_tiff,
+    "fits": write_fits,
+    "npy": write_npy
+}
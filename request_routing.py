@@ -0,0 +1,188 @@
+from concurrent.futures import Future
+from itertools import count
+from threading import Thread, Lock
+import logging
+
+
+log = logging.getLogger('main')
+
+DEFAULT_RESULT_TIMEOUT_S = 30.0
+
+
+class RequestTagger:
+    """
+    Camera process side: results and frames sent back are tagged with id of request being handled,
+    so they reach the request that asked for them. Used in place of result queue and data pipe.
+    """
+    def __init__(self, result_queue, data_pipe):
+        self._result_queue = result_queue
+        self._data_pipe = data_pipe
+        self._request_id = None
+
+    def set_request_id(self, request_id):
+        self._request_id = request_id
+
+    def put(self, result):
+        result.set_request_id(self._request_id)
+        self._result_queue.put(result)
+
+    def send(self, frame):
+        self._data_pipe.send((self._request_id, frame))
+
+
+class FutureStream:
+    """
+    Items delivered in order, each one read through its own future - whichever side comes first creates it.
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self._futures = {}
+        self._written = 0
+        self._read = 0
+
+    def _take(self, index):
+        future = self._futures.pop(index, None)
+        if future is None:
+            future = self._futures[index] = Future()
+        return future
+
+    def put(self, item):
+        with self._lock:
+            future = self._take(self._written)
+            self._written += 1
+        future.set_result(item)
+
+    def next(self):
+        with self._lock:
+            future = self._take(self._read)
+            self._read += 1
+        return future
+
+    def poll(self):
+        """
+        :return: next item if it is already there, None otherwise
+        """
+        with self._lock:
+            if self._read >= self._written:
+                return None
+            future = self._take(self._read)
+            self._read += 1
+        return future.result()
+
+
+class PendingRequest:
+    """
+    Results and frames of one command sent to camera process. Command may have several results
+    (e.g. busy token, progress and done token of capture), they are read in order.
+    """
+    def __init__(self, request_id):
+        self.request_id = request_id
+        self._results = FutureStream()
+        self._frames = FutureStream()
+
+    def deliver_result(self, result):
+        self._results.put(result)
+
+    def deliver_frame(self, frame):
+        self._frames.put(frame)
+
+    def result_future(self) -> Future:
+        return self._results.next()
+
+    def frame_future(self) -> Future:
+        return self._frames.next()
+
+    def next_result(self, timeout=DEFAULT_RESULT_TIMEOUT_S):
+        """
+        :raise concurrent.futures.TimeoutError: when there is no result in time
+        """
+        return self.result_future().result(timeout)
+
+    def next_frame(self, timeout=DEFAULT_RESULT_TIMEOUT_S):
+        return self.frame_future().result(timeout)
+
+    def poll_result(self):
+        return self._results.poll()
+
+    def poll_frame(self):
+        return self._frames.poll()
+
+
+class ResultDemultiplexer:
+    """
+    Server side of one camera process: threads reading result queue and data pipe route everything
+    to pending request it is tagged with. Results of requests nobody waits for anymore are dropped,
+    and so are their frames - then their slots are unpinned here.
+    """
+    def __init__(self, command_queue, result_queue, data_pipe, ring):
+        self._command_queue = command_queue
+        self._result_queue = result_queue
+        self._data_pipe = data_pipe
+        self._ring = ring
+        self._lock = Lock()
+        self._pending = {}
+        self._ids = count(1)
+        self._dropped = 0
+        self._threads = [Thread(target=self._route_results, daemon=True),
+                         Thread(target=self._route_frames, daemon=True)]
+        for thread in self._threads:
+            thread.start()
+
+    def send(self, command) -> PendingRequest:
+        """
+        Tags command with new request id and sends it to camera process.
+        """
+        with self._lock:
+            request = PendingRequest(next(self._ids))
+            self._pending[request.request_id] = request
+        command.set_request_id(request.request_id)
+        self._command_queue.put(command)
+        return request
+
+    def release(self, request: PendingRequest):
+        with self._lock:
+            self._pending.pop(request.request_id, None)
+        frame = request.poll_frame()
+        while frame is not None:
+            self._ring.unpin(frame.slot)
+            frame = request.poll_frame()
+
+    def _find(self, request_id):
+        with self._lock:
+            request = self._pending.get(request_id)
+            if request is None:
+                self._dropped += 1
+            return request
+
+    def _route_results(self):
+        while True:
+            try:
+                result = self._result_queue.get()
+            except (EOFError, OSError):
+                return
+            request = self._find(result.get_request_id())
+            if request is None:
+                log.warning(f"Dropping result of request {result.get_request_id()}: {result.get() or result.error()}")
+                continue
+            request.deliver_result(result)
+
+    def _route_frames(self):
+        while True:
+            try:
+                request_id, frame = self._data_pipe.recv()
+            except (EOFError, OSError):
+                return
+            with self._lock:
+                request = self._pending.get(request_id)
+                if request is None:
+                    self._dropped += 1
+                else:
+                    # delivered under lock, so that release() either finds the frame or makes it dropped here:
+                    request.deliver_frame(frame)
+            if request is None:
+                log.warning(f"Dropping frame of request {request_id}: {frame}")
+                self._ring.unpin(frame.slot)
+
+    def get_stats(self):
+        with self._lock:
+            return {"Pending": len(self._pending), "Dropped": self._dropped}
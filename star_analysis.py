@@ -0,0 +1,179 @@
+from .frame_ops import frame_histogram, histogram_median_mad, bin_reduce, MAD_TO_SIGMA
+from .frame_stats import FrameStatsCache
+from .app_utils import parse_bool
+from threading import Lock
+import numpy as np
+import time
+
+
+DEFAULT_THRESHOLD_SIGMA = 5.0
+DEFAULT_CPU_BUDGET = 0.2
+MIN_STAR_PIXELS = 3
+MEASURE_RADIUS = 8
+BACKGROUND_SUBSAMPLING = 4
+REPORTED_STARS = 20
+GAUSSIAN_FWHM_TO_SIGMA = 2.3548
+
+
+def _background(img):
+    """
+    Median and noise of sky background, estimated on subsampled frame - stars are too few to matter.
+    """
+    median, mad = histogram_median_mad(frame_histogram(img[::BACKGROUND_SUBSAMPLING, ::BACKGROUND_SUBSAMPLING]))
+    return float(median), max(float(mad) * MAD_TO_SIGMA, 1.0)
+
+
+def _label(indices, width):
+    """
+    Connected-component labelling (4-connectivity) of pixels given by sorted flat indices.
+    Works on detected pixels only: labels are propagated along neighbour edges, with pointer jumping.
+    :return: component number for each pixel
+    """
+    n = len(indices)
+    edges = []
+    for step, same_row in [(1, True), (width, False)]:
+        position = np.searchsorted(indices, indices + step)
+        position[position == n] = 0
+        connected = indices[position] == indices + step
+        if same_row:
+            connected &= (indices % width) != width - 1
+        edges.append((np.flatnonzero(connected), position[connected]))
+    a = np.concatenate([e[0] for e in edges])
+    b = np.concatenate([e[1] for e in edges])
+    labels = np.arange(n)
+    while True:
+        updated = labels.copy()
+        np.minimum.at(updated, a, labels[b])
+        np.minimum.at(updated, b, labels[a])
+        updated = updated[updated]
+        if np.array_equal(updated, labels):
+            break
+        labels = updated
+    return np.unique(labels, return_inverse=True)[1]
+
+
+def detect_stars(img, threshold_sigma=DEFAULT_THRESHOLD_SIGMA, mosaic=False):
+    """
+    Finds stars as connected groups of pixels above background + threshold_sigma * noise,
+    and measures them in fixed radius around flux-weighted centroids.
+    :param img: frame as returned by frame_as_array
+    :param mosaic: frame is raw Bayer mosaic, 2x2 cells are averaged first
+    :return: metrics record
+    """
+    scale = 1
+    if mosaic:
+        img = bin_reduce(img, 2, "mean")
+        scale = 2
+    elif img.ndim == 3:
+        img = (img.sum(axis=2, dtype=np.uint32) // 3).astype(img.dtype)
+    height, width = img.shape
+    background, noise = _background(img)
+
+    indices = np.flatnonzero(img > background + threshold_sigma * noise)
+    stars = np.empty((0, 5))
+    if len(indices) > 0:
+        components = _label(indices, width)
+        sizes = np.bincount(components)
+        flux = np.maximum(img.ravel()[indices].astype(np.float64) - background, 0)
+        total = np.bincount(components, weights=flux)
+        cx = np.bincount(components, weights=flux * (indices % width)) / total
+        cy = np.bincount(components, weights=flux * (indices // width)) / total
+        r = MEASURE_RADIUS
+        keep = (sizes >= MIN_STAR_PIXELS) & (cx >= r) & (cx < width - r - 1) & (cy >= r) & (cy < height - r - 1)
+        cx, cy = cx[keep], cy[keep]
+        if len(cx) > 0:
+            # all stars measured at once, in (stars, 2r+1, 2r+1) stack of cutouts:
+            offsets = np.arange(-r, r + 1)
+            ys = np.rint(cy).astype(np.intp)[:, None, None] + offsets[None, :, None]
+            xs = np.rint(cx).astype(np.intp)[:, None, None] + offsets[None, None, :]
+            cutouts = np.maximum(img[ys, xs].astype(np.float64) - background, 0)
+            distance = np.hypot(xs - cx[:, None, None], ys - cy[:, None, None])
+            cutouts[distance > r] = 0
+            star_flux = cutouts.sum(axis=(1, 2))
+            valid = star_flux > 0
+            cutouts, distance, star_flux = cutouts[valid], distance[valid], star_flux[valid]
+            hfr = (cutouts * distance).sum(axis=(1, 2)) / star_flux
+            sigma = np.sqrt((cutouts * distance ** 2).sum(axis=(1, 2)) / (2 * star_flux))
+            stars = np.stack([cx[valid] * scale, cy[valid] * scale, hfr * scale,
+                              sigma * GAUSSIAN_FWHM_TO_SIGMA * scale, star_flux], axis=1)
+    brightest = stars[np.argsort(-stars[:, -1])[:REPORTED_STARS]] if len(stars) > 0 else stars
+    return {
+        "StarCount": len(stars),
+        "HFR": float(np.median(stars[:, 2])) if len(stars) > 0 else None,
+        "FWHM": float(np.median(stars[:, 3])) if len(stars) > 0 else None,
+        "Background": background,
+        "Noise": noise,
+        "Stars": [{"X": s[0], "Y": s[1], "HFR": s[2], "FWHM": s[3], "Flux": s[4]} for s in brightest.tolist()]
+    }
+
+
+class StarAnalyzer:
+    """
+    Optional star analysis of frames at readout. Analysis is given CPU budget: fraction of wall clock time
+    it may take. When it would take more, frames are skipped until enough time has passed since last one.
+    """
+    def __init__(self, log, budget=DEFAULT_CPU_BUDGET, threshold_sigma=DEFAULT_THRESHOLD_SIGMA):
+        self._log = log
+        self._lock = Lock()
+        self._enabled = False
+        self._budget = budget
+        self._threshold_sigma = threshold_sigma
+        self._records = FrameStatsCache()
+        self._last_end = 0
+        self._last_duration = 0
+        self._analyzed = 0
+        self._skipped = 0
+
+    def configure(self, enabled, budget, threshold_sigma):
+        budget = float(budget)
+        threshold_sigma = float(threshold_sigma)
+        if not 0 < budget <= 1:
+            raise ValueError(f"Budget must be in (0, 1], got {budget}")
+        if threshold_sigma <= 0:
+            raise ValueError(f"Threshold must be positive, got {threshold_sigma}")
+        with self._lock:
+            self._enabled = parse_bool(enabled)
+            self._budget = budget
+            self._threshold_sigma = threshold_sigma
+            self._analyzed = 0
+            self._skipped = 0
+
+    def process(self, sequence, img, mosaic=False):
+        """
+        Analyzes frame if analysis is enabled and fits in CPU budget.
+        """
+        with self._lock:
+            if not self._enabled:
+                return
+            idle_needed = self._last_duration * (1 - self._budget) / self._budget
+            if time.time() - self._last_end < idle_needed:
+                self._skipped += 1
+                return
+            threshold_sigma = self._threshold_sigma
+        ss = time.time()
+        try:
+            record = detect_stars(img, threshold_sigma, mosaic)
+        except Exception as e:
+            self._log.error(f"Star analysis of frame {sequence} failed: {repr(e)}")
+            return
+        se = time.time()
+        record["ComputeTime"] = se - ss
+        self._records.put(sequence, record)
+        with self._lock:
+            self._last_end = se
+            self._last_duration = se - ss
+            self._analyzed += 1
+
+    def get_metrics(self, sequence=None):
+        return self._records.get(sequence)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "Enabled": self._enabled,
+                "Budget": self._budget,
+                "Threshold": self._threshold_sigma,
+                "Analyzed": self._analyzed,
+                "Skipped": self._skipped,
+                "LastComputeTime": self._last_duration
+            }
@@ -19,3 +19,11 @@ class StatusResource:
         resp.text = json.dumps({"server": "OK"})
         resp.status = falcon.HTTP_200
         resp.content_type = falcon.MEDIA_JSON
+
+
+class AsyncStatusResource:
+    # noinspection PyMethodMayBeStatic
+    async def on_get(self, _req, resp):
+        resp.text = json.dumps({"server": "OK"})
+        resp.status = falcon.HTTP_200
+        resp.content_type = falcon.MEDIA_JSON
@@ -0,0 +1,79 @@
+from ..array_trigger import ArrayTrigger
+from threading import Thread
+import time
+import pytest
+
+
+def _wait_in_threads(trigger, job, parties, timeout):
+    results = [None] * parties
+
+    def wait(i):
+        try:
+            trigger.wait(job, timeout)
+            results[i] = time.time()
+        except RuntimeError as e:
+            results[i] = e
+
+    threads = [Thread(target=wait, args=(i,)) for i in range(parties)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def test_all_parties_pass_together():
+    trigger = ArrayTrigger()
+    trigger.configure(1, 3)
+    threads, results = _wait_in_threads(trigger, 1, 3, 5)
+    for thread in threads:
+        thread.join()
+    assert all(isinstance(result, float) for result in results)
+    assert max(results) - min(results) < 0.5
+
+
+def test_barrier_is_reused_for_next_frame():
+    trigger = ArrayTrigger()
+    trigger.configure(1, 2)
+    for _ in range(3):
+        threads, results = _wait_in_threads(trigger, 1, 2, 5)
+        for thread in threads:
+            thread.join()
+        assert all(isinstance(result, float) for result in results)
+
+
+def test_abort_releases_waiting_parties():
+    trigger = ArrayTrigger()
+    trigger.configure(1, 3)
+    threads, results = _wait_in_threads(trigger, 1, 2, 5)
+    time.sleep(0.1)
+    trigger.abort()
+    for thread in threads:
+        thread.join(2)
+    assert all(isinstance(result, RuntimeError) and "aborted" in str(result) for result in results)
+    with pytest.raises(RuntimeError):
+        trigger.wait(1, 0.1)
+
+
+def test_timeout_breaks_barrier_for_all():
+    trigger = ArrayTrigger()
+    trigger.configure(1, 2)
+    ss = time.time()
+    with pytest.raises(RuntimeError, match="Not all cameras"):
+        trigger.wait(1, 0.1)
+    assert time.time() - ss < 1
+    with pytest.raises(RuntimeError, match="aborted"):
+        trigger.wait(1, 0.1)
+
+
+def test_configure_resets_broken_barrier():
+    trigger = ArrayTrigger()
+    trigger.configure(1, 2)
+    trigger.abort()
+    trigger.configure(2, 1)
+    trigger.wait(2, 0.1)
+
+
+def test_wrong_job():
+    trigger = ArrayTrigger()
+    trigger.configure(2, 1)
+    with pytest.raises(RuntimeError, match="job 2"):
+        trigger.wait(1, 0.1)
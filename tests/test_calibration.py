@@ -0,0 +1,77 @@
+from ..calibration import MasterBuilder, Calibrator, CALIBRATION_BIAS, CALIBRATION_DARK, CALIBRATION_FLAT, \
+    COMBINE_MEAN, COMBINE_MEDIAN
+import logging
+import numpy as np
+import pytest
+
+log = logging.getLogger("test_calibration")
+
+SETTINGS = {"camera": "ZWO ASI", "gain": 100, "exposure": 10.0, "bin": 1, "roi": [0, 0, 2, 2], "temperature": -10.0}
+
+
+def frames(*values):
+    return [np.full((2, 2), value, dtype=np.uint16) for value in values]
+
+
+def test_mean_master():
+    builder = MasterBuilder(".", 3, COMBINE_MEAN)
+    for frame in frames(1, 2, 6):
+        builder.add(frame)
+    assert np.all(builder.finish() == 3)
+
+
+def test_median_master_removes_its_stack_file(tmp_path):
+    builder = MasterBuilder(str(tmp_path), 3, COMBINE_MEDIAN)
+    for frame in frames(1, 2, 6):
+        builder.add(frame)
+    with pytest.raises(ValueError):
+        builder.add(frames(1)[0])
+    master = builder.finish()
+    assert master.dtype == np.float32 and np.all(master == 2)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_flat_is_normalized_and_applied_after_bias(tmp_path):
+    calibrator = Calibrator(log, str(tmp_path))
+    calibrator.configure(True, 2.0)
+    calibrator.store(CALIBRATION_BIAS, SETTINGS, np.full((2, 2), 100, dtype=np.float32))
+    calibrator.store(CALIBRATION_FLAT, SETTINGS, np.array([[200, 200], [200, 400]], dtype=np.float32))
+    img = np.array([[150, 150], [150, 400]], dtype=np.uint16)
+    calibrator.apply(img, SETTINGS)
+    assert img.tolist() == [[50, 50], [50, 100]]
+
+
+def test_dark_is_matched_by_temperature_bucket(tmp_path):
+    calibrator = Calibrator(log, str(tmp_path))
+    calibrator.configure(True, 2.0)
+    calibrator.store(CALIBRATION_BIAS, SETTINGS, np.full((2, 2), 100, dtype=np.float32))
+    calibrator.store(CALIBRATION_DARK, SETTINGS, np.full((2, 2), 120, dtype=np.float32))
+    img = frames(1000)[0]
+    calibrator.apply(img, dict(SETTINGS, temperature=-10.6))
+    assert np.all(img == 880)
+    img = frames(1000)[0]
+    calibrator.apply(img, dict(SETTINGS, temperature=-14.0))
+    assert np.all(img == 900)  # no dark for this temperature, bias is used
+
+
+def test_disabled_calibrator_leaves_frame_alone(tmp_path):
+    calibrator = Calibrator(log, str(tmp_path))
+    calibrator.store(CALIBRATION_BIAS, SETTINGS, np.full((2, 2), 100, dtype=np.float32))
+    img = frames(1000)[0]
+    calibrator.apply(img, SETTINGS)
+    assert np.all(img == 1000)
+
+
+def test_masters_are_indexed_on_disk(tmp_path):
+    Calibrator(log, str(tmp_path)).store(CALIBRATION_BIAS, SETTINGS, np.full((2, 2), 100, dtype=np.float32))
+    masters = Calibrator(log, str(tmp_path)).get_stats()["Masters"]
+    assert [(m["kind"], m["temperature"]) for m in masters] == [(CALIBRATION_BIAS, -10.0)]
+
+
+def test_calibrator_is_disabled_by_form_value(tmp_path):
+    calibrator = Calibrator(log, str(tmp_path))
+    calibrator.configure("false", 2.0)
+    calibrator.store(CALIBRATION_BIAS, SETTINGS, np.full((2, 2), 100, dtype=np.float32))
+    img = frames(1000)[0]
+    calibrator.apply(img, SETTINGS)
+    assert np.all(img == 1000)
@@ -0,0 +1,73 @@
+from ..capture_sequence import parse_plan, settings_changes, changes_format, SequenceStep, SequenceProgress, \
+    MAX_SEQUENCE_FRAMES, SEQUENCE_DONE
+import pytest
+
+
+def test_step_defaults():
+    step = SequenceStep(0, {"Duration": "2.5"})
+    assert (step.duration, step.number, step.light, step.path, step.settings) == (2.5, 1, True, None, {})
+
+
+def test_step_light_from_form():
+    assert SequenceStep(0, {"Duration": 1, "Light": "false"}).light is False
+    assert SequenceStep(0, {"Duration": 1, "Light": "True"}).light is True
+
+
+@pytest.mark.parametrize("step", [
+    {"Duration": -1},
+    {"Duration": 1, "Number": 0},
+    {"Duration": 1, "Format": "jpg"},
+    {"Duration": 1, "Path": "/tmp"},
+    {"Duration": 1, "Path": "a/../../b"}
+])
+def test_invalid_step(step):
+    with pytest.raises(ValueError):
+        parse_plan({"Steps": [step]})
+
+
+@pytest.mark.parametrize("params", [{}, {"Steps": []}, {"Steps": {"Duration": 1}}, {"Steps": [1]},
+                                    {"Steps": [{"Number": 2}]},
+                                    {"Steps": [{"Duration": 1, "Number": MAX_SEQUENCE_FRAMES + 1}]}])
+def test_invalid_plan(params):
+    with pytest.raises(ValueError):
+        parse_plan(params)
+
+
+def test_plan_keeps_order_unless_optimized():
+    steps = [{"Duration": 1, "Bin": 2}, {"Duration": 2, "Bin": 1}, {"Duration": 3, "Bin": 2, "Gain": 100},
+             {"Duration": 4, "Bin": 1}, {"Duration": 5}]
+    assert [step.index for step in parse_plan({"Steps": steps})] == [0, 1, 2, 3, 4]
+    # stable grouping by frame format, groups in order of first appearance; gain does not change format:
+    assert [step.index for step in parse_plan({"Steps": steps, "Optimize": True})] == [0, 2, 1, 3, 4]
+
+
+def test_settings_changes_in_dependency_order():
+    step = SequenceStep(0, {"Duration": 1, "Gain": 100, "StartY": 8, "NumX": 640, "Bin": 2, "ReadoutMode": 0})
+    changes = settings_changes({"ReadoutMode": 0, "NumX": 640}, step)
+    assert changes == [("Bin", 2), ("StartY", 8), ("Gain", 100)]
+    assert changes_format(changes)
+
+
+def test_settings_changes_skip_current():
+    step = SequenceStep(0, {"Duration": 1, "Gain": 100, "Bin": 2})
+    assert settings_changes({"Gain": 100, "Bin": 2}, step) == []
+    changes = settings_changes({"Gain": 0, "Bin": 2}, step)
+    assert changes == [("Gain", 100)]
+    assert not changes_format(changes)
+
+
+def test_progress():
+    plan = parse_plan({"Steps": [{"Duration": 0, "Number": 2}, {"Duration": 0, "Number": 1}]})
+    progress = SequenceProgress(plan)
+    progress.step_started(0, 0.0)
+    progress.frame_done(0)
+    state = progress.get()
+    assert (state["Frame"], state["Frames"], state["Step"], state["Steps"]) == (1, 3, 0, 2)
+    assert state["ETA"] >= 0
+    progress.frame_done(0)
+    progress.step_started(1, 0.0)
+    progress.frame_done(1)
+    progress.finish()
+    state = progress.get()
+    assert (state["State"], state["Frame"], state["ETA"]) == (SEQUENCE_DONE, 3, 0.0)
+    assert [stats["Done"] for stats in state["StepStats"]] == [2, 1]
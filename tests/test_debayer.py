@@ -0,0 +1,62 @@
+from ..debayer import debayer, debayered_format, bayer_offsets, MODE_SUPERPIXEL, MODE_BILINEAR, MODE_CHANNEL, \
+    IMG_RGB48
+import zwoasi as asi
+import numpy as np
+import pytest
+
+
+RED, GREEN, BLUE = 1000, 500, 100
+
+# color of each pixel of 2x2 cell, row by row, as sensor patterns are named:
+patterns = {
+    asi.ASI_BAYER_RG: "RGGB",
+    asi.ASI_BAYER_BG: "BGGR",
+    asi.ASI_BAYER_GR: "GRBG",
+    asi.ASI_BAYER_RB: "GBRG"
+}
+
+
+def _mosaic(pattern, width=8, height=6):
+    values = {"R": RED, "G": GREEN, "B": BLUE}
+    cell = np.array([[values[pattern[0]], values[pattern[1]]], [values[pattern[2]], values[pattern[3]]]],
+                    dtype=np.uint16)
+    return np.tile(cell, (height // 2, width // 2))
+
+
+@pytest.mark.parametrize("bayer", patterns.keys())
+def test_offsets_point_to_red(bayer):
+    x, y = bayer_offsets[bayer]
+    assert patterns[bayer][2 * y + x] == "R"
+
+
+@pytest.mark.parametrize("bayer", patterns.keys())
+@pytest.mark.parametrize("mode", [MODE_SUPERPIXEL, MODE_BILINEAR])
+def test_color_modes_give_bgr(bayer, mode):
+    result = debayer(_mosaic(patterns[bayer]), bayer_offsets[bayer], mode)
+    assert result.shape[2] == 3
+    np.testing.assert_array_equal(result[:, :, 0], BLUE)
+    np.testing.assert_array_equal(result[:, :, 1], GREEN)
+    np.testing.assert_array_equal(result[:, :, 2], RED)
+
+
+@pytest.mark.parametrize("bayer", patterns.keys())
+@pytest.mark.parametrize("channel, value", [("r", RED), ("g", GREEN), ("b", BLUE)])
+def test_channel_mode(bayer, channel, value):
+    result = debayer(_mosaic(patterns[bayer]), bayer_offsets[bayer], MODE_CHANNEL, channel)
+    assert result.shape == (3, 4)
+    np.testing.assert_array_equal(result, value)
+
+
+def test_result_matches_debayered_format():
+    mosaic = _mosaic("RGGB", 10, 6)[:5, :9]
+    for mode in [MODE_SUPERPIXEL, MODE_BILINEAR]:
+        width, height, image_type = debayered_format(9, 5, asi.ASI_IMG_RAW16, mode)
+        assert debayer(mosaic, (0, 0), mode).shape == (height, width, 3)
+        assert image_type == IMG_RGB48
+
+
+def test_result_is_written_to_given_buffer():
+    out = bytearray(3 * 4 * 3 * 2)
+    result = debayer(_mosaic("RGGB"), (0, 0), MODE_SUPERPIXEL, out=out)
+    assert np.frombuffer(out, dtype=np.uint16)[2] == RED
+    assert not result.flags.owndata
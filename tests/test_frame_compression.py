@@ -0,0 +1,54 @@
+from ..frame_compression import negotiate_encoding, shuffle_bytes, compress_frame, compressors
+import numpy as np
+import zlib
+import pytest
+
+
+def _unshuffle(data, dtype, shape):
+    itemsize = np.dtype(dtype).itemsize
+    planes = np.frombuffer(data, dtype=np.uint8).reshape((itemsize, -1))
+    return np.ascontiguousarray(planes.T).view(dtype).reshape(shape)
+
+
+@pytest.mark.parametrize("dtype", [np.uint16, np.float32])
+def test_shuffle_round_trip(dtype):
+    img = (np.arange(12 * 8) * 37).astype(dtype).reshape((8, 12))
+    out = bytearray(img.nbytes)
+    assert shuffle_bytes(img, out) == img.dtype.itemsize
+    np.testing.assert_array_equal(_unshuffle(out, dtype, img.shape), img)
+
+
+def test_shuffle_puts_low_bytes_first():
+    img = np.array([[0x0102, 0x0304]], dtype="<u2")
+    out = bytearray(img.nbytes)
+    shuffle_bytes(img, out)
+    assert bytes(out) == b"\x02\x04\x01\x03"
+
+
+def test_shuffle_of_non_contiguous_frame():
+    img = np.arange(16 * 8, dtype=np.uint16).reshape((8, 16))[:, ::2]
+    out = bytearray(img.nbytes)
+    shuffle_bytes(img, out)
+    np.testing.assert_array_equal(_unshuffle(out, np.uint16, img.shape), img)
+
+
+def test_compress_frame_round_trip():
+    img = np.full((64, 64), 1000, dtype=np.uint16)
+    img[::3, ::5] += 7
+    out = bytearray(img.nbytes)
+    length, itemsize = compress_frame(img, "deflate", out)
+    assert itemsize == 2 and length < img.nbytes
+    np.testing.assert_array_equal(_unshuffle(zlib.decompress(bytes(out[:length])), np.uint16, img.shape), img)
+
+
+def test_incompressible_frame_is_not_compressed():
+    img = np.random.default_rng(0).integers(0, 256, size=(32, 32), dtype=np.uint8)
+    assert compress_frame(img, "deflate", bytearray(img.nbytes)) is None
+
+
+def test_negotiate_encoding():
+    assert negotiate_encoding(None) is None
+    assert negotiate_encoding("gzip") is None
+    assert negotiate_encoding("deflate;q=0") is None
+    assert negotiate_encoding("gzip, deflate;q=0.5") == "deflate"
+    assert negotiate_encoding("*") == list(compressors.keys())[0]
@@ -0,0 +1,58 @@
+from ..frame_ring import FrameRing, FrameStream, SlotsBusyError
+import pytest
+
+
+@pytest.fixture
+def ring():
+    ring = FrameRing("test", slots=3)
+    ring.create(16)
+    yield ring
+    ring.close()
+
+
+def test_slots_are_used_in_turn(ring):
+    assert [ring.next_slot() for _ in range(4)] == [0, 1, 2, 0]
+
+
+def test_published_frame_is_read_from_its_slot(ring):
+    slot = ring.next_slot()
+    ring.writable(slot, 4)[:] = b"abcd"
+    first = ring.publish(slot, 2, 2, 0, 4)
+    second = ring.publish(ring.next_slot(), 2, 2, 0, 4)
+    assert bytes(ring.view(first)) == b"abcd"
+    assert second.sequence == first.sequence + 1
+
+
+def test_pinned_slot_is_not_reused(ring):
+    ring.pin(1)
+    assert [ring.next_slot() for _ in range(3)] == [0, 2, 0]
+    ring.unpin(1)
+    assert ring.next_slot() == 1
+
+
+def test_newest_slot_is_not_reused_when_others_are_pinned(ring):
+    ring.pin(1)
+    ring.pin(2)
+    assert ring.next_slot() == 0
+    with pytest.raises(SlotsBusyError):
+        ring.next_slot()
+
+
+def test_next_slot_can_pin(ring):
+    assert ring.next_slot(pin=True) == 0
+    assert [ring.next_slot() for _ in range(3)] == [1, 2, 1]
+
+
+def test_frame_stream_sends_prefix_and_unpins_once(ring):
+    slot = ring.next_slot()
+    ring.writable(slot, 10)[:] = b"0123456789"
+    frame = ring.publish(slot, 10, 1, 0, 10)
+    ring.pin(slot)
+    ring.pin(slot)
+    stream = FrameStream(ring, frame, prefix=b"h", chunk_size=4)
+    assert len(stream) == 11
+    assert list(stream) == [b"h", b"0123", b"4567", b"89"]
+    stream.close()
+    stream.close()
+    # one pin is still held, so the slot is skipped:
+    assert [ring.next_slot() for _ in range(2)] == [1, 2]
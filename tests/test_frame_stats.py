@@ -0,0 +1,41 @@
+from ..frame_stats import saturation_level, compute_frame_stats, rebin_histogram, FrameStatsCache
+import numpy as np
+import pytest
+
+
+def test_saturation_level():
+    assert saturation_level(256, np.uint8) == 255
+    assert saturation_level(65536, np.uint16) == 65535
+    # 12 bit data scaled to 16 bits by SDK:
+    assert saturation_level(4096, np.uint16) == 4095 * 16
+
+
+def test_stats_of_8_bit_frame():
+    img = np.zeros((10, 10), dtype=np.uint8)
+    img[0, :5] = 255
+    img[1:, :] = 10
+    stats = compute_frame_stats(img, 256)
+    assert (stats["Min"], stats["Max"], stats["Median"], stats["Pixels"]) == (0, 255, 10, 100)
+    assert stats["SaturatedFraction"] == 0.05
+    assert stats["Mean"] == pytest.approx((5 * 255 + 90 * 10) / 100)
+    assert len(stats["Histogram"]) == 256 and sum(stats["Histogram"]) == 100
+
+
+def test_histogram_of_16_bit_frame_is_binned():
+    img = np.full((4, 4), 40000, dtype=np.uint16)
+    stats = compute_frame_stats(img, 65536)
+    assert len(stats["Histogram"]) == 4096
+    assert stats["Histogram"][40000 // 16] == 16
+    assert rebin_histogram(stats["Histogram"], 256)[40000 // 256] == 16
+    with pytest.raises(ValueError):
+        rebin_histogram(stats["Histogram"], 100)
+
+
+def test_cache_keeps_newest_entries():
+    cache = FrameStatsCache(entries=2)
+    assert cache.get() is None
+    for sequence in range(1, 4):
+        cache.put(sequence, {"Median": sequence})
+    assert cache.get(1) is None
+    assert cache.get(2)["Median"] == 2
+    assert cache.get()["Sequence"] == 3
@@ -0,0 +1,97 @@
+from .. import frame_writer
+from ..frame_writer import WriterPool, POLICY_BLOCK, POLICY_DROP_OLDEST, POLICY_SPILL
+from threading import Thread, Event
+import logging
+import time
+import pytest
+
+log = logging.getLogger("test_frame_writer")
+
+
+@pytest.fixture
+def written(monkeypatch):
+    """
+    Replaces file writing: frames are recorded once gate is set.
+    """
+    gate = Event()
+    frames = {}
+
+    def save_frame(filename, buffer, *args):
+        gate.wait(5)
+        frames[filename] = bytes(buffer)
+
+    monkeypatch.setattr(frame_writer, "save_frame", save_frame)
+    frames["gate"] = gate
+    return frames
+
+
+def fill_pool(pool):
+    """
+    One frame being written (held by gate) and one waiting in queue - all buffers of pool are taken.
+    """
+    pool.reserve(4)
+    first = pool.acquire_buffer()
+    first[:] = b"aaaa"
+    pool.submit("a", first, 2, 2, 0)
+    while pool.get_stats()["InProgress"] < 1:
+        time.sleep(0.001)
+    second = pool.acquire_buffer()
+    second[:] = b"bbbb"
+    pool.submit("b", second, 2, 2, 0)
+
+
+def test_block_waits_for_free_buffer(written):
+    pool = WriterPool(log, threads=1, depth=1, policy=POLICY_BLOCK)
+    fill_pool(pool)
+    acquired = []
+    waiting = Thread(target=lambda: acquired.append(pool.acquire_buffer()))
+    waiting.start()
+    waiting.join(0.1)
+    assert waiting.is_alive()
+    written["gate"].set()
+    waiting.join(5)
+    pool.flush()
+    assert len(acquired) == 1
+    assert (written["a"], written["b"]) == (b"aaaa", b"bbbb")
+    assert pool.get_stats()["Dropped"] == 0
+
+
+def test_drop_oldest_discards_queued_frame(written):
+    pool = WriterPool(log, threads=1, depth=1, policy=POLICY_DROP_OLDEST)
+    fill_pool(pool)
+    pool.acquire_buffer()
+    written["gate"].set()
+    pool.flush()
+    assert written["a"] == b"aaaa" and "b" not in written
+    assert pool.get_stats()["Dropped"] == 1
+
+
+def test_spill_writes_queued_frame_later(written, tmp_path):
+    pool = WriterPool(log, threads=1, depth=1, policy=POLICY_SPILL, spill_path=str(tmp_path))
+    fill_pool(pool)
+    buffer = pool.acquire_buffer()
+    buffer[:] = b"cccc"  # buffer of spilled frame is reused right away
+    assert len(list(tmp_path.iterdir())) == 1
+    written["gate"].set()
+    pool.flush()
+    assert (written["a"], written["b"]) == (b"aaaa", b"bbbb")
+    assert pool.get_stats()["Spilled"] == 1
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_reserve_returns_write_error_of_previous_frames(monkeypatch):
+    def save_frame(filename, buffer, *args):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(frame_writer, "save_frame", save_frame)
+    pool = WriterPool(log, threads=1, depth=1)
+    pool.reserve(4)
+    pool.submit("a", pool.acquire_buffer(), 2, 2, 0)
+    assert isinstance(pool.reserve(8), OSError)
+    assert pool.reserve(8) is None
+    assert pool.get_stats()["Errors"] == 1
+
+
+def test_configure_rejects_unknown_policy():
+    with pytest.raises(ValueError):
+        WriterPool(log, policy="ignore")
@@ -0,0 +1,51 @@
+from ..hot_pixels import HotPixelMap
+import logging
+import numpy as np
+import pytest
+
+log = logging.getLogger("test_hot_pixels")
+
+
+@pytest.fixture
+def hot_pixels(tmp_path):
+    dark = np.full((20, 20), 100, dtype=np.float32)
+    dark[5, 7] = 1000
+    dark[10, 3] = 0
+    hot_pixels = HotPixelMap(log, str(tmp_path))
+    info = hot_pixels.build(dark, [0, 0, 20, 20], 20)
+    assert (info["Hot"], info["Cold"]) == (1, 1)
+    return hot_pixels
+
+
+def test_indices_follow_frame_format(hot_pixels):
+    assert hot_pixels.indices_for([0, 0], 1, (20, 20)) is None
+    hot_pixels.set_enabled(True)
+    assert hot_pixels.indices_for([0, 0], 1, (20, 20)).tolist() == [5 * 20 + 7, 10 * 20 + 3]
+    # cold pixel is outside of ROI:
+    assert hot_pixels.indices_for([4, 2], 1, (10, 10)).tolist() == [3 * 10 + 3]
+    assert hot_pixels.indices_for([0, 0], 2, (10, 10)).tolist() == [2 * 10 + 3, 5 * 10 + 1]
+
+
+def test_map_is_loaded_from_disk(hot_pixels, tmp_path):
+    assert HotPixelMap(log, str(tmp_path)).get_stats()["Pixels"] == 2
+
+
+def test_pixel_is_replaced_by_median_of_neighbours():
+    img = np.full((5, 5), 10, dtype=np.uint16)
+    img[0, 1] = 12
+    img[2, 2] = 1000
+    img[0, 0] = 0
+    HotPixelMap(log, ".").correct(img, np.array([2 * 5 + 2, 0]))
+    assert (img[2, 2], img[0, 0]) == (10, 10)
+
+
+def test_mosaic_pixel_is_replaced_from_same_color():
+    img = np.tile(np.array([[10, 50], [50, 10]], dtype=np.uint16), (3, 3))
+    img[2, 2] = 1000
+    HotPixelMap(log, ".").correct(img, np.array([2 * 6 + 2]), mosaic=True)
+    assert img[2, 2] == 10
+
+
+def test_enabled_from_form_value(hot_pixels):
+    hot_pixels.set_enabled("false")
+    assert hot_pixels.indices_for([0, 0], 1, (20, 20)) is None
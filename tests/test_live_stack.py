@@ -0,0 +1,72 @@
+from ..live_stack import LiveStack
+import logging
+import numpy as np
+import pytest
+
+log = logging.getLogger("test_live_stack")
+
+
+def render(stack, kind, dtype=np.float32, size=4):
+    return stack.render(kind, dtype, bytearray(size * np.dtype(dtype).itemsize))
+
+
+def test_disabled_stack_ignores_frames():
+    stack = LiveStack(log)
+    stack.add(np.ones((2, 2), dtype=np.uint16))
+    assert stack.get_stats()["Frames"] == 0
+    assert render(stack, "mean") is None
+
+
+def test_mean_sum_and_sigma():
+    stack = LiveStack(log)
+    stack.configure(True, 0, 10)
+    for value in [1, 3]:
+        stack.add(np.full((2, 2), value, dtype=np.uint16))
+    assert np.all(render(stack, "mean") == 2)
+    assert np.all(render(stack, "sum") == 4)
+    assert render(stack, "sigma") == pytest.approx(np.full((2, 2), np.sqrt(2)))
+    with pytest.raises(ValueError):
+        render(stack, "median")
+
+
+def test_8_bit_stack_is_scaled_to_16_bits():
+    stack = LiveStack(log)
+    stack.configure(True, 0, 10)
+    stack.add(np.full((2, 2), 255, dtype=np.uint8))
+    assert np.all(render(stack, "mean", np.uint16) == 65535)
+
+
+def test_outlier_is_rejected_once_there_are_enough_frames():
+    stack = LiveStack(log)
+    stack.configure(True, 2.0, 3)
+    for i in range(10):
+        stack.add(np.full((2, 2), 10 + 2 * (i % 2), dtype=np.uint16))
+    outlier = np.full((2, 2), 11, dtype=np.uint16)
+    outlier[0, 0] = 100
+    stack.add(outlier)
+    mean = render(stack, "mean")
+    assert mean[0, 0] == pytest.approx(11)
+    assert stack.get_stats()["RejectedFraction"] > 0
+
+
+def test_stack_restarts_when_format_changes():
+    stack = LiveStack(log)
+    stack.configure(True, 0, 10)
+    stack.add(np.ones((2, 2), dtype=np.uint16))
+    stack.add(np.ones((3, 3), dtype=np.uint16))
+    stats = stack.get_stats()
+    assert (stats["Frames"], stats["Shape"]) == (1, [3, 3])
+
+
+def test_configure_validates_values():
+    with pytest.raises(ValueError):
+        LiveStack(log).configure(True, -1, 10)
+    with pytest.raises(ValueError):
+        LiveStack(log).configure(True, 3, 1)
+
+
+def test_stack_is_disabled_by_form_value():
+    stack = LiveStack(log)
+    stack.configure("false", 3, 10)
+    stack.add(np.ones((2, 2), dtype=np.uint16))
+    assert stack.get_stats()["Frames"] == 0
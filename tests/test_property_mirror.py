@@ -0,0 +1,67 @@
+from ..property_mirror import PropertyMirror
+from threading import Thread, Event
+import time
+import pytest
+
+
+def test_publish_and_read():
+    mirror = PropertyMirror()
+    assert mirror.read() == {}
+    mirror.publish({"gain": 100, "temperature": -10.5}, timestamp=5.0)
+    assert mirror.read() == {"gain": {"Value": 100, "Time": 5.0}, "temperature": {"Value": -10.5, "Time": 5.0}}
+
+
+def test_older_value_does_not_replace_newer():
+    mirror = PropertyMirror()
+    mirror.publish({"gain": 200}, timestamp=10.0)
+    mirror.publish({"gain": 100, "offset": 5}, timestamp=9.0)
+    assert mirror.read() == {"gain": {"Value": 200, "Time": 10.0}, "offset": {"Value": 5, "Time": 9.0}}
+
+
+def test_read_fails_while_write_is_in_progress():
+    mirror = PropertyMirror()
+    mirror.publish({"gain": 100})
+    mirror._sequence.value += 1  # as if writer was in the middle of publishing
+    assert mirror.read() is None
+    assert mirror.get("gain") == (False, None)
+
+
+def test_get_checks_age():
+    mirror = PropertyMirror()
+    now = time.time()
+    mirror.publish({"gain": 100, "offset": 5}, timestamp=now)
+    mirror.publish({"offset": 5}, timestamp=now - 10)
+    assert mirror.get("gain") == (True, 100)
+    assert mirror.get("gain", not_before=now + 1) == (False, None)
+    assert mirror.get("offset", max_age_s=0.5) == (True, 5)
+    assert mirror.get("missing") == (False, None)
+    mirror.publish({"old": 1}, timestamp=now - 10)
+    assert mirror.get("old", max_age_s=1.0) == (False, None)
+
+
+def test_snapshot_too_large():
+    mirror = PropertyMirror(size=32)
+    with pytest.raises(ValueError):
+        mirror.publish({"name": "x" * 64})
+
+
+def test_reader_sees_only_whole_snapshots():
+    mirror = PropertyMirror()
+    stop = Event()
+
+    def write():
+        i = 0
+        while not stop.is_set():
+            i += 1
+            mirror.publish({"a": i, "b": i, "c": "x" * (i % 100)})
+
+    writer = Thread(target=write)
+    writer.start()
+    try:
+        for _ in range(2000):
+            snapshot = mirror.read()
+            if snapshot:
+                assert snapshot["a"]["Value"] == snapshot["b"]["Value"]
+    finally:
+        stop.set()
+        writer.join()
@@ -0,0 +1,100 @@
+from ..raw_writers import write_tiff, write_fits, write_npy, FITS_BLOCK, FITS_CARD, NPY_ALIGNMENT
+from PIL import Image
+import zwoasi as asi
+import numpy as np
+import struct
+
+
+WIDTH, HEIGHT = 6, 4
+
+
+def _mono16():
+    return np.arange(WIDTH * HEIGHT, dtype=np.uint16).reshape((HEIGHT, WIDTH)) * 1000
+
+
+def _bgr24():
+    return np.arange(WIDTH * HEIGHT * 3, dtype=np.uint8).reshape((HEIGHT, WIDTH, 3))
+
+
+def _fits_cards(data):
+    end = data.index(b"END" + b" " * (FITS_CARD - 3))
+    header = data[:end].decode("ascii")
+    cards = {}
+    for i in range(0, len(header), FITS_CARD):
+        key, _, value = header[i:i + FITS_CARD].partition("=")
+        cards[key.strip()] = value.split(" / ")[0].strip()
+    return cards, (end // FITS_BLOCK + 1) * FITS_BLOCK
+
+
+def test_npy_mono16(tmp_path):
+    img = _mono16()
+    write_npy(tmp_path / "f.npy", bytearray(img.tobytes()), WIDTH, HEIGHT, asi.ASI_IMG_RAW16)
+    data = (tmp_path / "f.npy").read_bytes()
+    assert (data.index(b"\n") + 1) % NPY_ALIGNMENT == 0
+    np.testing.assert_array_equal(np.load(tmp_path / "f.npy"), img)
+
+
+def test_npy_color_is_rgb(tmp_path):
+    img = _bgr24()
+    write_npy(tmp_path / "f.npy", bytearray(img.tobytes()), WIDTH, HEIGHT, asi.ASI_IMG_RGB24)
+    np.testing.assert_array_equal(np.load(tmp_path / "f.npy"), img[:, :, ::-1])
+
+
+def test_tiff_mono16(tmp_path):
+    img = _mono16()
+    write_tiff(tmp_path / "f.tif", bytearray(img.tobytes()), WIDTH, HEIGHT, asi.ASI_IMG_RAW16)
+    with Image.open(tmp_path / "f.tif") as tiff:
+        assert tiff.size == (WIDTH, HEIGHT)
+        np.testing.assert_array_equal(np.array(tiff).astype(np.uint16), img)
+
+
+def test_tiff_color_is_rgb(tmp_path):
+    img = _bgr24()
+    write_tiff(tmp_path / "f.tif", bytearray(img.tobytes()), WIDTH, HEIGHT, asi.ASI_IMG_RGB24)
+    with Image.open(tmp_path / "f.tif") as tiff:
+        assert tiff.mode == "RGB"
+        np.testing.assert_array_equal(np.array(tiff), img[:, :, ::-1])
+
+
+def test_tiff_data_offset_is_even(tmp_path):
+    write_tiff(tmp_path / "f.tif", bytearray(_bgr24().tobytes()), WIDTH, HEIGHT, asi.ASI_IMG_RGB24)
+    data = (tmp_path / "f.tif").read_bytes()
+    ifd_offset = struct.unpack_from("<I", data, 4)[0]
+    entries = struct.unpack_from("<H", data, ifd_offset)[0]
+    tags = {}
+    for i in range(entries):
+        tag, _, _, value = struct.unpack_from("<HHII", data, ifd_offset + 2 + 12 * i)
+        tags[tag] = value
+    assert tags[273] % 2 == 0
+    assert tags[279] == WIDTH * HEIGHT * 3
+    assert len(data) == tags[273] + tags[279]
+
+
+def test_fits_mono16_header_and_data(tmp_path):
+    img = _mono16()
+    header = {"exposure": 2.5, "gain": 100, "bin": 1, "camera": "ZWO ASI1600MM Pro", "timestamp": "2024-01-01T00:00:00"}
+    write_fits(tmp_path / "f.fits", bytearray(img.tobytes()), WIDTH, HEIGHT, asi.ASI_IMG_RAW16, header)
+    data = (tmp_path / "f.fits").read_bytes()
+    assert len(data) % FITS_BLOCK == 0
+    cards, data_start = _fits_cards(data)
+    assert cards["SIMPLE"] == "T"
+    assert cards["BITPIX"] == "16"
+    assert (cards["NAXIS"], cards["NAXIS1"], cards["NAXIS2"]) == ("2", str(WIDTH), str(HEIGHT))
+    assert (cards["BZERO"], cards["BSCALE"]) == ("32768", "1")
+    assert cards["EXPTIME"] == "2.5"
+    assert cards["INSTRUME"] == "'ZWO ASI1600MM Pro'"
+    assert "CCD-TEMP" not in cards
+    stored = np.frombuffer(data, dtype=">i2", count=WIDTH * HEIGHT, offset=data_start).reshape((HEIGHT, WIDTH))
+    np.testing.assert_array_equal(stored.astype(np.int32) + 32768, img)
+
+
+def test_fits_color_is_planar_rgb(tmp_path):
+    img = _bgr24()
+    write_fits(tmp_path / "f.fits", bytearray(img.tobytes()), WIDTH, HEIGHT, asi.ASI_IMG_RGB24)
+    data = (tmp_path / "f.fits").read_bytes()
+    cards, data_start = _fits_cards(data)
+    assert (cards["BITPIX"], cards["NAXIS"], cards["NAXIS3"]) == ("8", "3", "3")
+    assert "BZERO" not in cards
+    planes = np.frombuffer(data, dtype=np.uint8, count=img.size, offset=data_start).reshape((3, HEIGHT, WIDTH))
+    for plane, channel in zip(planes, [2, 1, 0]):
+        np.testing.assert_array_equal(plane, img[:, :, channel])
@@ -0,0 +1,36 @@
+from ..request_routing import PendingRequest
+from threading import Thread
+
+
+def test_results_are_read_in_order_whichever_side_comes_first():
+    request = PendingRequest(1)
+    request.deliver_result(1)
+    first = request.result_future()
+    second = request.result_future()
+    request.deliver_result(2)
+    assert (first.result(0), second.result(0)) == (1, 2)
+
+
+def test_poll():
+    request = PendingRequest(1)
+    assert request.poll_result() is None
+    request.deliver_result("a")
+    request.deliver_result("b")
+    assert request.poll_result() == "a"
+    assert request.next_result(0) == "b"
+    assert request.poll_result() is None
+
+
+def test_results_and_frames_are_separate():
+    request = PendingRequest(1)
+    request.deliver_frame("frame")
+    assert request.poll_result() is None
+    assert request.next_frame(0) == "frame"
+
+
+def test_concurrent_writer():
+    request = PendingRequest(1)
+    writer = Thread(target=lambda: [request.deliver_result(i) for i in range(1000)])
+    writer.start()
+    assert [request.next_result(5) for _ in range(1000)] == list(range(1000))
+    writer.join()
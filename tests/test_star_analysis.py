@@ -0,0 +1,57 @@
+from ..star_analysis import detect_stars, StarAnalyzer, GAUSSIAN_FWHM_TO_SIGMA
+import logging
+import numpy as np
+import pytest
+
+
+SIGMA = 1.5
+STARS = [(30.3, 25.6, 4000), (90.0, 60.5, 2000), (50.7, 80.2, 1000)]
+
+
+def _sky(width=128, height=112, background=500, noise=10):
+    img = np.random.default_rng(1).normal(background, noise, size=(height, width))
+    y, x = np.mgrid[0:height, 0:width]
+    for cx, cy, peak in STARS:
+        img += peak * np.exp(-((x - cx) ** 2 + (y - cy) ** 2) / (2 * SIGMA ** 2))
+    return np.clip(np.rint(img), 0, 65535).astype(np.uint16)
+
+
+def test_detects_and_measures_stars():
+    record = detect_stars(_sky())
+    assert record["StarCount"] == len(STARS)
+    assert record["Background"] == pytest.approx(500, abs=3)
+    assert record["FWHM"] == pytest.approx(SIGMA * GAUSSIAN_FWHM_TO_SIGMA, rel=0.15)
+    brightest = record["Stars"][0]
+    assert (brightest["X"], brightest["Y"]) == (pytest.approx(30.3, abs=0.1), pytest.approx(25.6, abs=0.1))
+    assert [star["Flux"] for star in record["Stars"]] == sorted([star["Flux"] for star in record["Stars"]],
+                                                                 reverse=True)
+
+
+def test_empty_sky():
+    record = detect_stars(np.full((64, 64), 500, dtype=np.uint16))
+    assert (record["StarCount"], record["HFR"], record["FWHM"], record["Stars"]) == (0, None, None, [])
+
+
+def test_stars_at_edge_are_not_measured():
+    img = _sky()
+    record = detect_stars(img[:, 25:])
+    assert record["StarCount"] == len(STARS) - 1
+
+
+def test_analyzer_measures_frames_while_enabled():
+    analyzer = StarAnalyzer(logging.getLogger("test"))
+    analyzer.process(1, _sky())
+    assert analyzer.get_metrics(1) is None
+    analyzer.configure(True, 1, 5)
+    analyzer.process(2, _sky())
+    assert analyzer.get_metrics(2)["StarCount"] == len(STARS)
+
+
+def test_analyzer_is_disabled_by_form_value():
+    analyzer = StarAnalyzer(logging.getLogger("test"))
+    analyzer.configure("false", 1, 5)
+    analyzer.process(1, _sky())
+    assert analyzer.get_metrics(1) is None
+    analyzer.configure("true", 1, 5)
+    analyzer.process(2, _sky())
+    assert analyzer.get_metrics(2)["StarCount"] == len(STARS)
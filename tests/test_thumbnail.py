@@ -0,0 +1,31 @@
+from ..thumbnail import make_thumbnail, ThumbnailCache
+from io import BytesIO
+from PIL import Image
+import numpy as np
+
+
+def test_thumbnail_fits_in_size():
+    img = np.arange(100 * 60, dtype=np.uint16).reshape(60, 100)
+    thumbnail = Image.open(BytesIO(make_thumbnail(img, 50, "jpeg", "mtf")))
+    assert (thumbnail.format, thumbnail.size) == ("JPEG", (50, 30))
+
+
+def test_color_thumbnail_is_converted_from_bgr():
+    img = np.zeros((8, 8, 3), dtype=np.uint8)
+    img[:, :, 0] = np.arange(64).reshape(8, 8) * 4  # blue
+    thumbnail = Image.open(BytesIO(make_thumbnail(img, 8, "png", "percentile")))
+    assert (thumbnail.format, thumbnail.mode, thumbnail.size) == ("PNG", "RGB", (8, 8))
+    rgb = np.asarray(thumbnail)
+    assert rgb[:, :, 0].min() == rgb[:, :, 0].max()
+    assert rgb[:, :, 2].min() < rgb[:, :, 2].max()
+
+
+def test_cache_evicts_least_recently_used():
+    cache = ThumbnailCache(entries=2)
+    cache.put((1, "jpeg"), b"1")
+    cache.put((2, "jpeg"), b"2")
+    assert cache.get((1, "jpeg")) == b"1"
+    cache.put((3, "jpeg"), b"3")
+    assert cache.get((2, "jpeg")) is None
+    assert cache.get((1, "jpeg")) == b"1"
+    assert cache.get_stats() == {"Entries": 2, "Hits": 2, "Misses": 1}
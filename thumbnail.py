@@ -0,0 +1,73 @@
+from .frame_ops import bin_reduce, frame_histogram, stretch_lut
+from collections import OrderedDict
+from threading import Lock
+from io import BytesIO
+from PIL import Image
+import numpy as np
+
+
+DEFAULT_THUMBNAIL_SIZE = 512
+DEFAULT_THUMBNAIL_FORMAT = "jpeg"
+DEFAULT_THUMBNAIL_STRETCH = "mtf"
+DEFAULT_CACHE_ENTRIES = 16
+JPEG_QUALITY = 85
+
+# format name: (PIL format, content type)
+thumbnail_formats = {
+    "jpeg": ("JPEG", "image/jpeg"),
+    "png": ("PNG", "image/png")
+}
+
+
+def make_thumbnail(img, size, file_format, stretch):
+    """
+    Downscales frame so that its longer side fits in size, stretches it for display and encodes.
+    Binning comes first, so histogram and lookup work on the small image only.
+    :return: encoded image bytes
+    """
+    factor = -(-max(img.shape[:2]) // size)
+    if factor > 1:
+        img = bin_reduce(img, factor, "mean")
+    lut = stretch_lut(frame_histogram(img), stretch)
+    display = lut[img]
+    if display.ndim == 3:
+        display = display[:, :, ::-1]  # camera delivers BGR
+    pil_format, _ = thumbnail_formats[file_format]
+    options = {"quality": JPEG_QUALITY} if pil_format == "JPEG" else {}
+    output = BytesIO()
+    Image.fromarray(np.ascontiguousarray(display)).save(output, format=pil_format, **options)
+    return output.getvalue()
+
+
+class ThumbnailCache:
+    """
+    Encoded thumbnails of recent frames, keyed by frame sequence number and rendering parameters,
+    so many viewers polling the same frame cost only one encode.
+    """
+    def __init__(self, entries=DEFAULT_CACHE_ENTRIES):
+        self._entries = entries
+        self._cache = OrderedDict()
+        self._lock = Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key):
+        with self._lock:
+            data = self._cache.get(key)
+            if data is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+            self._cache.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        with self._lock:
+            self._cache[key] = data
+            self._cache.move_to_end(key)
+            while len(self._cache) > self._entries:
+                self._cache.popitem(last=False)
+
+    def get_stats(self):
+        with self._lock:
+            return {"Entries": len(self._cache), "Hits": self._hits, "Misses": self._misses}
@@ -17,3 +17,11 @@ def add_timestamp_after(req: falcon.Request, response: falcon.Response, resource
     e = datetime.now().strftime(default_format)
     response.append_header("timestamps", json.dumps({"before": b, "after": e}))
     pass
+
+
+async def add_timestamp_before_async(req, response, resource, params):
+    add_timestamp_before(req, response, resource, params)
+
+
+async def add_timestamp_after_async(req, response, resource):
+    add_timestamp_after(req, response, resource)
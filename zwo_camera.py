@@ -3,8 +3,15 @@ import zwoasi as asi
 import numpy as np
 import base64
 import os
-from PIL import Image
+import ctypes
+import time
+from threading import Lock
+from datetime import datetime, timezone
 from .app_utils import add_log
+from .frame_writer import save_frame
+from .debayer import IMG_RGB48, MODE_CHANNEL, bayer_offsets
+from .exposure_timing import ExposureTimingModel, FINAL_POLL_S
+from .camera_events import EVENT_EXPOSURE_STARTED, EVENT_IMAGE_READY, EVENT_EXPOSURE_FAILED
 
 
 if os.name == "nt": 
@@ -34,6 +41,31 @@ image_types_by_name = {
 
 image_types_by_value = {v: k for k, v in image_types_by_name.items()}
 
+bytes_per_pixel = {
+    asi.ASI_IMG_RAW8: 1,
+    asi.ASI_IMG_Y8: 1,
+    asi.ASI_IMG_RAW16: 2,
+    asi.ASI_IMG_RGB24: 3,
+    IMG_RGB48: 6
+}
+
+
+def frame_as_array(buffer, width, height, image_type):
+    shape = [height, width]
+    if image_type == asi.ASI_IMG_RAW8 or image_type == asi.ASI_IMG_Y8:
+        img = np.frombuffer(buffer, dtype=np.uint8, count=width*height)
+    elif image_type == asi.ASI_IMG_RAW16:
+        img = np.frombuffer(buffer, dtype=np.uint16, count=width*height)
+    elif image_type == asi.ASI_IMG_RGB24:
+        img = np.frombuffer(buffer, dtype=np.uint8, count=width*height*3)
+        shape.append(3)
+    elif image_type == IMG_RGB48:
+        img = np.frombuffer(buffer, dtype=np.uint16, count=width*height*3)
+        shape.append(3)
+    else:
+        raise ValueError('Unsupported image type')
+    return img.reshape(shape)
+
 
 logs = {}
 
@@ -51,17 +83,69 @@ class ZwoCamera(AscomCamera):
         self._camera.set_control_value(asi.ASI_BANDWIDTHOVERLOAD, 40)
         self._camera.set_control_value(asi.ASI_GAIN, 17)
         self._camera.set_control_value(asi.ASI_EXPOSURE, 1 * ONE_SECOND_IN_MICROSECONDS)
-        supported = self._camera.get_camera_property()['SupportedVideoFormat']
-        self._camera.set_image_type(supported[0])
+        self._property = None
+        self._controls = None
+        self._readout_types = None
+        self._debayer_mode = None
+        self._snapshot_capabilities()
+        self._camera.set_image_type(self._property['SupportedVideoFormat'][0])
         self._connected = True
         self._new_filename = None
         self._last_duration = 1
+        self._exposure_start = 0
+        self._exposure_number = 0
+        self._reported_exposure = 0
+        self._readout_exposure = 0
+        # exposure is watched on its own thread while it may be read out on another one:
+        self._exposure_lock = Lock()
+        self._timing = ExposureTimingModel()
+        self._event_listener = None
         self._log.info(f"ROI FORMAT = {self._camera.get_roi_format()}")
 
         self._buffer = None
         self._buffer_size = 0
+        self._roi_format = None
         self._reserve_buffer()
 
+    def _snapshot_capabilities(self):
+        """
+        Camera property and control ranges do not change while camera is connected, so they are read once
+        here (on connect) and getters only look them up.
+        """
+        self._property = self._camera.get_camera_property()
+        self._controls = self._camera.get_controls()
+        self._readout_types = sorted(self._property['SupportedVideoFormat'])
+
+    def set_event_listener(self, listener):
+        """
+        :param listener: called with event kind and dict of its data: exposure_started, image_ready, exposure_failed
+        """
+        self._event_listener = listener
+
+    def _emit(self, kind, data):
+        if self._event_listener is not None:
+            self._event_listener(kind, data)
+
+    def _report_ready(self, number, overhead=None):
+        with self._exposure_lock:
+            if number == self._reported_exposure:
+                return
+            self._reported_exposure = number
+        self._emit(EVENT_IMAGE_READY, {"Exposure": number, "Overhead": overhead})
+
+    def _begin_readout(self):
+        """
+        SDK status goes back to idle when frame is downloaded, so readout is noted before it starts - exposure
+        watched on another thread must not be taken for failed then.
+        :return: number of exposure being read out
+        """
+        with self._exposure_lock:
+            self._readout_exposure = self._exposure_number
+            return self._readout_exposure
+
+    def get_exposure_timing(self):
+        return self._timing.get_stats()
+
     def set_exposure(self, duration_s):
         duration_s = float(duration_s)
         self._camera.set_control_value(asi.ASI_EXPOSURE, int(duration_s * ONE_SECOND_IN_MICROSECONDS))
@@ -77,11 +161,8 @@ class ZwoCamera(AscomCamera):
 
     def _reserve_buffer(self):
         whbi = self._camera.get_roi_format()
-        sz = whbi[0] * whbi[1]
-        if whbi[3] == asi.ASI_IMG_RGB24:
-            sz *= 3
-        elif whbi[3] == asi.ASI_IMG_RAW16:
-            sz *= 2
+        self._roi_format = whbi
+        sz = whbi[0] * whbi[1] * bytes_per_pixel[whbi[3]]
         self._log.info(f"Reserving buffer of size {whbi[0]}x{whbi[1]}={sz}")
 
         if self._buffer is None:
@@ -98,34 +179,131 @@ class ZwoCamera(AscomCamera):
         return self._buffer, self._buffer_size
 
     def _store_imagebytes(self):
+        number = self._begin_readout()
         self._camera.get_data_after_exposure(self._buffer)
+        self._report_ready(number)
 
     def get_imagebytes(self):
         self._store_imagebytes()
         return self._get_buffer()
 
+    def get_frame_format(self):
+        """
+        :return: [width, height, bins, image_type] of frame that will be read out, as of last ROI change
+        """
+        return self._roi_format
+
+    def get_frame_size(self):
+        return self._buffer_size
+
+    def get_max_frame_size(self):
+        camera_info = self._property
+        formats = list(camera_info['SupportedVideoFormat'])
+        if camera_info["IsColorCam"] and asi.ASI_IMG_RAW16 in formats:
+            formats.append(IMG_RGB48)  # frame may be debayered in its slot
+        max_bpp = max(bytes_per_pixel[s] for s in formats)
+        return camera_info["MaxWidth"] * camera_info["MaxHeight"] * max_bpp
+
+    def get_max_converted_size(self, dtype):
+        """
+        :return: size of largest raw frame converted to given dtype, e.g. float32 live stack image
+        """
+        camera_info = self._property
+        channels = 3 if asi.ASI_IMG_RGB24 in camera_info['SupportedVideoFormat'] else 1
+        return camera_info["MaxWidth"] * camera_info["MaxHeight"] * channels * np.dtype(dtype).itemsize
+
+    def get_bayer_offsets(self):
+        """
+        :return: (x, y) Bayer offsets if frames are raw color mosaics, None otherwise
+        """
+        camera_info = self._property
+        if not camera_info["IsColorCam"] or self._roi_format[3] not in [asi.ASI_IMG_RAW8, asi.ASI_IMG_RAW16]:
+            return None
+        return bayer_offsets[camera_info["BayerPattern"]]
+
+    def set_debayer_mode(self, mode):
+        """
+        Remembers how server debayers frames of latest capture (None if they are stored raw), see get_sensortype.
+        """
+        self._debayer_mode = mode
+
+    def get_header_fields(self):
+        """
+        Fields of frame header which take SDK calls - read once per capture (or step), not between readout
+        and next exposure.
+        """
+        return {
+            "gain": self.get_gain(),
+            "temperature": self.get_ccdtemperature(),
+            "camera": self.get_name()
+        }
+
+    def get_frame_header(self, fields=None):
+        """
+        Metadata of last exposure, as stored in headers of saved files.
+        :param fields: result of get_header_fields(), they are read now if not given
+        """
+        start_utc = datetime.fromtimestamp(self._exposure_start, tz=timezone.utc).replace(tzinfo=None)
+        header = dict(fields if fields is not None else self.get_header_fields())
+        header.update({
+            "exposure": self._last_duration,
+            "timestamp": start_utc.isoformat(timespec="milliseconds"),
+            "bin": self._roi_format[2]
+        })
+        return header
+
+    def get_calibration_settings(self):
+        """
+        Settings which calibration masters are indexed by.
+        """
+        sx, sy, w, h = self._camera.get_roi()
+        return {
+            "camera": self.get_name(),
+            "gain": self.get_gain(),
+            "exposure": self._last_duration,
+            "bin": self._roi_format[2],
+            "roi": [sx, sy, w, h],
+            "temperature": self.get_ccdtemperature()
+        }
+
+    def read_into(self, buffer):
+        """
+        Downloads exposed frame straight into given writable buffer (e.g. shared memory slot),
+        omitting zwoasi which accepts only bytearrays.
+        """
+        sz = self._buffer_size
+        number = self._begin_readout()
+        cbuf = (ctypes.c_char * sz).from_buffer(buffer)
+        r = asi.zwolib.ASIGetDataAfterExp(self._camera.id, cbuf, sz)
+        del cbuf
+        if r:
+            raise asi.zwo_errors[r]
+        self._report_ready(number)
+        return sz
+
+    def start_video(self, duration_s):
+        self.set_exposure(duration_s)
+        self._camera.start_video_capture()
+
+    def stop_video(self):
+        self._camera.stop_video_capture()
+
+    def read_video_frame_into(self, buffer, timeout_ms):
+        sz = self._buffer_size
+        cbuf = (ctypes.c_char * sz).from_buffer(buffer)
+        r = asi.zwolib.ASIGetVideoData(self._camera.id, cbuf, sz, int(timeout_ms))
+        del cbuf
+        if r:
+            raise asi.zwo_errors[r]
+        return sz
+
+    def get_dropped_frames(self):
+        return self._camera.get_dropped_frames()
+
     def save_image_to_file(self, filename):
         self._store_imagebytes()
-        whbi = self._camera.get_roi_format()
-        shape = [whbi[1], whbi[0]]
-        if whbi[3] == asi.ASI_IMG_RAW8 or whbi[3] == asi.ASI_IMG_Y8:
-            img = np.frombuffer(self._buffer, dtype=np.uint8)
-        elif whbi[3] == asi.ASI_IMG_RAW16:
-            img = np.frombuffer(self._buffer, dtype=np.uint16)
-        elif whbi[3] == asi.ASI_IMG_RGB24:
-            img = np.frombuffer(self._buffer, dtype=np.uint8)
-            shape.append(3)
-        else:
-            raise ValueError('Unsupported image type')
-        img = img.reshape(shape)
-
-        mode = None
-        if len(img.shape) == 3:
-            img = img[:, :, ::-1]  # Convert BGR to RGB
-        if whbi[3] == asi.ASI_IMG_RAW16:
-            mode = 'I;16'
-        image = Image.fromarray(img, mode=mode)
-        image.save(filename)
+        whbi = self._roi_format
+        save_frame(filename, self._buffer, whbi[0], whbi[1], whbi[3])
         self._log.debug('wrote %s', filename)
 
     def save_to_file_and_get_imagebytes(self, filename):
@@ -149,10 +327,10 @@ class ZwoCamera(AscomCamera):
         return rank, whbi[0], whbi[1], dim3
 
     def get_property(self):
-        return self._camera.get_camera_property()
+        return self._property
 
     def get_controls(self):
-        return self._camera.get_controls()
+        return self._controls
 
     @staticmethod
     def get_cameras_list():
@@ -177,17 +355,19 @@ class ZwoCamera(AscomCamera):
         value = bool(value)
         if self._connected and not value:
             del self._camera
+            self._property = self._controls = self._readout_types = None
             self._connected = False
         elif not self._connected and value:
             self._camera = asi.Camera(self._index)
+            self._snapshot_capabilities()
             self._connected = True
 
     def get_name(self):
-        return self._camera.get_camera_property()["Name"]
+        return self._property["Name"]
 
     def get_description(self):
-        if "Description" in self._camera.get_camera_property():
-            return self._camera.get_camera_property()["Description"]
+        if "Description" in self._property:
+            return self._property["Description"]
         return "<no description available>"
 
     def get_driverinfo(self):
@@ -208,22 +388,22 @@ class ZwoCamera(AscomCamera):
         return False  # TODO as for now
 
     def get_canfastreadout(self):
-        return "HighSpeedMode" in self._camera.get_controls()
+        return "HighSpeedMode" in self._controls
 
     def get_sensorname(self):
-        return self._camera.get_camera_property()["Name"]
+        return self._property["Name"]
 
     def get_pixelsizex(self):
-        return self._camera.get_camera_property()["PixelSize"]
+        return self._property["PixelSize"]
 
     def get_pixelsizey(self):
-        return self._camera.get_camera_property()["PixelSize"]
+        return self._property["PixelSize"]
 
     def get_cameraxsize(self):
-        return self._camera.get_camera_property()["MaxWidth"]
+        return self._property["MaxWidth"]
 
     def get_cameraysize(self):
-        return self._camera.get_camera_property()["MaxHeight"]
+        return self._property["MaxHeight"]
 
     def get_canasymmetricbin(self):
         return False
@@ -242,10 +422,10 @@ class ZwoCamera(AscomCamera):
         self._camera.set_control_value(asi.ASI_GAIN, value)
 
     def get_bayeroffsetx(self):
-        return 0  # TODO!
+        return bayer_offsets[self._property["BayerPattern"]][0]
 
     def get_bayeroffsety(self):
-        return 0  # TODO!
+        return bayer_offsets[self._property["BayerPattern"]][1]
 
     def get_camerastate(self):
         exp_status = self._camera.get_exposure_status()
@@ -278,7 +458,7 @@ class ZwoCamera(AscomCamera):
         return False
 
     def get_cansetccdtemperature(self):
-        return self._camera.get_camera_property()["IsCoolerCam"]
+        return self._property["IsCoolerCam"]
 
     def get_canstopexposure(self):
         return False  # TODO! Maybe it can be done
@@ -293,16 +473,16 @@ class ZwoCamera(AscomCamera):
         pass  # TODO!
 
     def get_exposuremax(self):
-        return self._camera.get_controls()["Exposure"]["MaxValue"] / ONE_SECOND_IN_MICROSECONDS
+        return self._controls["Exposure"]["MaxValue"] / ONE_SECOND_IN_MICROSECONDS
 
     def get_exposuremin(self):
-        return self._camera.get_controls()["Exposure"]["MinValue"] / ONE_SECOND_IN_MICROSECONDS
+        return self._controls["Exposure"]["MinValue"] / ONE_SECOND_IN_MICROSECONDS
 
     def get_exposureresolution(self):
         return 1.0 / ONE_SECOND_IN_MICROSECONDS
 
     def get_fastreadout(self):
-        return self._camera.get_controls().get("HighSpeedMode", 0)
+        return self._controls.get("HighSpeedMode", 0)
 
     def get_fullwellcapacity(self):
         pass  # TODO!
@@ -311,10 +491,10 @@ class ZwoCamera(AscomCamera):
         return self._camera.get_control_value(asi.ASI_GAIN)[0]
 
     def get_gainmax(self):
-        return self._camera.get_controls()["Gain"]["MaxValue"]
+        return self._controls["Gain"]["MaxValue"]
 
     def get_gainmin(self):
-        return self._camera.get_controls()["Gain"]["MinValue"]
+        return self._controls["Gain"]["MinValue"]
 
     def get_gains(self):
         pass  # TODO!
@@ -327,7 +507,9 @@ class ZwoCamera(AscomCamera):
 
     def get_imagearray(self):
         filename = self._new_filename  # TODO this can be somehow customized
+        number = self._begin_readout()
         data = self._camera.get_data_after_exposure(None)
+        self._report_ready(number)
 
         whbi = self._camera.get_roi_format()
 
@@ -356,15 +538,18 @@ class ZwoCamera(AscomCamera):
         return img, filename
 
     def get_imagearraybase64(self):
-        img = self.get_imagearray()
-        base64_bytes = base64.b64encode(img)
+        img, _ = self.get_imagearray()
+        base64_bytes = base64.b64encode(np.ascontiguousarray(img).tobytes())
         return base64_bytes.decode('ascii')
 
     def get_imagearrayvariant(self):
         pass  # TODO!
 
     def get_imageready(self):
-        return self._camera.get_exposure_status() == 2
+        ready = self._camera.get_exposure_status() == 2
+        if ready:
+            self._report_ready(self._exposure_number)
+        return ready
 
     def get_ispulseguiding(self):
         pass  # TODO!
@@ -376,13 +561,13 @@ class ZwoCamera(AscomCamera):
         pass  # TODO!
 
     def get_maxadu(self):
-        return 2**(self._camera.get_camera_property()["BitDepth"])
+        return 2**(self._property["BitDepth"])
 
     def get_maxbinx(self):
-        return max(self._camera.get_camera_property()["SupportedBins"])
+        return max(self._property["SupportedBins"])
 
     def get_maxbiny(self):
-        return max(self._camera.get_camera_property()["SupportedBins"])
+        return max(self._property["SupportedBins"])
 
     def get_numx(self):
         return self._camera.get_roi_format()[0]
@@ -406,23 +591,23 @@ class ZwoCamera(AscomCamera):
         pass  # TODO!
 
     def get_readoutmode(self):
-        camera_info = self._camera.get_camera_property()
-        supported = camera_info['SupportedVideoFormat']
-        sorted_supported = [s for s in sorted(supported)]
-        mode = self._camera.get_image_type()
-        return sorted_supported.index(mode)
+        return self._readout_types.index(self._roi_format[3])
 
     def get_readoutmodes(self):
-        camera_info = self._camera.get_camera_property()
-        supported = camera_info['SupportedVideoFormat']
-        print(f"Supported = {supported}")
-        return [image_types_by_value[s] for s in sorted(supported)]
+        return [image_types_by_value[s] for s in self._readout_types]
 
     def get_sensortype(self):
-        # if not self._camera.get_camera_property()["IsColorCam"]:
-        #     return 0
-        # return self._camera.get_camera_property()["BayerPattern"]
-        return 2  # TODO!!!! it should be variable, this is good only for ASI120MC
+        # ASCOM: 0 = monochrome, 1 = color (not mosaic), 2 = RGGB, actual pattern is given by Bayer offsets
+        image_type = self._roi_format[3]
+        if not self._property["IsColorCam"] or image_type == asi.ASI_IMG_Y8:
+            return 0
+        if image_type in [asi.ASI_IMG_RGB24, IMG_RGB48]:
+            return 1
+        if self._debayer_mode == MODE_CHANNEL:
+            return 0
+        if self._debayer_mode is not None:
+            return 1
+        return 2
 
     def get_setccdtemperature(self):
         pass  # TODO!
@@ -436,7 +621,7 @@ class ZwoCamera(AscomCamera):
     def _set_bins(self, value):
         whbi = self._camera.get_roi_format()
         new_bins = int(value)
-        if new_bins < 0 or new_bins > max(self._camera.get_camera_property()["SupportedBins"]):
+        if new_bins < 0 or new_bins > max(self._property["SupportedBins"]):
             raise Exception
 
         old_bins = whbi[2]
@@ -448,11 +633,8 @@ class ZwoCamera(AscomCamera):
 
     def set_readoutmode(self, value):
         value = int(value)
-        camera_info = self._camera.get_camera_property()
-        supported = camera_info['SupportedVideoFormat']
-
         # list like "RGB8, RAW16"
-        used_list = [image_types_by_value[s] for s in sorted(supported)]
+        used_list = self.get_readoutmodes()
 
         # value of 1 means RAW16 in above example
         image_type_name = used_list[value]
@@ -507,4 +689,39 @@ class ZwoCamera(AscomCamera):
         if self._last_duration != duration:
             self._last_duration = duration
             self._camera.set_control_value(asi.ASI_EXPOSURE, exposure_us)
+        self._exposure_start = time.time()
         self._camera.start_exposure(is_dark=not light)
+        self._exposure_number += 1
+        self._emit(EVENT_EXPOSURE_STARTED, {"Exposure": self._exposure_number, "Duration": duration, "Light": light})
+
+    def wait_for_exposure(self, timeout_s=None, max_poll_s=0.02):
+        """
+        Sleeps until shortly before exposure is expected to be done (as learned by timing model), then polls
+        status with interval growing from FINAL_POLL_S up to max_poll_s.
+        """
+        number, start, duration = self._exposure_number, self._exposure_start, self._last_duration
+        key = tuple(self._roi_format)
+        remaining = self._timing.sleep_until(key, start, duration) - time.time()
+        if remaining > 0:
+            time.sleep(remaining)
+        poll_s = FINAL_POLL_S
+        polls = 1
+        status = self._camera.get_exposure_status()
+        while status == asi.ASI_EXP_WORKING:
+            if self._exposure_number != number:
+                return  # another exposure has been started meanwhile, it is waited for by its own caller
+            if timeout_s is not None and time.time() - start > timeout_s:
+                raise TimeoutError(f"Exposure not done in {timeout_s}s")
+            time.sleep(poll_s)
+            poll_s = min(2 * poll_s, max_poll_s)
+            polls += 1
+            status = self._camera.get_exposure_status()
+        if status == asi.ASI_EXP_IDLE:
+            with self._exposure_lock:
+                read_out = self._readout_exposure == number
+            if read_out:
+                return  # frame has been read out (and reported) meanwhile, exposure did not fail
+        if status != asi.ASI_EXP_SUCCESS:
+            self._emit(EVENT_EXPOSURE_FAILED, {"Exposure": number, "Status": exp_states.get(status, status)})
+            raise asi.ZWO_CaptureError('Could not capture image', status)
+        self._report_ready(number, self._timing.record(key, start, duration, time.time(), polls))